@@ -9,7 +9,7 @@
 
 import math
 from functools import reduce
-from operator import add
+from operator import add, and_
 from collections import OrderedDict
 from typing import Union, Optional
 
@@ -259,19 +259,20 @@ class PhySettings(Settings):
         self.set_attributes(locals())
 
 class GeomSettings(Settings):
-    def __init__(self, bankbits, rowbits, colbits):
+    def __init__(self, bankbits, rowbits, colbits, bankgroupbits=0):
         self.set_attributes(locals())
         self.addressbits = max(rowbits, colbits)
 
 
 class TimingSettings(Settings):
-    def __init__(self, tRP, tRCD, tWR, tWTR, tREFI, tRFC, tFAW, tCCD, tRRD, tRC, tRAS, tZQCS):
+    def __init__(self, tRP, tRCD, tWR, tWTR, tREFI, tRFC, tFAW, tCCD, tRRD, tRC, tRAS, tZQCS,
+                 tRTP=None, tCCD_S=None, tRRD_S=None, tXP=None, tXS=None):
         self.set_attributes(locals())
 
 # Layouts/Interface --------------------------------------------------------------------------------
 
-def cmd_layout(address_width):
-    return [
+def cmd_layout(address_width, len_width=0):
+    layout = [
         ("valid",            1, DIR_M_TO_S),
         ("ready",            1, DIR_S_TO_M),
         ("we",               1, DIR_M_TO_S),
@@ -281,6 +282,9 @@ def cmd_layout(address_width):
         ("wdata_ready",      1, DIR_S_TO_M),
         ("rdata_valid",      1, DIR_S_TO_M)
     ]
+    if len_width:
+        layout += [("len", len_width, DIR_M_TO_S)] # Burst length (beats - 1).
+    return layout
 
 def data_layout(data_width):
     return [
@@ -312,21 +316,28 @@ class LiteDRAMInterface(Record):
         self.address_align = address_align
         self.address_width = settings.geom.rowbits + settings.geom.colbits + rankbits - address_align
         self.data_width    = settings.phy.dfi_databits*settings.phy.nphases
+        self.len_width     = log2_int(settings.cmd_burst_max)
         self.nbanks   = settings.phy.nranks*(2**settings.geom.bankbits)
         self.nranks   = settings.phy.nranks
         self.settings = settings
 
-        layout = [("bank"+str(i), cmd_layout(self.address_width)) for i in range(self.nbanks)]
+        layout = [("bank"+str(i), cmd_layout(self.address_width, self.len_width))
+            for i in range(self.nbanks)]
         layout += data_layout(self.data_width)
         Record.__init__(self, layout)
 
 # Ports --------------------------------------------------------------------------------------------
 
-def cmd_description(address_width):
-    return [
+def cmd_description(address_width, id_width=0, len_width=0):
+    layout = [
         ("we",               1), # Write (1) or Read (0).
         ("addr", address_width)  # Address (in Controller's words).
     ]
+    if id_width:
+        layout += [("id", id_width)] # Read ID (tagged ports).
+    if len_width:
+        layout += [("len", len_width)] # Burst length (beats - 1, burst ports).
+    return layout
 
 def wdata_description(data_width):
     return [
@@ -334,28 +345,39 @@ def wdata_description(data_width):
         ("we",   data_width//8), # Write Data byte enable.
     ]
 
-def rdata_description(data_width):
-    return [("data", data_width)] # Read Data.
+def rdata_description(data_width, id_width=0):
+    layout = [("data", data_width)] # Read Data.
+    if id_width:
+        layout += [("id", id_width)] # Read ID of the command (tagged ports).
+    return layout
 
 class LiteDRAMNativePort(Settings):
-    def __init__(self, mode, address_width, data_width, clock_domain="sys", id=0):
+    def __init__(self, mode, address_width, data_width, clock_domain="sys", id=0, id_width=0,
+        len_width=0):
         self.set_attributes(locals())
 
         self.flush = Signal()
         self.lock  = Signal()
 
-        self.cmd   = stream.Endpoint(cmd_description(address_width))
+        self.cmd   = stream.Endpoint(cmd_description(address_width, id_width, len_width))
         self.wdata = stream.Endpoint(wdata_description(data_width))
-        self.rdata = stream.Endpoint(rdata_description(data_width))
+        self.rdata = stream.Endpoint(rdata_description(data_width, id_width))
 
         # retro-compatibility # FIXME: remove
         self.aw = self.address_width
         self.dw = self.data_width
         self.cd = self.clock_domain
 
-    def get_bank_address(self, bank_bits, cba_shift):
+    def get_bank_address(self, bank_bits, cba_shift, address_mapping="ROW_BANK_COL", rank_bits=0):
         cba_upper = cba_shift + bank_bits
-        return self.cmd.addr[cba_shift:cba_upper]
+        ba = self.cmd.addr[cba_shift:cba_upper]
+        if address_mapping == "ROW_BANK_COL_XOR":
+            # Permutation-based interleaving: bank bits XORed with the row LSBs.
+            ba = ba ^ self.cmd.addr[cba_upper:cba_upper + bank_bits]
+        if address_mapping == "ROW_BANK_RANK_COL" and rank_bits:
+            # Rank bits below bank bits in the address, but in the MSBs of the bank number.
+            ba = Cat(ba[rank_bits:], ba[:rank_bits])
+        return ba
 
     def get_row_column_address(self, bank_bits, rca_bits, cba_shift):
         cba_upper = cba_shift + bank_bits
@@ -391,12 +413,25 @@ class LiteDRAMNativeReadPort(LiteDRAMNativePort):
 class tXXDController(Module):
     def __init__(self, txxd):
         self.valid = valid = Signal()
-        self.ready = ready = Signal(reset=txxd is None)
+        self.ready = ready = Signal(reset=txxd is None or not isinstance(txxd, int))
         ready.attr.add("no_retiming")
 
         # # #
 
-        if txxd is not None:
+        if txxd is not None and not isinstance(txxd, int):
+            # Runtime timing (CSR)
+            count = Signal(len(txxd))
+            self.sync += \
+                If(valid,
+                    count.eq(txxd - 1),
+                    ready.eq(txxd <= 1)
+                ).Elif(~ready,
+                    count.eq(count - 1),
+                    If(count == 1,
+                        ready.eq(1)
+                    )
+                )
+        elif txxd is not None:
             count = Signal(max=max(txxd, 2))
             self.sync += \
                 If(valid,
@@ -435,3 +470,162 @@ class tFAWController(Module):
                         ready.eq(1)
                     )
                 )
+
+
+class TimingScoreboard(Module):
+    """Tracks the earliest time each command can be issued to each bank
+
+    Centralizes the timings between commands to different banks (the timings between commands to
+    the same bank being enforced by the BankMachines). Issued commands are reported with `act`,
+    `read`, `write`, and the scoreboard gives for each bank if an ACT/READ/WRITE/PRE can be issued
+    this cycle:
+     - tRRD/tFAW: ACT to ACT of the same rank
+     - tCCD: CAS to CAS (data bus, shared by the ranks)
+     - tWTR: WRITE to READ of the same rank (measured from the WRITE command)
+     - tRTP: READ to PRE of the same bank
+     - tRTRS: CAS to CAS of a different rank (data bus turnaround between ranks)
+    Each timing is tracked with a counter of the cycles left before the command can be issued.
+
+    With bank groups (DDR4), tCCD/tRRD only apply between banks of the same group (tCCD_L/tRRD_L)
+    and tCCD_S/tRRD_S between banks of different groups. `cas_alternate` then gives the banks that
+    are not in the group of the last CAS, which can be used to favor alternating the bank groups.
+    Similarly, `cas_same_rank` gives the banks of the rank of the last CAS, which can be used to group
+    the CAS to the same rank and avoid the rank switch penalty.
+
+    Parameters
+    ----------
+    nbanks : int
+        Number of banks (including ranks, rank in the MSBs of the bank number)
+    nranks : int
+        Number of ranks
+    ngroups : int
+        Number of bank groups per rank (group in the MSBs of the bank number of the rank)
+    tRRD, tFAW, tCCD, tWTR, tRTP, tCCD_S, tRRD_S, tRTRS : int or None
+        Timings in controller cycles (None: not enforced), all but tFAW can also be given as Signals
+        (runtime timings)
+
+    Attributes
+    ----------
+    act : Signal, in
+        An ACT is issued to bank `act_ba`
+    read : Signal, in
+        A READ is issued to bank `cas_ba`
+    write : Signal, in
+        A WRITE is issued to bank `cas_ba`
+    can_act, can_read, can_write, can_pre : [Signal, ...], out
+        Command can be issued to the bank
+    cas_alternate : [Signal, ...], out
+        Bank is not in the bank group of the last CAS (always 0 without bank groups)
+    cas_same_rank : [Signal, ...], out
+        Bank is in the rank of the last CAS (always 1 with a single rank)
+    """
+    def __init__(self, nbanks, nranks=1, tRRD=None, tFAW=None, tCCD=None, tWTR=None, tRTP=None,
+                 ngroups=1, tCCD_S=None, tRRD_S=None, tRTRS=None):
+        self.act           = Signal()
+        self.act_ba        = Signal(max=max(nbanks, 2))
+        self.read          = Signal()
+        self.write         = Signal()
+        self.cas_ba        = Signal(max=max(nbanks, 2))
+        self.can_act       = [Signal() for b in range(nbanks)]
+        self.can_read      = [Signal() for b in range(nbanks)]
+        self.can_write     = [Signal() for b in range(nbanks)]
+        self.can_pre       = [Signal() for b in range(nbanks)]
+        self.cas_alternate = [Signal() for b in range(nbanks)]
+        self.cas_same_rank = [Signal(reset=1) for b in range(nbanks)]
+
+        # # #
+
+        rank_banks  = nbanks//nranks
+        group_banks = rank_banks//ngroups
+        def rank(ba):
+            return ba[log2_int(rank_banks):] if nranks > 1 else 0
+        def group(ba):
+            # Bank group including the rank, to index all the groups of all the ranks.
+            return ba[log2_int(group_banks):]
+
+        # Without bank groups, the _L timings apply to all the banks.
+        if ngroups == 1:
+            tCCD_S, tRRD_S = tCCD, tRRD
+
+        # tCCD (data bus) --------------------------------------------------------------------------
+        cas        = self.read | self.write
+        tccd_ready = self.countdown(tCCD_S, cas)
+
+        # Per rank: tRRD, tFAW, tWTR ---------------------------------------------------------------
+        for r in range(nranks):
+            rank_act   = self.act   & (rank(self.act_ba) == r)
+            rank_write = self.write & (rank(self.cas_ba) == r)
+            tfawcon    = tFAWController(tFAW)
+            self.submodules += tfawcon
+            self.comb += tfawcon.valid.eq(rank_act)
+            trrd_ready = self.countdown(tRRD_S, rank_act)
+            twtr_ready = self.countdown(tWTR, rank_write)
+            for b in range(r*rank_banks, (r + 1)*rank_banks):
+                self.comb += [
+                    self.can_act[b].eq(trrd_ready & tfawcon.ready),
+                    self.can_read[b].eq(tccd_ready & twtr_ready),
+                    self.can_write[b].eq(tccd_ready),
+                ]
+
+        # Per rank: tRTRS (rank to rank switch) ----------------------------------------------------
+        if nranks > 1:
+            cas_rank     = Signal(max=nranks)
+            trtrs_readys = []
+            self.sync += If(cas, cas_rank.eq(rank(self.cas_ba)))
+            for r in range(nranks):
+                trtrs_readys.append(self.countdown(tRTRS, cas & (rank(self.cas_ba) == r)))
+            for r in range(nranks):
+                others_ready = reduce(and_, [trtrs_readys[o] for o in range(nranks) if o != r])
+                for b in range(r*rank_banks, (r + 1)*rank_banks):
+                    self.comb += [
+                        If(~others_ready,
+                            self.can_read[b].eq(0),
+                            self.can_write[b].eq(0),
+                        ),
+                        self.cas_same_rank[b].eq(cas_rank == r),
+                    ]
+
+        # Per bank group: tCCD_L, tRRD_L -----------------------------------------------------------
+        if ngroups > 1:
+            cas_group = Signal(max=nbanks//group_banks)
+            self.sync += If(cas, cas_group.eq(group(self.cas_ba)))
+            for g in range(nbanks//group_banks):
+                tccd_l_ready = self.countdown(tCCD, cas & (group(self.cas_ba) == g))
+                trrd_l_ready = self.countdown(tRRD, self.act & (group(self.act_ba) == g))
+                for b in range(g*group_banks, (g + 1)*group_banks):
+                    self.comb += [
+                        If(~trrd_l_ready, self.can_act[b].eq(0)),
+                        If(~tccd_l_ready,
+                            self.can_read[b].eq(0),
+                            self.can_write[b].eq(0),
+                        ),
+                        self.cas_alternate[b].eq(cas_group != g),
+                    ]
+
+        # Per bank: tRTP ---------------------------------------------------------------------------
+        for b in range(nbanks):
+            self.comb += self.can_pre[b].eq(self.countdown(tRTP, self.read & (self.cas_ba == b)))
+
+    def countdown(self, t, trigger):
+        # Returns a signal that is low during the `t` cycles following `trigger`.
+        ready = Signal(reset=1)
+        if t is not None and not isinstance(t, int):
+            # Runtime timing (CSR)
+            count = Signal(len(t))
+            self.sync += \
+                If(trigger,
+                    count.eq(Mux(t > 1, t - 1, 0))
+                ).Elif(count != 0,
+                    count.eq(count - 1)
+                )
+            self.comb += ready.eq(count == 0)
+        elif t is not None and t > 1:
+            count = Signal(max=t)
+            self.sync += \
+                If(trigger,
+                    count.eq(t - 1)
+                ).Elif(count != 0,
+                    count.eq(count - 1)
+                )
+            self.comb += ready.eq(count == 0)
+        return ready
@@ -10,6 +10,7 @@
 
 from migen import *
 
+from litex.soc.interconnect import stream
 from litex.soc.interconnect.csr import *
 
 # Bandwidth ----------------------------------------------------------------------------------------
@@ -88,3 +89,169 @@ class Bandwidth(Module, AutoCSR):
                 self.nwrites.status.eq(nwrites_r)
             )
         ]
+
+# PerformanceMonitor -------------------------------------------------------------------------------
+
+class PerformanceMonitor(Module, AutoCSR):
+    """Monitors LiteDRAM controller performance
+
+    This module counts events from the Multiplexer and BankMachines. Counters are free-running, to
+    copy their values to the status registers and restart counting, user must write to the
+    `update` register.
+
+    Parameters
+    ----------
+    dfi : dfi.Interface
+        DFI driven by the Multiplexer, used to count ACT/PRE/REF commands
+    bank_machines : [BankMachine, ...]
+        Bank machines providing row_hit/row_miss/row_conflict events
+    states : {str: Signal(), ...}
+        Multiplexer FSM states to count cycles of (e.g. {"read": fsm.ongoing("READ")})
+    counter_bits : int, in
+        Width of the counters
+
+    Attributes
+    ----------
+    update : CSR, in
+        Copy the counters to the status registers and clear them
+    nactivates, nprecharges, nrefreshes : CSRStatus, out
+        Number of ACT/PRE/REF commands issued
+    bankN_row_hits, bankN_row_misses, bankN_row_conflicts : CSRStatus, out
+        Number of row hits/misses/conflicts on bank N
+    STATE_cycles : CSRStatus, out
+        Number of cycles spent in each of the given Multiplexer FSM states
+    """
+    def __init__(self, dfi, bank_machines, states=None, counter_bits=32):
+        self.update = CSR(name="update")
+        self.counter_bits = counter_bits
+
+        # # #
+
+        # DFI commands
+        activates, precharges, refreshes = [], [], []
+        for phase in dfi.phases:
+            selected = phase.cs_n != (2**len(phase.cs_n) - 1)
+            ras, cas, we = ~phase.ras_n, ~phase.cas_n, ~phase.we_n
+            activates.append(selected  & ras & ~cas & ~we)
+            precharges.append(selected & ras & ~cas &  we)
+            refreshes.append(selected  & ras &  cas & ~we)
+        self.add_counter("nactivates",  activates)
+        self.add_counter("nprecharges", precharges)
+        self.add_counter("nrefreshes",  refreshes)
+
+        # Bank row hits/misses/conflicts
+        for n, bm in enumerate(bank_machines):
+            self.add_counter("bank{}_row_hits".format(n),      [bm.row_hit_event])
+            self.add_counter("bank{}_row_misses".format(n),    [bm.row_miss_event])
+            self.add_counter("bank{}_row_conflicts".format(n), [bm.row_conflict_event])
+
+        # Multiplexer FSM states
+        for name, ongoing in (states or {}).items():
+            self.add_counter("{}_cycles".format(name), [ongoing])
+
+    def add_counter(self, name, events):
+        status  = CSRStatus(self.counter_bits, name=name)
+        counter = Signal(self.counter_bits)
+        incr    = Signal(max=len(events) + 1)
+        setattr(self, name, status)
+        self.comb += incr.eq(sum(events))
+        self.sync += [
+            If(self.update.re,
+                status.status.eq(counter),
+                # don't miss events on update
+                counter.eq(incr)
+            ).Else(
+                counter.eq(counter + incr)
+            )
+        ]
+
+# LatencyHistogram ---------------------------------------------------------------------------------
+
+class LatencyHistogram(Module, AutoCSR):
+    """Measures LiteDRAM port request-to-data latency
+
+    The latency between a command being accepted on the port and its data being transferred
+    (rdata for reads, wdata for writes) is measured and accumulated in power-of-two buckets: bucket
+    0 counts latencies lower than 2, bucket N latencies in [2^N, 2^(N+1)) and the last bucket all
+    the latencies above (latencies are measured modulo 2^16 cycles). Commands are timestamped in a
+    FIFO of `depth` entries, commands issued while it is full are not measured. As for the
+    PerformanceMonitor, user must write to the `update` register to copy the histogram to the status
+    registers and clear it.
+
+    Parameters
+    ----------
+    port : LiteDRAMNativePort
+        Port to monitor (sys clock domain)
+    nbuckets : int, in
+        Number of histogram buckets
+    depth : int, in
+        Number of outstanding commands that can be measured
+    counter_bits : int, in
+        Width of the bucket counters
+
+    Attributes
+    ----------
+    update : CSR, in
+        Copy the histogram to the status registers and clear it
+    read_bucketN, write_bucketN : CSRStatus, out
+        Number of reads/writes with a latency in bucket N
+    """
+    def __init__(self, port, nbuckets=8, depth=16, counter_bits=32):
+        self.update = CSR(name="update")
+
+        # # #
+
+        assert nbuckets <= 16
+        timestamp = Signal(16)
+        self.sync += timestamp.eq(timestamp + 1)
+
+        cmd_accept = port.cmd.valid & port.cmd.ready
+        if port.mode in ["both", "read"]:
+            self.add_histogram("read", timestamp, nbuckets, depth, counter_bits,
+                start = cmd_accept & ~port.cmd.we,
+                end   = port.rdata.valid & port.rdata.ready)
+        if port.mode in ["both", "write"]:
+            self.add_histogram("write", timestamp, nbuckets, depth, counter_bits,
+                start = cmd_accept & port.cmd.we,
+                end   = port.wdata.valid & port.wdata.ready)
+
+    def add_histogram(self, name, timestamp, nbuckets, depth, counter_bits, start, end):
+        # Commands and data are in order: tag commands/data with sequence numbers to only measure
+        # the data of the commands that have been timestamped.
+        seq_bits  = 16
+        start_seq = Signal(seq_bits)
+        end_seq   = Signal(seq_bits)
+        self.sync += [
+            If(start, start_seq.eq(start_seq + 1)),
+            If(end,   end_seq.eq(end_seq + 1)),
+        ]
+
+        fifo = stream.SyncFIFO([("seq", seq_bits), ("timestamp", len(timestamp))], depth)
+        self.submodules += fifo
+        self.comb += [
+            fifo.sink.valid.eq(start),
+            fifo.sink.seq.eq(start_seq),
+            fifo.sink.timestamp.eq(timestamp),
+            fifo.source.ready.eq(end & (fifo.source.seq == end_seq)),
+        ]
+
+        # Latency and bucket (position of the MSB, saturated)
+        latency = Signal(len(timestamp))
+        bucket  = Signal(max=nbuckets)
+        self.comb += latency.eq(timestamp - fifo.source.timestamp)
+        for i in range(1, nbuckets):
+            self.comb += If(latency[i:] != 0, bucket.eq(i))
+
+        for i in range(nbuckets):
+            status  = CSRStatus(counter_bits, name="{}_bucket{}".format(name, i))
+            counter = Signal(counter_bits)
+            setattr(self, "{}_bucket{}".format(name, i), status)
+            sample  = fifo.source.valid & fifo.source.ready & (bucket == i)
+            self.sync += [
+                If(self.update.re,
+                    status.status.eq(counter),
+                    counter.eq(sample)
+                ).Elif(sample,
+                    counter.eq(counter + 1)
+                )
+            ]
@@ -8,8 +8,12 @@
 """LiteDRAM BankMachine (Rows/Columns management)."""
 
 import math
+from functools import reduce
+from operator import or_
 
 from migen import *
+from migen.genlib.misc import WaitTimer
+from migen.genlib.roundrobin import *
 
 from litex.soc.interconnect import stream
 
@@ -36,6 +40,309 @@ class _AddressSlicer:
         split = self.colbits - self.address_align
         return Cat(Replicate(0, self.address_align), address[:split])
 
+# CommandReorderBuffer -----------------------------------------------------------------------------
+
+class _CommandReorderBuffer(Module):
+    """Reorder window for BankMachine requests (FR-FCFS)
+
+    Holds up to `depth` requests (oldest in slot 0) and presents on `source`
+    the request that should be served next: the oldest eligible request that
+    hits the currently opened row, or the oldest request when there is no row
+    hit. Served requests are removed and younger ones are shifted down.
+
+    Requests in a BankMachine all come from a single master (see the lock
+    mechanism in LiteDRAMCrossbar) and LiteDRAMNativePort returns data in
+    order, so a request is only eligible if no older request has the same
+    direction (reads stay ordered with reads, writes with writes) or targets
+    the same address (no read/write hazards). Once the oldest request has been
+    bypassed `max_age` times, it is forced to be served next to avoid
+    starvation.
+
+    Parameters
+    ----------
+    layout : list
+        Layout of the requests (must contain "we" and "addr")
+    depth : int
+        Number of requests in the reorder window
+    max_age : int
+        Number of times the oldest request can be bypassed
+    slicer : _AddressSlicer
+        Used to extract row from request address
+    row : Signal, in
+        Currently opened row
+    row_opened : Signal, in
+        Indicates that `row` is opened
+
+    Attributes
+    ----------
+    sink : Endpoint(layout)
+        Requests to be queued
+    source : Endpoint(layout)
+        Request selected to be served next
+    pending : Signal, out
+        There are other requests than the selected one in the window
+    pending_hit : Signal, out
+        One of the other requests targets the same row as the selected one
+    """
+    def __init__(self, layout, depth, max_age, slicer, row, row_opened):
+        assert depth >= 1
+        assert max_age >= 1
+        self.sink        = sink   = stream.Endpoint(layout)
+        self.source      = source = stream.Endpoint(layout)
+        self.pending     = Signal()
+        self.pending_hit = Signal()
+
+        # # #
+
+        level = Signal(max=depth + 1)
+        we    = [Signal()               for i in range(depth)]
+        addr  = [Signal(len(sink.addr)) for i in range(depth)]
+        valid = [level > i              for i in range(depth)]
+
+        # Eligibility / Row hits -------------------------------------------------------------------
+        eligible = Signal(depth)
+        hits     = Signal(depth)
+        for i in range(depth):
+            blocked = 0
+            for j in range(i):
+                blocked = blocked | (valid[j] & ((we[j] == we[i]) | (addr[j] == addr[i])))
+            self.comb += [
+                eligible[i].eq(valid[i] & ~blocked),
+                hits[i].eq(eligible[i] & row_opened & (slicer.row(addr[i]) == row)),
+            ]
+
+        # Selection --------------------------------------------------------------------------------
+        age = Signal(max=max_age + 1)
+        sel = Signal(max=max(depth, 2))
+        # Oldest row hit first, then oldest request.
+        for i in reversed(range(depth)):
+            self.comb += If(hits[i], sel.eq(i))
+        self.comb += If(age == max_age, sel.eq(0))
+
+        self.comb += [
+            source.valid.eq(level != 0),
+            source.we.eq(Array(we)[sel]),
+            source.addr.eq(Array(addr)[sel]),
+        ]
+        self.comb += self.pending.eq(level > 1)
+        for i in range(depth):
+            same_row = [valid[j] & (slicer.row(addr[j]) == slicer.row(addr[i]))
+                for j in range(depth) if j != i]
+            self.comb += If(sel == i, self.pending_hit.eq(reduce(or_, same_row, 0)))
+
+        # Age (starvation avoidance) ---------------------------------------------------------------
+        take = Signal()
+        self.comb += take.eq(source.valid & source.ready)
+        self.sync += If(take,
+            If(sel == 0,
+                age.eq(0)
+            ).Else(
+                age.eq(age + 1)
+            )
+        )
+
+        # Insertion / Removal ----------------------------------------------------------------------
+        put = Signal()
+        self.comb += [
+            sink.ready.eq((level != depth) | take),
+            put.eq(sink.valid & sink.ready),
+        ]
+        self.sync += level.eq(level + put - take)
+        for i in range(depth):
+            shift = []
+            if i < depth - 1:
+                shift = [we[i].eq(we[i + 1]), addr[i].eq(addr[i + 1])]
+            self.sync += \
+                If(put & (level - take == i),
+                    we[i].eq(sink.we),
+                    addr[i].eq(sink.addr)
+                ).Elif(take & (sel <= i),
+                    *shift
+                )
+
+# CommandPool --------------------------------------------------------------------------------------
+
+class CommandPool(Module):
+    """Request pool shared between BankMachines
+
+    Instead of giving every BankMachine a private `cmd_buffer_depth` FIFO, requests of all banks
+    are stored in a single memory of `depth` entries. Each bank owns a linked list of entries
+    (head/tail pointers and a `next` memory), unused entries are kept in a free list. The pool
+    accepts one request and forwards one request per cycle, which matches the rate at which the
+    Multiplexer can issue CAS commands.
+
+    Request payloads are stored in a memory with a synchronous read port (block RAM), only the
+    link pointers use asynchronous reads. The next request of each bank is presented on its
+    source, directly from the memory read port when it has just been read or from a per-bank head
+    register otherwise. BankMachines built with `settings.cmd_pool_depth` use it in place of their
+    `cmd_buffer_lookahead` FIFO: it is the request following the one being served, used to decide
+    on auto-precharge.
+
+    To avoid a single busy bank taking the whole pool, each bank can hold at most `bank_limit`
+    entries.
+
+    Parameters
+    ----------
+    nbanks : int
+        Number of BankMachines
+    address_width : int
+        LiteDRAMInterface address width
+    depth : int
+        Total number of entries in the pool
+    bank_limit : int
+        Maximum number of entries owned by a single bank
+
+    Attributes
+    ----------
+    sinks : [Endpoint(cmd_description), ...]
+        Requests from LiteDRAMCrossbar (one per bank)
+    sources : [Endpoint(cmd_description), ...]
+        Next request of each bank, to the BankMachines (one per bank)
+    pending : [Signal, ...], out
+        Bank has requests in the pool, used to hold the LiteDRAMCrossbar lock
+    """
+    def __init__(self, nbanks, address_width, depth, bank_limit=None):
+        if bank_limit is None:
+            bank_limit = depth
+        assert depth >= 2
+        assert 1 <= bank_limit <= depth
+        self.sinks   = sinks   = [stream.Endpoint(cmd_description(address_width)) for n in range(nbanks)]
+        self.sources = sources = [stream.Endpoint(cmd_description(address_width)) for n in range(nbanks)]
+        self.pending = pending = [Signal() for n in range(nbanks)]
+
+        # # #
+
+        # Storage ----------------------------------------------------------------------------------
+        data_mem = Memory(1 + address_width, depth)
+        next_mem = Memory(bits_for(depth - 1), depth)
+        free_mem = Memory(bits_for(depth - 1), depth, init=list(range(depth)))
+        data_wrport = data_mem.get_port(write_capable=True)
+        data_rdport = data_mem.get_port()
+        next_wrport = next_mem.get_port(write_capable=True)
+        next_rdport = next_mem.get_port(async_read=True)
+        free_wrport = free_mem.get_port(write_capable=True)
+        free_rdport = free_mem.get_port(async_read=True)
+        self.specials += data_mem, next_mem, free_mem
+        self.specials += data_wrport, data_rdport, next_wrport, next_rdport, free_wrport, free_rdport
+
+        head  = Array(Signal(max=depth) for n in range(nbanks))
+        tail  = Array(Signal(max=depth) for n in range(nbanks))
+        count = Array(Signal(max=bank_limit + 1) for n in range(nbanks))
+
+        free_rdptr = Signal(max=depth)
+        free_wrptr = Signal(max=depth)
+        free_count = Signal(max=depth + 1, reset=depth)
+
+        # Push (LiteDRAMCrossbar -> pool) ----------------------------------------------------------
+        push       = Signal()
+        push_bank  = Signal(max=max(nbanks, 2))
+        push_index = Signal(max=depth)
+        push_req   = [sinks[n].valid & (count[n] != bank_limit) for n in range(nbanks)]
+        push_rr    = RoundRobin(nbanks, SP_CE)
+        self.submodules += push_rr
+        self.comb += [
+            push_rr.request.eq(Cat(*push_req)),
+            push_rr.ce.eq(1),
+            push_bank.eq(push_rr.grant),
+            push.eq(Array(push_req)[push_bank] & (free_count != 0)),
+            push_index.eq(free_rdport.dat_r),
+            free_rdport.adr.eq(free_rdptr),
+        ]
+        for n in range(nbanks):
+            self.comb += sinks[n].ready.eq(push & (push_bank == n))
+        self.comb += [
+            data_wrport.adr.eq(push_index),
+            data_wrport.dat_w.eq(Cat(Array(sinks)[push_bank].we, Array(sinks)[push_bank].addr)),
+            data_wrport.we.eq(push),
+            # Link the new entry behind the current tail of the bank.
+            next_wrport.adr.eq(tail[push_bank]),
+            next_wrport.dat_w.eq(push_index),
+            next_wrport.we.eq(push & (count[push_bank] != 0)),
+        ]
+        self.sync += If(push,
+            free_rdptr.eq(Mux(free_rdptr == depth - 1, 0, free_rdptr + 1)),
+            tail[push_bank].eq(push_index),
+            If(count[push_bank] == 0,
+                head[push_bank].eq(push_index)
+            )
+        )
+
+        # Pop (pool -> BankMachines) ---------------------------------------------------------------
+        # An entry is popped when the next request of its bank is not presented or is taken.
+        pop         = Signal()
+        pop_bank    = Signal(max=max(nbanks, 2))
+        pop_valid_d = Signal()
+        pop_bank_d  = Signal(max=max(nbanks, 2))
+        inflight    = [pop_valid_d & (pop_bank_d == n) for n in range(nbanks)]
+        pop_req     = [(count[n] != 0) & (~sources[n].valid | sources[n].ready)
+            for n in range(nbanks)]
+        pop_rr      = RoundRobin(nbanks, SP_CE)
+        self.submodules += pop_rr
+        self.comb += [
+            pop_rr.request.eq(Cat(*pop_req)),
+            pop_rr.ce.eq(1),
+            pop_bank.eq(pop_rr.grant),
+            pop.eq(Array(pop_req)[pop_bank]),
+            data_rdport.adr.eq(head[pop_bank]),
+            next_rdport.adr.eq(head[pop_bank]),
+        ]
+        self.sync += [
+            pop_valid_d.eq(pop),
+            pop_bank_d.eq(pop_bank),
+            If(pop,
+                If(push & (push_bank == pop_bank) & (count[pop_bank] == 1),
+                    # The list only contains the popped entry, the pushed one becomes the head.
+                    head[pop_bank].eq(push_index)
+                ).Else(
+                    head[pop_bank].eq(next_rdport.dat_r)
+                )
+            )
+        ]
+
+        # Next request of each bank: popped entry (memory read port) or head register.
+        for n in range(nbanks):
+            head_valid = Signal()
+            head_we    = Signal()
+            head_addr  = Signal(address_width)
+            self.comb += [
+                sources[n].valid.eq(inflight[n] | head_valid),
+                If(inflight[n],
+                    sources[n].we.eq(data_rdport.dat_r[0]),
+                    sources[n].addr.eq(data_rdport.dat_r[1:])
+                ).Else(
+                    sources[n].we.eq(head_we),
+                    sources[n].addr.eq(head_addr)
+                )
+            ]
+            self.sync += \
+                If(sources[n].ready,
+                    head_valid.eq(0)
+                ).Elif(inflight[n],
+                    head_valid.eq(1),
+                    head_we.eq(sources[n].we),
+                    head_addr.eq(sources[n].addr)
+                )
+
+        # Release popped entries to the free list --------------------------------------------------
+        self.comb += [
+            free_wrport.adr.eq(free_wrptr),
+            free_wrport.dat_w.eq(head[pop_bank]),
+            free_wrport.we.eq(pop),
+        ]
+        self.sync += [
+            If(pop,
+                free_wrptr.eq(Mux(free_wrptr == depth - 1, 0, free_wrptr + 1))
+            ),
+            free_count.eq(free_count - push + pop),
+        ]
+
+        # Occupancy --------------------------------------------------------------------------------
+        for n in range(nbanks):
+            pushed = push & (push_bank == n)
+            popped = pop  & (pop_bank  == n)
+            self.sync += count[n].eq(count[n] + pushed - popped)
+            self.comb += pending[n].eq((count[n] != 0) | sources[n].valid)
+
 # BankMachine --------------------------------------------------------------------------------------
 
 class BankMachine(Module):
@@ -55,6 +362,24 @@ class BankMachine(Module):
     can be "looked ahead", and auto-precharge can be performed (if enabled in
     settings).
 
+    Optionally (`settings.cmd_reorder_depth`), `cmd_buffer` is replaced by
+    a reorder window that serves requests hitting the opened row first (see
+    _CommandReorderBuffer), `settings.cmd_reorder_age` limits how many
+    times the oldest request can be bypassed.
+
+    With `settings.page_policy = "adaptive"`, rows are precharged early when the
+    bank is idle and the row-hit history suggests that the next access will be
+    a row conflict (`settings.page_idle_timeout`, `settings.page_hit_threshold`).
+
+    With `settings.cmd_burst_max` > 1, a request can be a burst of up to
+    `cmd_burst_max` beats (cmd_layout.len + 1) at consecutive addresses in the
+    same row: it occupies the BankMachine as a single request and its CASes
+    are issued back to back, with a wdata_ready/rdata_valid for each beat.
+
+    With `settings.cmd_pool_depth`, requests come from a CommandPool shared
+    between BankMachines: `cmd_buffer_lookahead` is not instantiated and the
+    next request of the bank presented by the pool on `req` is the lookahead.
+
     Lock (cmd_layout.lock) is used to synchronise with LiteDRAMCrossbar. It is
     being held when:
      - there is a valid command awaiting in `cmd_buffer_lookahead` - this buffer
@@ -85,11 +410,20 @@ class BankMachine(Module):
         Indicates that refresh permission has been granted, satisfying timings
     cmd : Endpoint(cmd_request_rw_layout)
         Stream of commands to the Multiplexer
+    row_hit_event : Signal(), out
+        Pulses on each row hit (performance monitoring)
+    row_miss_event : Signal(), out
+        Pulses on each row miss (performance monitoring)
+    row_conflict_event : Signal(), out
+        Pulses on each row conflict (performance monitoring)
     """
     def __init__(self, n, address_width, address_align, nranks, settings):
-        self.req = req = Record(cmd_layout(address_width))
+        self.req = req = Record(cmd_layout(address_width, log2_int(settings.cmd_burst_max)))
         self.refresh_req = refresh_req = Signal()
         self.refresh_gnt = refresh_gnt = Signal()
+        self.row_hit_event      = Signal()
+        self.row_miss_event     = Signal()
+        self.row_conflict_event = Signal()
 
         a  = settings.geom.addressbits
         ba = settings.geom.bankbits + log2_int(nranks)
@@ -99,25 +433,72 @@ class BankMachine(Module):
 
         auto_precharge = Signal()
 
+        slicer = _AddressSlicer(settings.geom.colbits, address_align)
+
+        row        = Signal(settings.geom.rowbits)
+        row_opened = Signal()
+
         # Command buffer ---------------------------------------------------------------------------
+        burst_bits           = log2_int(settings.cmd_burst_max)
         cmd_buffer_layout    = [("we", 1), ("addr", len(req.addr))]
-        cmd_buffer_lookahead = stream.SyncFIFO(
-            cmd_buffer_layout, settings.cmd_buffer_depth,
-            buffered=settings.cmd_buffer_buffered)
-        cmd_buffer = stream.Buffer(cmd_buffer_layout) # 1 depth buffer to detect row change
-        self.submodules += cmd_buffer_lookahead, cmd_buffer
+        if burst_bits:
+            if settings.cmd_burst_max > 2**(settings.geom.colbits - address_align):
+                raise ValueError("Command bursts can't be longer than a DRAM row")
+            if settings.cmd_reorder_depth or getattr(settings, "cmd_pool_depth", 0):
+                raise ValueError("Command bursts can't be used with command reordering/pool")
+            cmd_buffer_layout += [("len", burst_bits)]
+        if getattr(settings, "cmd_pool_depth", 0):
+            # Requests come from the CommandPool, whose next request for this bank is directly the
+            # lookahead: no per-bank FIFO.
+            lookahead = stream.Endpoint(cmd_buffer_layout)
+            self.comb += req.connect(lookahead, keep={"valid", "ready", "we", "addr"})
+        else:
+            cmd_buffer_lookahead = stream.SyncFIFO(
+                cmd_buffer_layout, settings.cmd_buffer_depth,
+                buffered=settings.cmd_buffer_buffered)
+            self.submodules += cmd_buffer_lookahead
+            self.comb += req.connect(cmd_buffer_lookahead.sink,
+                keep={"valid", "ready", "we", "addr", "len"})
+            lookahead = cmd_buffer_lookahead.source
+        if settings.cmd_reorder_depth:
+            # Reorder window to serve row hits first (FR-FCFS)
+            cmd_buffer = _CommandReorderBuffer(cmd_buffer_layout,
+                depth      = settings.cmd_reorder_depth,
+                max_age    = settings.cmd_reorder_age,
+                slicer     = slicer,
+                row        = row,
+                row_opened = row_opened)
+        else:
+            cmd_buffer = stream.Buffer(cmd_buffer_layout) # 1 depth buffer to detect row change
+        self.submodules += cmd_buffer
+        cmd_addr  = Signal(len(req.addr)) # Address of the current beat.
+        burst_end = Signal()              # Last beat of the command.
         self.comb += [
-            req.connect(cmd_buffer_lookahead.sink, keep={"valid", "ready", "we", "addr"}),
-            cmd_buffer_lookahead.source.connect(cmd_buffer.sink),
-            cmd_buffer.source.ready.eq(req.wdata_ready | req.rdata_valid),
-            req.lock.eq(cmd_buffer_lookahead.source.valid | cmd_buffer.source.valid),
+            lookahead.connect(cmd_buffer.sink),
+            cmd_buffer.source.ready.eq((req.wdata_ready | req.rdata_valid) & burst_end),
+            req.lock.eq(lookahead.valid | cmd_buffer.source.valid),
         ]
 
-        slicer = _AddressSlicer(settings.geom.colbits, address_align)
+        # Command bursts ---------------------------------------------------------------------------
+        # A command of len + 1 beats issues its CASes at consecutive columns (the burst stays in the
+        # row) and leaves the command buffer with the last one.
+        if burst_bits:
+            beat = Signal(burst_bits)
+            self.comb += [
+                cmd_addr.eq(cmd_buffer.source.addr + beat),
+                burst_end.eq(beat == cmd_buffer.source.len),
+            ]
+            self.sync += \
+                If(req.wdata_ready | req.rdata_valid,
+                    beat.eq(Mux(burst_end, 0, beat + 1))
+                )
+        else:
+            self.comb += [
+                cmd_addr.eq(cmd_buffer.source.addr),
+                burst_end.eq(1),
+            ]
 
         # Row tracking -----------------------------------------------------------------------------
-        row        = Signal(settings.geom.rowbits)
-        row_opened = Signal()
         row_hit    = Signal()
         row_open   = Signal()
         row_close  = Signal()
@@ -137,7 +518,7 @@ class BankMachine(Module):
             If(row_col_n_addr_sel,
                 cmd.a.eq(slicer.row(cmd_buffer.source.addr))
             ).Else(
-                cmd.a.eq((auto_precharge << 10) | slicer.col(cmd_buffer.source.addr))
+                cmd.a.eq((auto_precharge << 10) | slicer.col(cmd_addr))
             )
         ]
 
@@ -158,18 +539,84 @@ class BankMachine(Module):
         # Auto Precharge generation ----------------------------------------------------------------
         # generate auto precharge when current and next cmds are to different rows
         if settings.with_auto_precharge:
-            self.comb += \
-                If(cmd_buffer_lookahead.source.valid & cmd_buffer.source.valid,
-                    If(slicer.row(cmd_buffer_lookahead.source.addr) !=
-                       slicer.row(cmd_buffer.source.addr),
-                        auto_precharge.eq(row_close == 0)
+            if settings.cmd_reorder_depth:
+                # With reordering, only close the row when none of the queued requests targets it.
+                lookahead_hit = Signal()
+                self.comb += lookahead_hit.eq(lookahead.valid &
+                    (slicer.row(lookahead.addr) == slicer.row(cmd_buffer.source.addr)))
+                self.comb += \
+                    If(cmd_buffer.source.valid & (lookahead.valid | cmd_buffer.pending),
+                        If(~cmd_buffer.pending_hit & ~lookahead_hit,
+                            auto_precharge.eq(row_close == 0)
+                        )
+                    )
+            else:
+                self.comb += \
+                    If(lookahead.valid & cmd_buffer.source.valid & burst_end,
+                        If(slicer.row(lookahead.addr) !=
+                           slicer.row(cmd_buffer.source.addr),
+                            auto_precharge.eq(row_close == 0)
+                        )
+                    )
+
+        # Row hit/miss/conflict events -------------------------------------------------------------
+        # A CAS is a row hit when the row has already been accessed since its activation, a request
+        # finding the bank precharged is a row miss and one finding another row opened a conflict.
+        row_accessed = Signal()
+        row_hit_cas  = Signal()
+        row_miss     = Signal()
+        row_conflict = Signal()
+        self.comb += [
+            row_hit_cas.eq(cmd.valid & cmd.ready & cmd.cas & row_accessed),
+            self.row_hit_event.eq(row_hit_cas),
+            self.row_miss_event.eq(row_miss),
+            self.row_conflict_event.eq(row_conflict),
+        ]
+        self.sync += \
+            If(row_open,
+                row_accessed.eq(0)
+            ).Elif(cmd.valid & cmd.ready & cmd.cas,
+                row_accessed.eq(1)
+            )
+
+        # Page policy ------------------------------------------------------------------------------
+        # With the adaptive page policy, a row-hit history counter is incremented on row hits (and
+        # when an idle-closed row gets re-opened) and decremented on row conflicts. When the bank is
+        # idle for `page_idle_timeout` cycles and the history is below `page_hit_threshold`, the row
+        # is precharged early so that the next (random) access does not pay tRP.
+        assert settings.page_policy in ["open", "adaptive"]
+        page_close = Signal()
+        if settings.page_policy == "adaptive":
+            assert settings.page_hit_threshold >= 1
+            history_max  = 2*settings.page_hit_threshold - 1
+            history      = Signal(max=history_max + 1)
+            row_reopened = Signal()
+            closed_idle  = Signal()
+            self.comb += row_reopened.eq(row_open & closed_idle & (row == slicer.row(cmd_buffer.source.addr)))
+            self.sync += [
+                If(row_hit_cas | row_reopened,
+                    If(history != history_max,
+                        history.eq(history + 1)
+                    )
+                ).Elif(row_conflict,
+                    If(history != 0,
+                        history.eq(history - 1)
                     )
                 )
+            ]
+
+            idle = Signal()
+            self.comb += idle.eq(~req.valid & ~lookahead.valid & ~cmd_buffer.source.valid)
+            self.submodules.idle_timer = idle_timer = WaitTimer(settings.page_idle_timeout)
+            self.comb += [
+                idle_timer.wait.eq(idle & row_opened),
+                page_close.eq(idle_timer.done & (history < settings.page_hit_threshold)),
+            ]
 
         # Control and command generation FSM -------------------------------------------------------
         # Note: tRRD, tFAW, tCCD, tWTR timings are enforced by the multiplexer
         self.submodules.fsm = fsm = FSM()
-        fsm.act("REGULAR",
+        regular = \
             If(refresh_req,
                 NextState("REFRESH")
             ).Elif(cmd_buffer.source.valid,
@@ -189,13 +636,19 @@ class BankMachine(Module):
                            NextState("AUTOPRECHARGE")
                         )
                     ).Else(  # row_opened & ~row_hit
+                        row_conflict.eq(1),
                         NextState("PRECHARGE")
                     )
                 ).Else(  # ~row_opened
+                    row_miss.eq(1),
                     NextState("ACTIVATE")
                 )
             )
-        )
+        if settings.page_policy == "adaptive":
+            regular = regular.Elif(page_close,
+                NextState("IDLEPRECHARGE")
+            )
+        fsm.act("REGULAR", regular)
         fsm.act("PRECHARGE",
             # Note: we are presenting the column address, A10 is always low
             If(twtpcon.ready & trascon.ready,
@@ -237,5 +690,44 @@ class BankMachine(Module):
                 NextState("REGULAR")
             )
         )
-        fsm.delayed_enter("TRP", "ACTIVATE", settings.timing.tRP - 1)
-        fsm.delayed_enter("TRCD", "REGULAR", settings.timing.tRCD - 1)
+        if settings.page_policy == "adaptive":
+            fsm.act("IDLEPRECHARGE",
+                # Note: no request is pending, A10 is always low
+                If(twtpcon.ready & trascon.ready,
+                    cmd.valid.eq(1),
+                    If(cmd.ready,
+                        NextState("IDLETRP")
+                    ),
+                    cmd.ras.eq(1),
+                    cmd.we.eq(1),
+                    cmd.is_cmd.eq(1)
+                ),
+                row_close.eq(1)
+            )
+            self.sync += \
+                If(fsm.ongoing("IDLEPRECHARGE"),
+                    closed_idle.eq(1)
+                ).Elif(row_open,
+                    closed_idle.eq(0)
+                )
+            self.delayed_enter(fsm, "IDLETRP", "REGULAR", settings.timing.tRP - 1)
+        self.delayed_enter(fsm, "TRP", "ACTIVATE", settings.timing.tRP - 1)
+        self.delayed_enter(fsm, "TRCD", "REGULAR", settings.timing.tRCD - 1)
+
+    def delayed_enter(self, fsm, name, target, delay):
+        # FSM.delayed_enter, also accepting runtime timings (CSRs).
+        if isinstance(delay, int):
+            fsm.delayed_enter(name, target, delay)
+        else:
+            count = Signal(len(delay))
+            self.sync += \
+                If(fsm.ongoing(name),
+                    count.eq(count + 1)
+                ).Else(
+                    count.eq(0)
+                )
+            fsm.act(name,
+                If(count + 1 >= delay,
+                    NextState(target)
+                )
+            )
@@ -7,12 +7,16 @@
 
 """LiteDRAM Controller."""
 
+import copy
+
 from migen import *
 
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage
+
 from litedram.common import *
 from litedram.phy import dfi
 from litedram.core.refresher import Refresher
-from litedram.core.bankmachine import BankMachine
+from litedram.core.bankmachine import BankMachine, CommandPool
 from litedram.core.multiplexer import Multiplexer
 
 # Settings -----------------------------------------------------------------------------------------
@@ -23,12 +27,55 @@ class ControllerSettings(Settings):
         cmd_buffer_depth    = 8,
         cmd_buffer_buffered = False,
 
+        # Shared command pool, replacing the per-bank cmd_buffer_depth FIFOs (disabled when depth
+        # is 0, bank limit defaults to the pool depth)
+        cmd_pool_depth      = 0,
+        cmd_pool_bank_limit = None,
+
+        # Command reordering (FR-FCFS, disabled when depth is 0)
+        cmd_reorder_depth   = 0,
+        cmd_reorder_age     = 16,
+
+        # Command bursts (max beats of a crossbar command, power of 2 up to a DRAM row, 1: disabled)
+        cmd_burst_max       = 1,
+
+        # Number of command choosers (>1: additional PRE per cycle on free DFI phases, ACTs and CAS
+        # are still limited to one per cycle)
+        cmd_choosers        = 1,
+
+        # Registered command arbitration (+1 cycle of command latency, for higher sys_clk)
+        with_cmd_pipeline   = False,
+
         # Read/Write times
         read_time           = 32,
         write_time          = 16,
 
-        # Bandwidth
+        # Read/Write turnaround (write draining disabled when high watermark is None)
+        write_drain_high    = None,
+        write_drain_low     = 0,
+        with_fast_rtw       = False,
+
+        # Read priority (writes held until the drain high watermark or the write age limit)
+        read_priority       = False,
+        write_age_limit     = 64,
+
+        # Runtime CSRs for read/write times, write drain watermarks and write age limit
+        with_sched_csrs     = False,
+
+        # Multi-rank (rank switch penalty in DRAM clocks, ODT driven on READs/WRITEs only)
+        rank_switch_penalty = 2,
+        with_dynamic_odt    = False,
+
+        # Low power (idle cycles before precharge power-down/self-refresh entry, None: disabled)
+        powerdown_timeout   = None,
+        selfrefresh_timeout = None,
+
+        # Runtime CSRs for the DRAM timings (reset to the module timings)
+        with_timing_csrs    = False,
+
+        # Bandwidth / Performance monitor
         with_bandwidth      = False,
+        with_perfmon        = False,
 
         # Refresh
         with_refresh        = True,
@@ -39,10 +86,41 @@ class ControllerSettings(Settings):
         # Auto-Precharge
         with_auto_precharge = True,
 
-        # Address mapping
+        # Page policy ("open" or "adaptive")
+        page_policy         = "open",
+        page_idle_timeout   = 16,
+        page_hit_threshold  = 2,
+
+        # Address mapping (ROW_BANK_COL, BANK_ROW_COL, ROW_BANK_COL_XOR, ROW_BANK_RANK_COL)
         address_mapping     = "ROW_BANK_COL"):
         self.set_attributes(locals())
 
+# Timing CSRs --------------------------------------------------------------------------------------
+
+class TimingCSRs(Module, AutoCSR):
+    """Runtime DRAM timings
+
+    Turns the DRAM timings into CSRs (in controller cycles, reset to the module timings) so that they
+    can be tuned without rebuilding the gateware. `timing_settings` is a copy of the given timing
+    settings where these timings are replaced by the CSR storages; tFAW, tZQCS, tXP/tXS and the
+    DDR4 bank group timings remain static.
+    """
+    timings = ["tRP", "tRCD", "tWR", "tWTR", "tREFI", "tRFC", "tCCD", "tRRD", "tRC", "tRAS", "tRTP"]
+
+    def __init__(self, timing_settings):
+        self.timing_settings = copy.copy(timing_settings)
+
+        # # #
+
+        for name in self.timings:
+            value = getattr(timing_settings, name, None)
+            if value is None:
+                continue
+            # Allow timings up to twice the module timings (e.g. faster clock).
+            csr = CSRStorage(max(bits_for(2*value), 8), reset=value, name="timing_" + name.lower())
+            setattr(self, "_" + name.lower(), csr)
+            setattr(self.timing_settings, name, csr.storage)
+
 # Controller ---------------------------------------------------------------------------------------
 
 class LiteDRAMController(Module):
@@ -60,6 +138,11 @@ class LiteDRAMController(Module):
         self.settings.geom   = geom_settings
         self.settings.timing = timing_settings
 
+        # Timing CSRs ------------------------------------------------------------------------------
+        if self.settings.with_timing_csrs:
+            self.submodules.timing_csrs = TimingCSRs(timing_settings)
+            self.settings.timing = self.timing_csrs.timing_settings
+
         nranks = phy_settings.nranks
         nbanks = 2**geom_settings.bankbits
 
@@ -92,7 +175,33 @@ class LiteDRAMController(Module):
                 settings      = self.settings)
             bank_machines.append(bank_machine)
             self.submodules += bank_machine
-            self.comb += getattr(interface, "bank"+str(n)).connect(bank_machine.req)
+
+        # Command pool -----------------------------------------------------------------------------
+        if self.settings.cmd_pool_depth:
+            self.submodules.cmd_pool = cmd_pool = CommandPool(
+                nbanks        = len(bank_machines),
+                address_width = interface.address_width,
+                depth         = self.settings.cmd_pool_depth,
+                bank_limit    = self.settings.cmd_pool_bank_limit)
+        for n, bank_machine in enumerate(bank_machines):
+            req = getattr(interface, "bank"+str(n))
+            if self.settings.cmd_pool_depth:
+                sink, source = cmd_pool.sinks[n], cmd_pool.sources[n]
+                self.comb += [
+                    sink.valid.eq(req.valid),
+                    req.ready.eq(sink.ready),
+                    sink.we.eq(req.we),
+                    sink.addr.eq(req.addr),
+                    bank_machine.req.valid.eq(source.valid),
+                    source.ready.eq(bank_machine.req.ready),
+                    bank_machine.req.we.eq(source.we),
+                    bank_machine.req.addr.eq(source.addr),
+                    req.lock.eq(bank_machine.req.lock | cmd_pool.pending[n]),
+                    req.wdata_ready.eq(bank_machine.req.wdata_ready),
+                    req.rdata_valid.eq(bank_machine.req.rdata_valid),
+                ]
+            else:
+                self.comb += req.connect(bank_machine.req)
 
         # Multiplexer ------------------------------------------------------------------------------
         self.submodules.multiplexer = Multiplexer(
@@ -103,4 +212,7 @@ class LiteDRAMController(Module):
             interface     = interface)
 
     def get_csrs(self):
-        return self.multiplexer.get_csrs()
+        csrs = self.multiplexer.get_csrs()
+        if self.settings.with_timing_csrs:
+            csrs += self.timing_csrs.get_csrs()
+        return csrs
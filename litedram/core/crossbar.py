@@ -15,14 +15,158 @@ from migen import *
 from migen.genlib import roundrobin
 
 from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import *
 
 from litedram.common import *
 from litedram.core.controller import *
+from litedram.core.bandwidth import LatencyHistogram
 from litedram.frontend.adapter import *
 
+# ReadReorderBuffer --------------------------------------------------------------------------------
+
+class _ReadReorderBuffer(Module):
+    """Returns read data of a port in request order
+
+    Each read issued by the port gets a tag (its position in the buffer). Read data can come back
+    in any order (from different banks), it is stored at the position given by its tag and is
+    forwarded to `source` once all the previous reads have been forwarded.
+
+    Parameters
+    ----------
+    data_width : int
+        Width of the read data
+    depth : int
+        Maximum number of reads in flight (power of 2)
+
+    Attributes
+    ----------
+    issue : Signal, in
+        A read is issued, `issue_tag` is allocated to it
+    issue_tag : Signal, out
+        Tag of the next issued read
+    full : Signal, out
+        No more reads can be issued
+    ret_valid : Signal, in
+        Read data `ret_data` with tag `ret_tag` is returned
+    source : Endpoint(rdata_description)
+        Read data in request order
+    """
+    def __init__(self, data_width, depth):
+        assert depth >= 2
+        tag_bits = log2_int(depth)
+        self.issue     = Signal()
+        self.issue_tag = Signal(tag_bits)
+        self.full      = Signal()
+        self.ret_valid = Signal()
+        self.ret_tag   = Signal(tag_bits)
+        self.ret_data  = Signal(data_width)
+        self.source    = source = stream.Endpoint(rdata_description(data_width))
+
+        # # #
+
+        count   = Signal(max=depth + 1)
+        rd_tag  = Signal(tag_bits)
+        valids  = Array(Signal() for i in range(depth))
+        deliver = Signal()
+
+        mem    = Memory(data_width, depth)
+        wrport = mem.get_port(write_capable=True)
+        rdport = mem.get_port(async_read=True)
+        self.specials += mem, wrport, rdport
+
+        self.comb += [
+            self.full.eq(count == depth),
+            wrport.adr.eq(self.ret_tag),
+            wrport.dat_w.eq(self.ret_data),
+            wrport.we.eq(self.ret_valid),
+            rdport.adr.eq(rd_tag),
+            source.valid.eq(valids[rd_tag]),
+            source.data.eq(rdport.dat_r),
+            deliver.eq(source.valid & source.ready),
+        ]
+        self.sync += [
+            If(self.issue,
+                self.issue_tag.eq(self.issue_tag + 1)
+            ),
+            If(deliver,
+                rd_tag.eq(rd_tag + 1)
+            ),
+            count.eq(count + self.issue - deliver),
+        ]
+        for i in range(depth):
+            self.sync += \
+                If(self.ret_valid & (self.ret_tag == i),
+                    valids[i].eq(1)
+                ).Elif(deliver & (rd_tag == i),
+                    valids[i].eq(0)
+                )
+
+# ReadIDTracker ------------------------------------------------------------------------------------
+
+class _ReadIDTracker(Module):
+    """Tracks the reads in flight of a tagged port
+
+    Read data of a tagged port is returned as soon as it is available, with the ID of its command.
+    Reads with different IDs can complete out of order, but reads with the same ID must complete in
+    order: a read is only allowed to the bank holding the reads in flight with the same ID.
+
+    Parameters
+    ----------
+    id_width : int
+        Width of the read IDs
+    bank_bits : int
+        Width of the bank number
+    depth : int
+        Maximum number of reads in flight
+
+    Attributes
+    ----------
+    issue : Signal, in
+        A read with ID `issue_id` is issued to bank `issue_bank`
+    id_busy : Signal, out
+        Reads with ID `issue_id` are in flight
+    id_bank : Signal, out
+        Bank of the reads with ID `issue_id` in flight
+    full : Signal, out
+        No more reads can be issued
+    ret_valid : Signal, in
+        Read data with ID `ret_id` is returned
+    """
+    def __init__(self, id_width, bank_bits, depth):
+        self.issue      = Signal()
+        self.issue_id   = Signal(id_width)
+        self.issue_bank = Signal(max(bank_bits, 1))
+        self.id_busy    = Signal()
+        self.id_bank    = Signal(max(bank_bits, 1))
+        self.full       = Signal()
+        self.ret_valid  = Signal()
+        self.ret_id     = Signal(id_width)
+
+        # # #
+
+        count  = Signal(max=depth + 1)
+        counts = Array(Signal(max=depth + 1) for i in range(2**id_width))
+        banks  = Array(Signal(max(bank_bits, 1)) for i in range(2**id_width))
+
+        self.comb += [
+            self.full.eq(count == depth),
+            self.id_busy.eq(counts[self.issue_id] != 0),
+            self.id_bank.eq(banks[self.issue_id]),
+        ]
+        self.sync += [
+            count.eq(count + self.issue - self.ret_valid),
+            If(self.issue,
+                banks[self.issue_id].eq(self.issue_bank)
+            ),
+        ]
+        for i in range(2**id_width):
+            issue = self.issue     & (self.issue_id == i)
+            ret   = self.ret_valid & (self.ret_id   == i)
+            self.sync += counts[i].eq(counts[i] + issue - ret)
+
 # LiteDRAMCrossbar ---------------------------------------------------------------------------------
 
-class LiteDRAMCrossbar(Module):
+class LiteDRAMCrossbar(Module, AutoCSR):
     """Multiplexes LiteDRAMController (slave) between ports (masters)
 
     To get a port to LiteDRAM, use the `get_port` method. It handles data width
@@ -31,7 +175,12 @@ class LiteDRAMCrossbar(Module):
     The crossbar routes requests from masters to the BankMachines
     (bankN.cmd_layout) and connects data path directly to the Multiplexer
     (data_layout). It performs address translation based on chosen
-    `controller.settings.address_mapping`.
+    `controller.settings.address_mapping`:
+     - ROW_BANK_COL: row | rank | bank | column (default)
+     - BANK_ROW_COL: rank | bank | row | column
+     - ROW_BANK_COL_XOR: as ROW_BANK_COL, but with the row LSBs XORed into
+       the bank number, so that row-conflicting streams get spread over banks
+     - ROW_BANK_RANK_COL: row | bank | rank | column, interleaving ranks first
     Internally, all masters are multiplexed between controller banks based on
     the bank address (extracted from the presented address). Each bank has
     a RoundRobin arbiter, that selects from masters that want to access this
@@ -51,6 +200,51 @@ class LiteDRAMCrossbar(Module):
     Data ready/valid signals for banks are routed from bankmachines with
     a latency that synchronizes them with the data coming over datapath.
 
+    Ports can be given a QoS configuration with `get_port`:
+     - priority: static priority (0-15), the arbiter only considers the
+       requesting masters with the highest priority
+     - weight: number of commands (1-255) a master can issue to a bank before
+       yielding it to another requesting master of the same priority (0: no
+       limit, the master keeps the bank until it stops requesting)
+     - urgent: Signal (sys clock domain) raising the master above all
+       priorities while asserted
+     - with_qos_csr: expose priority/weight in a CSR for runtime adjustment
+    A preempted master (by a higher priority/urgent master or when its weight
+    is exhausted) stops being forwarded to the bank and the grant only switches
+    once the bank is unlocked, so the lock semantics are kept.
+
+    A port created with `reorder_depth` is not locked by other banks for its
+    reads: it can have reads in flight in several banks at once (up to
+    `reorder_depth`, a power of 2), which lets a single master exploit bank
+    parallelism. Each read is tagged, the tags are queued per bank and come
+    back with rdata_valid, and a reorder buffer returns the read data to the
+    port in request order. Writes still lock the port to a bank while another
+    bank has writes of this port pending, since write data is sent in order.
+
+    A port created with `id_width` (and a `reorder_depth`) is tagged: its cmd
+    and rdata carry an `id`. Its reads are not locked by other banks either,
+    but instead of going through a reorder buffer, read data is returned as
+    soon as the bank completes it, with the ID of its command. Only reads with
+    the same ID are kept in order (they are sent to the same bank), so a slow
+    bank doesn't block the reads with other IDs. `reorder_depth` is then the
+    maximum number of reads in flight. Tagged ports live in the sys clock
+    domain at the controller data width.
+
+    With `controller.settings.cmd_burst_max` > 1, the ports (in the sys clock
+    domain, at the controller data width and without read reordering) get a
+    `len` on cmd: a command is then a burst of len + 1 beats at consecutive
+    addresses, handled by the BankMachine as a single request. Bursts must not
+    cross a `cmd_burst_max` aligned boundary (so they stay in a DRAM row).
+
+    A port created with `write_buffer_depth` gets a posted-write buffer
+    (LiteDRAMNativePortWriteBuffer): writes are acknowledged once buffered,
+    writes to the same address are merged and reads hitting a fully written
+    entry are served from the buffer. Buffered writes are written to the
+    controller after `write_buffer_timeout` cycles without a new write.
+
+    With `with_latency_histogram`, a LatencyHistogram measuring the port's
+    request-to-data latency is exposed in the portN_latency CSRs.
+
     Parameters
     ----------
     controller : LiteDRAMInterface
@@ -74,11 +268,31 @@ class LiteDRAMCrossbar(Module):
         self.bank_bits = log2_int(self.nbanks, False)
         self.rank_bits = log2_int(self.nranks, False)
 
-        self.masters = []
+        self.masters        = []
+        self.qos            = []
+        self.with_qos       = False
+        self.reorder_depths = []
+        self.id_widths      = []
 
-    def get_port(self, mode="both", data_width=None, clock_domain="sys", reverse=False):
+    def get_port(self, mode="both", data_width=None, clock_domain="sys", reverse=False,
+        priority=0, weight=0, urgent=None, with_qos_csr=False, with_latency_histogram=False,
+        reorder_depth=0, write_buffer_depth=0, write_buffer_timeout=16, id_width=0):
         if self.finalized:
             raise FinalizeError
+        if not (0 <= priority < 16):
+            raise ValueError("Port priority must be in [0, 15], got {}".format(priority))
+        if not (0 <= weight < 256):
+            raise ValueError("Port weight must be in [0, 255], got {}".format(weight))
+        if reorder_depth and (reorder_depth < 2 or reorder_depth & (reorder_depth - 1)):
+            raise ValueError("Port reorder_depth must be a power of 2 >= 2, got {}".format(reorder_depth))
+        if write_buffer_depth and mode == "read":
+            raise ValueError("Port write_buffer_depth can't be used on a read port")
+        if id_width and not reorder_depth:
+            raise ValueError("Port id_width requires a reorder_depth")
+        if id_width and (clock_domain != "sys" or write_buffer_depth or
+            data_width not in [None, self.controller.data_width]):
+            raise ValueError("Port id_width can't be used with clock domain crossing, data width "
+                             "conversion or a posted-write buffer")
 
         if data_width is None:
             # use internal data_width when no width adaptation is requested
@@ -90,9 +304,45 @@ class LiteDRAMCrossbar(Module):
             address_width = self.rca_bits + self.bank_bits - self.rank_bits,
             data_width    = self.controller.data_width,
             clock_domain  = "sys",
-            id            = len(self.masters))
+            id            = len(self.masters),
+            id_width      = id_width,
+            # Reordering ports tag each read command, so they can't do command bursts.
+            len_width     = 0 if reorder_depth else self.controller.len_width)
         self.masters.append(port)
 
+        # QoS --------------------------------------------------------------------------------------
+        self.with_qos |= (priority != 0) or (weight != 0) or (urgent is not None) or with_qos_csr
+        if with_qos_csr:
+            qos = CSRStorage(name="port{}_qos".format(port.id), fields=[
+                CSRField("priority", size=4, offset=0, reset=priority, description="Port priority."),
+                CSRField("weight",   size=8, offset=8, reset=weight,   description="Port weight (0: no limit)."),
+            ])
+            setattr(self, "port{}_qos".format(port.id), qos)
+            priority = qos.fields.priority
+            weight   = qos.fields.weight
+        self.qos.append((priority, weight, 0 if urgent is None else urgent))
+
+        # Read reordering --------------------------------------------------------------------------
+        self.reorder_depths.append(reorder_depth)
+        self.id_widths.append(id_width)
+
+        # Latency histogram ------------------------------------------------------------------------
+        if with_latency_histogram:
+            setattr(self.submodules, "port{}_latency".format(port.id), LatencyHistogram(port))
+
+        # Posted-write buffer ----------------------------------------------------------------------
+        if write_buffer_depth:
+            new_port = LiteDRAMNativePort(
+                mode          = mode,
+                address_width = port.address_width,
+                data_width    = port.data_width,
+                clock_domain  = "sys",
+                id            = port.id)
+            self.submodules += LiteDRAMNativePortWriteBuffer(new_port, port,
+                depth   = write_buffer_depth,
+                timeout = write_buffer_timeout)
+            port = new_port
+
         # Clock domain crossing --------------------------------------------------------------------
         if clock_domain != "sys":
             new_port = LiteDRAMNativePort(
@@ -127,18 +377,80 @@ class LiteDRAMCrossbar(Module):
         nmasters   = len(self.masters)
 
         # Address mapping --------------------------------------------------------------------------
-        cba_shifts = {"ROW_BANK_COL": controller.settings.geom.colbits - controller.address_align}
-        cba_shift = cba_shifts[controller.settings.address_mapping]
-        m_ba      = [m.get_bank_address(self.bank_bits, cba_shift)for m in self.masters]
+        address_mapping = controller.settings.address_mapping
+        col_shift = controller.settings.geom.colbits - controller.address_align
+        cba_shifts = {
+            "ROW_BANK_COL"      : col_shift,
+            "ROW_BANK_COL_XOR"  : col_shift,
+            "ROW_BANK_RANK_COL" : col_shift,
+            "BANK_ROW_COL"      : col_shift + controller.settings.geom.rowbits,
+        }
+        cba_shift = cba_shifts[address_mapping]
+        m_ba      = [m.get_bank_address(self.bank_bits, cba_shift, address_mapping, self.rank_bits)
+            for m in self.masters]
         m_rca     = [m.get_row_column_address(self.bank_bits, self.rca_bits, cba_shift) for m in self.masters]
 
         master_readys       = [0]*nmasters
         master_wdata_readys = [0]*nmasters
         master_rdata_valids = [0]*nmasters
+        master_rdata_tags   = [0]*nmasters
 
         arbiters = [roundrobin.RoundRobin(nmasters, roundrobin.SP_CE) for n in range(self.nbanks)]
         self.submodules += arbiters
 
+        # Read reordering: reorder buffers/ID trackers (per master) and read tags (per bank) -------
+        m_reorder    = [reorder_depth != 0 for reorder_depth in self.reorder_depths]
+        m_robs       = [None]*nmasters
+        m_trackers   = [None]*nmasters
+        m_issue_tags = [0]*nmasters
+        if any(m_reorder):
+            tag_bits = max(log2_int(max(self.reorder_depths)), *self.id_widths)
+            for nm, master in enumerate(self.masters):
+                issue = master.cmd.valid & master.cmd.ready & ~master.cmd.we
+                if self.id_widths[nm]:
+                    tracker = _ReadIDTracker(self.id_widths[nm], self.bank_bits,
+                        self.reorder_depths[nm])
+                    self.submodules += tracker
+                    self.comb += [
+                        tracker.issue.eq(issue),
+                        tracker.issue_id.eq(master.cmd.id),
+                        tracker.issue_bank.eq(m_ba[nm]),
+                    ]
+                    m_trackers[nm]   = tracker
+                    m_issue_tags[nm] = master.cmd.id
+                elif m_reorder[nm]:
+                    rob = _ReadReorderBuffer(controller.data_width, self.reorder_depths[nm])
+                    self.submodules += rob
+                    self.comb += rob.issue.eq(issue)
+                    m_robs[nm]       = rob
+                    m_issue_tags[nm] = rob.issue_tag
+            bank_tags   = []
+            bank_wlocks = []
+            for nb in range(self.nbanks):
+                bank   = getattr(controller, "bank"+str(nb))
+                # A reordering master can't have more reads in flight than its reorder buffer.
+                tags   = stream.SyncFIFO([("tag", tag_bits)], max(self.reorder_depths))
+                wlock  = Signal()
+                self.submodules += tags
+                bank_tags.append(tags)
+                bank_wlocks.append(wlock)
+                # Bank holds writes: set on an accepted write, cleared once the bank is unlocked.
+                self.sync += \
+                    If(bank.valid & bank.ready & bank.we,
+                        wlock.eq(1)
+                    ).Elif(~bank.lock,
+                        wlock.eq(0)
+                    )
+
+        # QoS levels (urgent above all static priorities) ------------------------------------------
+        if self.with_qos:
+            m_level  = []
+            m_weight = [weight for _, weight, _ in self.qos]
+            for priority, _, urgent in self.qos:
+                level = Signal(5)
+                self.comb += level.eq(priority | (urgent << 4))
+                m_level.append(level)
+
         for nb, arbiter in enumerate(arbiters):
             bank = getattr(controller, "bank"+str(nb))
 
@@ -149,14 +461,60 @@ class LiteDRAMCrossbar(Module):
                 for other_nb, other_arbiter in enumerate(arbiters):
                     if other_nb != nb:
                         other_bank = getattr(controller, "bank"+str(other_nb))
-                        locked = locked | (other_bank.lock & (other_arbiter.grant == nm))
+                        other_lock = other_bank.lock & (other_arbiter.grant == nm)
+                        if m_reorder[nm]:
+                            # Only writes have to wait for the writes pending in other banks.
+                            other_lock = other_lock & master.cmd.we & bank_wlocks[other_nb]
+                        locked = locked | other_lock
+                if m_robs[nm] is not None:
+                    # Reads are also blocked while the reorder buffer is full.
+                    locked = locked | (~master.cmd.we & m_robs[nm].full)
+                if m_trackers[nm] is not None:
+                    # Reads are also blocked while too many reads are in flight or while the reads
+                    # with the same ID are in flight in another bank.
+                    tracker = m_trackers[nm]
+                    locked  = locked | (~master.cmd.we & (tracker.full |
+                        (tracker.id_busy & (tracker.id_bank != nb))))
                 master_locked.append(locked)
 
             # Arbitrate ----------------------------------------------------------------------------
             bank_selected  = [(ba == nb) & ~locked for ba, locked in zip(m_ba, master_locked)]
             bank_requested = [bs & master.cmd.valid for bs, master in zip(bank_selected, self.masters)]
+            bank_granted   = Signal()
+            if self.with_qos:
+                # Only the requesting masters with the highest level are eligible.
+                bank_eligible = []
+                for nm in range(nmasters):
+                    eligible = Signal()
+                    self.comb += eligible.eq(bank_requested[nm] & ~reduce(or_,
+                        [bank_requested[j] & (m_level[j] > m_level[nm]) for j in range(nmasters) if j != nm], 0))
+                    bank_eligible.append(eligible)
+
+                # Count the commands of the granted master to enforce its weight.
+                count     = Signal(8)
+                weight    = Array(m_weight)[arbiter.grant]
+                exhausted = (weight != 0) & (count >= weight)
+                self.sync += [
+                    If(arbiter.ce,
+                        count.eq(0)
+                    ).Elif(bank.valid & bank.ready & (count != (2**len(count) - 1)),
+                        count.eq(count + 1)
+                    )
+                ]
+
+                # Preempt the granted master when another master is eligible and the granted one is
+                # not or has exhausted its weight: stop forwarding its commands, the grant switches
+                # once the bank is unlocked.
+                preempt = Signal()
+                self.comb += preempt.eq(reduce(or_,
+                    [(arbiter.grant != nm) & bank_eligible[nm] for nm in range(nmasters)]) &
+                    (~Array(bank_eligible)[arbiter.grant] | exhausted))
+                self.comb += bank_granted.eq(Array(bank_requested)[arbiter.grant] & ~preempt)
+            else:
+                bank_eligible = bank_requested
+                self.comb += bank_granted.eq(Array(bank_requested)[arbiter.grant])
             self.comb += [
-                arbiter.request.eq(Cat(*bank_requested)),
+                arbiter.request.eq(Cat(*bank_eligible)),
                 arbiter.ce.eq(~bank.valid & ~bank.lock)
             ]
 
@@ -164,15 +522,35 @@ class LiteDRAMCrossbar(Module):
             self.comb += [
                 bank.addr.eq(Array(m_rca)[arbiter.grant]),
                 bank.we.eq(Array(self.masters)[arbiter.grant].cmd.we),
-                bank.valid.eq(Array(bank_requested)[arbiter.grant])
+                bank.valid.eq(bank_granted)
             ]
-            master_readys = [master_ready | ((arbiter.grant == nm) & bank_selected[nm] & bank.ready)
+            if controller.len_width:
+                m_len = [getattr(master.cmd, "len", 0) for master in self.masters]
+                self.comb += bank.len.eq(Array(m_len)[arbiter.grant])
+            bank_ready = bank.ready
+            if self.with_qos:
+                bank_ready = bank.ready & ~preempt
+            master_readys = [master_ready | ((arbiter.grant == nm) & bank_selected[nm] & bank_ready)
                 for nm, master_ready in enumerate(master_readys)]
             master_wdata_readys = [master_wdata_ready | ((arbiter.grant == nm) & bank.wdata_ready)
                 for nm, master_wdata_ready in enumerate(master_wdata_readys)]
             master_rdata_valids = [master_rdata_valid | ((arbiter.grant == nm) & bank.rdata_valid)
                 for nm, master_rdata_valid in enumerate(master_rdata_valids)]
 
+            # Read tags ----------------------------------------------------------------------------
+            if any(m_reorder):
+                tags       = bank_tags[nb]
+                reordering = Array(m_reorder)[arbiter.grant]
+                issue_tag  = Array(m_issue_tags)[arbiter.grant]
+                self.comb += [
+                    tags.sink.valid.eq(bank.valid & bank.ready & ~bank.we & reordering),
+                    tags.sink.tag.eq(issue_tag),
+                    tags.source.ready.eq(bank.rdata_valid & reordering),
+                ]
+                master_rdata_tags = [master_rdata_tag |
+                    Mux((arbiter.grant == nm) & bank.rdata_valid, tags.source.tag, 0)
+                    for nm, master_rdata_tag in enumerate(master_rdata_tags)]
+
         # Delay write/read signals based on their latency
         for nm, master_wdata_ready in enumerate(master_wdata_readys):
             for i in range(self.write_latency):
@@ -188,12 +566,21 @@ class LiteDRAMCrossbar(Module):
                 master_rdata_valid = new_master_rdata_valid
             master_rdata_valids[nm] = master_rdata_valid
 
+        for nm, master_rdata_tag in enumerate(master_rdata_tags):
+            if m_reorder[nm]:
+                for i in range(self.read_latency):
+                    new_master_rdata_tag = Signal(tag_bits)
+                    self.sync += new_master_rdata_tag.eq(master_rdata_tag)
+                    master_rdata_tag = new_master_rdata_tag
+                master_rdata_tags[nm] = master_rdata_tag
+
         for master, master_ready in zip(self.masters, master_readys):
             self.comb += master.cmd.ready.eq(master_ready)
         for master, master_wdata_ready in zip(self.masters, master_wdata_readys):
             self.comb += master.wdata.ready.eq(master_wdata_ready)
-        for master, master_rdata_valid in zip(self.masters, master_rdata_valids):
-            self.comb += master.rdata.valid.eq(master_rdata_valid)
+        for master, master_rdata_valid, rob in zip(self.masters, master_rdata_valids, m_robs):
+            if rob is None:
+                self.comb += master.rdata.valid.eq(master_rdata_valid)
 
         # Route data writes ------------------------------------------------------------------------
         wdata_cases = {}
@@ -209,5 +596,22 @@ class LiteDRAMCrossbar(Module):
         self.comb += Case(Cat(*master_wdata_readys), wdata_cases)
 
         # Route data reads -------------------------------------------------------------------------
-        for master in self.masters:
-            self.comb += master.rdata.data.eq(controller.rdata)
+        for nm, master in enumerate(self.masters):
+            if m_trackers[nm] is not None:
+                tracker = m_trackers[nm]
+                self.comb += [
+                    master.rdata.data.eq(controller.rdata),
+                    master.rdata.id.eq(master_rdata_tags[nm]),
+                    tracker.ret_valid.eq(master_rdata_valids[nm]),
+                    tracker.ret_id.eq(master_rdata_tags[nm]),
+                ]
+            elif m_robs[nm] is None:
+                self.comb += master.rdata.data.eq(controller.rdata)
+            else:
+                rob = m_robs[nm]
+                self.comb += [
+                    rob.ret_valid.eq(master_rdata_valids[nm]),
+                    rob.ret_tag.eq(master_rdata_tags[nm]),
+                    rob.ret_data.eq(controller.rdata),
+                    rob.source.connect(master.rdata, keep={"valid", "ready", "data"}),
+                ]
@@ -10,17 +10,17 @@
 
 import math
 from functools import reduce
-from operator import or_, and_
+from operator import or_, and_, add
 
 from migen import *
 from migen.genlib.roundrobin import *
 from migen.genlib.coding import Decoder
 
 from litex.soc.interconnect import stream
-from litex.soc.interconnect.csr import AutoCSR
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage
 
 from litedram.common import *
-from litedram.core.bandwidth import Bandwidth
+from litedram.core.bandwidth import Bandwidth, PerformanceMonitor
 
 # _CommandChooser ----------------------------------------------------------------------------------
 
@@ -30,10 +30,20 @@ class _CommandChooser(Module):
     Uses RoundRobin to choose current request, filters requests based on
     `want_*` signals.
 
+    When `pipelined`, arbitration is done on the filtered requests of the
+    previous cycle: the next grant is pre-selected in a register (one-hot)
+    and the outputs are selected with one-hot AND-OR muxes. The selected
+    request is still checked against its current state, so a command is
+    never issued on a stale request, but a newly valid request takes one
+    more cycle to be selected. This removes the RoundRobin logic from the
+    BankMachines to DFI path.
+
     Parameters
     ----------
     requests : [Endpoint(cmd_request_rw_layout), ...]
         Request streams to consider for arbitration
+    pipelined : bool
+        Use registered (pre-selected, one-hot) arbitration
 
     Attributes
     ----------
@@ -45,14 +55,23 @@ class _CommandChooser(Module):
         Consider command requests (without ACT)
     want_activates : Signal, in
         Also consider ACT commands
+    exclude : Signal(len(requests)), in
+        Requests to ignore (e.g. already selected by another chooser)
+    prefer : Signal(len(requests)), in
+        Requests to favor: when one of them can be selected, the others are not considered
+    selected : Signal(len(requests)), out
+        One-hot encoding of the currently selected valid request
     cmd : Endpoint(cmd_request_rw_layout)
         Currently selected request stream (when ~cmd.valid, cas/ras/we are 0)
     """
-    def __init__(self, requests):
+    def __init__(self, requests, pipelined=False):
         self.want_reads     = Signal()
         self.want_writes    = Signal()
         self.want_cmds      = Signal()
         self.want_activates = Signal()
+        self.exclude        = Signal(len(requests))
+        self.prefer         = Signal(len(requests))
+        self.selected       = Signal(len(requests))
 
         a  = len(requests[0].a)
         ba = len(requests[0].ba)
@@ -64,20 +83,30 @@ class _CommandChooser(Module):
 
         n = len(requests)
 
-        valids = Signal(n)
+        candidates = Signal(n)
+        valids     = Signal(n)
         for i, request in enumerate(requests):
             is_act_cmd = request.ras & ~request.cas & ~request.we
             command = request.is_cmd & self.want_cmds & (~is_act_cmd | self.want_activates)
             read = request.is_read == self.want_reads
             write = request.is_write == self.want_writes
-            self.comb += valids[i].eq(request.valid & (command | (read & write)))
+            self.comb += candidates[i].eq(request.valid & (command | (read & write)))
+            self.comb += valids[i].eq(candidates[i] & ~self.exclude[i])
+
+        if pipelined:
+            self._add_pipelined_arbiter(requests, candidates, valids)
+        else:
+            self._add_arbiter(requests, valids)
 
+    def _add_arbiter(self, requests, valids):
+        n   = len(requests)
+        cmd = self.cmd
 
         arbiter = RoundRobin(n, SP_CE)
         self.submodules += arbiter
         choices = Array(valids[i] for i in range(n))
         self.comb += [
-            arbiter.request.eq(valids),
+            arbiter.request.eq(self.favor(valids)),
             cmd.valid.eq(choices[arbiter.grant])
         ]
 
@@ -94,6 +123,7 @@ class _CommandChooser(Module):
                 )
 
         for i, request in enumerate(requests):
+            self.comb += self.selected[i].eq(cmd.valid & (arbiter.grant == i))
             self.comb += \
                 If(cmd.valid & cmd.ready & (arbiter.grant == i),
                     request.ready.eq(1)
@@ -102,7 +132,49 @@ class _CommandChooser(Module):
         # command is selected when cmd.ready goes high.
         self.comb += arbiter.ce.eq(cmd.ready | ~cmd.valid)
 
+    def _add_pipelined_arbiter(self, requests, candidates, valids):
+        n   = len(requests)
+        cmd = self.cmd
+
+        # Pre-selection: round-robin on the filtered requests of the previous cycle. Excluded
+        # requests are still considered, as they are usually only excluded for a few cycles.
+        valids_d = Signal(n)
+        grant    = Signal(n, reset=1)
+        grant_n  = Signal(n)
+        self.sync += valids_d.eq(self.favor(candidates))
+        self.comb += grant_n.eq(grant)
+        for current in range(n):
+            # Requests following the current one first, current one last (last assignment wins).
+            order = [(current + k) % n for k in range(1, n + 1)]
+            self.comb += If(grant[current],
+                *[If(valids_d[i], grant_n.eq(1 << i)) for i in reversed(order)]
+            )
+        # Arbitrate if a command is being accepted or if the command is not valid.
+        self.sync += If(cmd.ready | ~cmd.valid, grant.eq(grant_n))
+
+        # Selection (one-hot AND-OR muxes).
+        def select(name):
+            return reduce(or_, [Replicate(grant[i], len(getattr(req, name))) & getattr(req, name)
+                for i, req in enumerate(requests)])
+
+        self.comb += cmd.valid.eq((valids & grant) != 0)
+        for name in ["a", "ba", "is_read", "is_write", "is_cmd"]:
+            self.comb += getattr(cmd, name).eq(select(name))
+        for name in ["cas", "ras", "we"]:
+            # we should only assert those signals when valid is 1
+            self.comb += If(cmd.valid, getattr(cmd, name).eq(select(name)))
+        for i, request in enumerate(requests):
+            self.comb += self.selected[i].eq(valids[i] & grant[i])
+            self.comb += \
+                If(cmd.ready & valids[i] & grant[i],
+                    request.ready.eq(1)
+                )
+
     # helpers
+    def favor(self, requests):
+        preferred = requests & self.prefer
+        return Mux(preferred != 0, preferred, requests)
+
     def accept(self):
         return self.cmd.valid & self.cmd.ready
 
@@ -124,17 +196,28 @@ class _Steerer(Module):
 
     cas/ras/we/is_write/is_read are connected only when `cmd.valid & cmd.ready`.
     Rank bits are decoded and used to drive cs_n in multi-rank systems,
-    STEER_REFRESH always enables all ranks.
+    STEER_REFRESH enables all ranks unless `refresh_all_ranks` is disabled
+    (per-rank refresh).
+
+    ODT is tied high unless `odt_cycles` is given: ODT is then driven high for
+    `odt_cycles` cycles from each WRITE on all the ranks and from each READ on
+    the ranks not being read (the rank driving the bus is not terminated).
 
     Parameters
     ----------
     commands : [Endpoint(cmd_request_rw_layout), ...]
-        Command streams to choose from. Must be of len=4 in the order:
-            NOP, CMD, REQ, REFRESH
+        Command streams to choose from. Must be of len>=4 in the order:
+            NOP, CMD, REQ, REFRESH, [additional CMDs...]
         NOP can be of type Record(cmd_request_rw_layout) instead, so that it is
         always considered invalid (because of lack of the `valid` attribute).
     dfi : dfi.Interface
         DFI interface connected to PHY
+    refresh_all_ranks : bool
+        Select all ranks on STEER_REFRESH (otherwise rank bits are decoded)
+    odt_cycles : int or None
+        Cycles ODT is held after a READ/WRITE (None: ODT tied high)
+    cke : Signal or None
+        CKE of all the ranks, registered along with the commands (None: CKE tied high)
 
     Attributes
     ----------
@@ -143,7 +226,7 @@ class _Steerer(Module):
         DFI phase. The signals should take one of the values from STEER_* to
         select given source.
     """
-    def __init__(self, commands, dfi):
+    def __init__(self, commands, dfi, refresh_all_ranks=True, odt_cycles=None, cke=None):
         ncmd = len(commands)
         nph  = len(dfi.phases)
         self.sel = [Signal(max=ncmd) for i in range(nph)]
@@ -156,27 +239,39 @@ class _Steerer(Module):
             else:
                 return cmd.valid & cmd.ready & getattr(cmd, attr)
 
+        nranks      = len(dfi.phases[0].cs_n)
+        rankbits    = log2_int(nranks)
+        dynamic_odt = odt_cycles is not None and hasattr(dfi.phases[0], "odt")
+        odt         = Signal(nranks)
+        rd_ranks    = [Signal(nranks) for i in range(nph)]
+        wr_ranks    = [Signal(nranks) for i in range(nph)]
+
         for i, (phase, sel) in enumerate(zip(dfi.phases, self.sel)):
-            nranks   = len(phase.cs_n)
-            rankbits = log2_int(nranks)
             if hasattr(phase, "reset_n"):
                 self.comb += phase.reset_n.eq(1)
-            self.comb += phase.cke.eq(Replicate(Signal(reset=1), nranks))
+            if cke is None:
+                self.comb += phase.cke.eq(Replicate(Signal(reset=1), nranks))
+            else:
+                self.sync += phase.cke.eq(Replicate(cke, nranks))
             if hasattr(phase, "odt"):
-                # FIXME: add dynamic drive for multi-rank (will be needed for high frequencies)
-                self.comb += phase.odt.eq(Replicate(Signal(reset=1), nranks))
+                if dynamic_odt:
+                    self.sync += phase.odt.eq(odt)
+                else:
+                    self.comb += phase.odt.eq(Replicate(Signal(reset=1), nranks))
             if rankbits:
                 rank_decoder = Decoder(nranks)
                 self.submodules += rank_decoder
                 self.comb += rank_decoder.i.eq((Array(cmd.ba[-rankbits:] for cmd in commands)[sel]))
-                if i == 0: # Select all ranks on refresh.
+                if i == 0 and refresh_all_ranks: # Select all ranks on refresh.
                     self.sync += If(sel == STEER_REFRESH, phase.cs_n.eq(0)).Else(phase.cs_n.eq(~rank_decoder.o))
                 else:
                     self.sync += phase.cs_n.eq(~rank_decoder.o)
                 self.sync += phase.bank.eq(Array(cmd.ba[:-rankbits] for cmd in commands)[sel])
+                rank_sel = rank_decoder.o
             else:
                 self.sync += phase.cs_n.eq(0)
                 self.sync += phase.bank.eq(Array(cmd.ba[:] for cmd in commands)[sel])
+                rank_sel = 1
 
             self.sync += [
                 phase.address.eq(Array(cmd.a for cmd in commands)[sel]),
@@ -191,6 +286,34 @@ class _Steerer(Module):
                 phase.rddata_en.eq(rddata_ens[sel]),
                 phase.wrdata_en.eq(wrdata_ens[sel])
             ]
+            self.comb += [
+                rd_ranks[i].eq(Replicate(rddata_ens[sel], nranks) & rank_sel),
+                wr_ranks[i].eq(Replicate(wrdata_ens[sel], nranks) & rank_sel),
+            ]
+
+        # Dynamic ODT: terminate all the ranks on WRITEs and the other ranks on READs.
+        if dynamic_odt:
+            rd_odt = []
+            wr_odt = []
+            for r in range(nranks):
+                rd_odt.append(self.odt_window(odt_cycles, reduce(or_, [rd[r] for rd in rd_ranks])))
+                wr_odt.append(self.odt_window(odt_cycles, reduce(or_, [wr[r] for wr in wr_ranks])))
+            for r in range(nranks):
+                other_rd_odt = [rd_odt[o] for o in range(nranks) if o != r]
+                self.comb += odt[r].eq(reduce(or_, wr_odt) | reduce(or_, other_rd_odt, 0))
+
+    def odt_window(self, cycles, trigger):
+        # Returns a signal that is high on `trigger` and during the `cycles - 1` following cycles.
+        active = Signal()
+        count  = Signal(max=max(cycles, 2))
+        self.sync += \
+            If(trigger,
+                count.eq(cycles - 1)
+            ).Elif(count != 0,
+                count.eq(count - 1)
+            )
+        self.comb += active.eq(trigger | (count != 0))
+        return active
 
 # Multiplexer --------------------------------------------------------------------------------------
 
@@ -200,7 +323,11 @@ class Multiplexer(Module, AutoCSR):
     This module multiplexes requests from BankMachines (and Refresher) and
     connects them to DFI. Refresh commands are coordinated between the Refresher
     and BankMachines to ensure there are no conflicts. Enforces required timings
-    between commands (some timings are enforced by BankMachines).
+    between commands to different banks with a TimingScoreboard: requests that
+    can't be issued this cycle are excluded from the arbitration (timings between
+    commands to the same bank are enforced by BankMachines). In multi-rank systems, CAS
+    are grouped to the rank of the last CAS and a rank switch penalty is enforced
+    between CAS to different ranks.
 
     Parameters
     ----------
@@ -209,7 +336,8 @@ class Multiplexer(Module, AutoCSR):
     bank_machines : [BankMachine, ...]
         Bank machines that generate command requests to the Multiplexer
     refresher : Refresher
-        Generates REFRESH command requests
+        Generates REFRESH command requests (per-bank/per-rank when `refresher.per_bank`/
+        `refresher.per_rank` is set), also drives CKE with power-down/self-refresh
     dfi : dfi.Interface
         DFI connected to the PHY
     interface : LiteDRAMInterface
@@ -223,9 +351,6 @@ class Multiplexer(Module, AutoCSR):
             interface):
         assert(settings.phy.nphases == len(dfi.phases))
 
-        ras_allowed = Signal(reset=1)
-        cas_allowed = Signal(reset=1)
-
         # Read/Write Cmd/Dat phases ----------------------------------------------------------------
         nphases = settings.phy.nphases
         rdphase = settings.phy.rdphase
@@ -241,49 +366,107 @@ class Multiplexer(Module, AutoCSR):
         else:
             wrcmdphase = (wrphase - 1)%nphases
 
-        # Command choosing -------------------------------------------------------------------------
+        # Timing scoreboard ------------------------------------------------------------------------
+        # Timings between commands to different banks: tRRD/tFAW (ACT), tCCD (CAS), tWTR and tRTP,
+        # with short/long tRRD/tCCD between banks of different/same bank groups (DDR4).
+        write_latency = math.ceil(settings.phy.cwl / settings.phy.nphases)
+        twtr = settings.timing.tWTR + write_latency
+        if settings.timing.tCCD is not None:
+            # tCCD must be added since tWTR begins after the transfer is complete
+            twtr += settings.timing.tCCD
+        # CAS to CAS of different ranks: burst + rank switch penalty (DRAM clocks).
+        nranks  = settings.phy.nranks
+        ngroups = 2**getattr(settings.geom, "bankgroupbits", 0)
+        trtrs   = None
+        if nranks > 1:
+            burst_clocks = max(burst_lengths[settings.phy.memtype]//2, 1)
+            trtrs = math.ceil((burst_clocks + settings.rank_switch_penalty)/nphases)
+        self.submodules.timing = timing = TimingScoreboard(
+            nbanks  = len(bank_machines),
+            nranks  = nranks,
+            tRRD    = settings.timing.tRRD,
+            tFAW    = settings.timing.tFAW,
+            tCCD    = settings.timing.tCCD,
+            tWTR    = twtr,
+            tRTP    = getattr(settings.timing, "tRTP", None),
+            ngroups = ngroups,
+            tCCD_S  = getattr(settings.timing, "tCCD_S", None),
+            tRRD_S  = getattr(settings.timing, "tRRD_S", None),
+            tRTRS   = trtrs)
+
+        # Requests that can't be issued this cycle are excluded from the arbitration.
         requests = [bm.cmd for bm in bank_machines]
-        self.submodules.choose_cmd = choose_cmd = _CommandChooser(requests)
-        self.submodules.choose_req = choose_req = _CommandChooser(requests)
+        blocked  = Signal(len(requests))
+        for i, req in enumerate(requests):
+            is_act = req.ras & ~req.cas & ~req.we
+            is_pre = req.ras & ~req.cas &  req.we
+            self.comb += blocked[i].eq(
+                (is_act       & ~timing.can_act[i])   |
+                (req.is_read  & ~timing.can_read[i])  |
+                (req.is_write & ~timing.can_write[i]) |
+                (is_pre       & ~timing.can_pre[i]))
+
+        # Command choosing -------------------------------------------------------------------------
+        pipelined = settings.with_cmd_pipeline
+        self.submodules.choose_cmd = choose_cmd = _CommandChooser(requests, pipelined)
+        self.submodules.choose_req = choose_req = _CommandChooser(requests, pipelined)
+        self.comb += choose_cmd.exclude.eq(blocked)
+        self.comb += choose_req.exclude.eq(blocked)
+        # Favor CAS to the rank of the last CAS (no rank switch) and, within it, to the other bank
+        # groups (tCCD_S instead of tCCD_L).
+        prefer = Cat(*timing.cas_alternate)
+        if nranks > 1:
+            same_rank = Cat(*timing.cas_same_rank)
+            prefer    = (same_rank & prefer) if ngroups > 1 else same_rank
+        self.comb += choose_req.prefer.eq(prefer)
         if settings.phy.nphases == 1:
             # When only 1 phase, use choose_req for all requests
             choose_cmd = choose_req
             self.comb += choose_req.want_cmds.eq(1)
-            self.comb += choose_req.want_activates.eq(ras_allowed)
+            self.comb += choose_req.want_activates.eq(1)
+
+        # Additional command choosers: issue non-ACT commands (PRE) on the DFI phases left free by
+        # choose_cmd/choose_req, ACTs are only issued by choose_cmd so tRRD/tFAW are kept enforced.
+        # Issuing several ACTs per cycle is deliberately not supported: tRRD (>= 4 clocks on DDR3/
+        # DDR4) already spans a 1:4 controller cycle, so at most one ACT per cycle could be legal.
+        choose_cmds = []
+        if settings.cmd_choosers > 1:
+            assert settings.cmd_choosers - 1 <= nphases - 2
+            exclude = blocked | choose_cmd.selected
+            for n in range(settings.cmd_choosers - 1):
+                chooser = _CommandChooser(requests, pipelined)
+                setattr(self.submodules, "choose_cmd{}".format(n + 1), chooser)
+                self.comb += chooser.exclude.eq(exclude)
+                exclude = exclude | chooser.selected
+                choose_cmds.append(chooser)
 
         # Command steering -------------------------------------------------------------------------
         nop = Record(cmd_request_layout(settings.geom.addressbits,
                                         log2_int(len(bank_machines))))
         # nop must be 1st
-        commands = [nop, choose_cmd.cmd, choose_req.cmd, refresher.cmd]
-        steerer = _Steerer(commands, dfi)
+        commands = [nop, choose_cmd.cmd, choose_req.cmd, refresher.cmd] + [c.cmd for c in choose_cmds]
+        # Dynamic ODT is held from the READ/WRITE command to the end of the burst: ODT latency
+        # (CWL - 2) + non-target READ delay (CL - CWL) + burst + ODT off latency (CWL - 2).
+        odt_cycles = None
+        if settings.with_dynamic_odt:
+            burst_clocks = max(burst_lengths[settings.phy.memtype]//2, 1)
+            odt_clocks   = max(settings.phy.cl - settings.phy.cwl, 0) + burst_clocks + 2
+            odt_cycles   = math.ceil(odt_clocks/nphases) + 1
+        with_lowpower = settings.powerdown_timeout is not None or settings.selfrefresh_timeout is not None
+        steerer = _Steerer(commands, dfi,
+            refresh_all_ranks = not getattr(refresher, "per_rank", False),
+            odt_cycles        = odt_cycles,
+            cke               = refresher.cke if with_lowpower else None)
         self.submodules += steerer
 
-        # tRRD timing (Row to Row delay) -----------------------------------------------------------
-        self.submodules.trrdcon = trrdcon = tXXDController(settings.timing.tRRD)
-        self.comb += trrdcon.valid.eq(choose_cmd.accept() & choose_cmd.activate())
-
-        # tFAW timing (Four Activate Window) -------------------------------------------------------
-        self.submodules.tfawcon = tfawcon = tFAWController(settings.timing.tFAW)
-        self.comb += tfawcon.valid.eq(choose_cmd.accept() & choose_cmd.activate())
-
-        # RAS control ------------------------------------------------------------------------------
-        self.comb += ras_allowed.eq(trrdcon.ready & tfawcon.ready)
-
-        # tCCD timing (Column to Column delay) -----------------------------------------------------
-        self.submodules.tccdcon = tccdcon = tXXDController(settings.timing.tCCD)
-        self.comb += tccdcon.valid.eq(choose_req.accept() & (choose_req.write() | choose_req.read()))
-
-        # CAS control ------------------------------------------------------------------------------
-        self.comb += cas_allowed.eq(tccdcon.ready)
-
-        # tWTR timing (Write to Read delay) --------------------------------------------------------
-        write_latency = math.ceil(settings.phy.cwl / settings.phy.nphases)
-        self.submodules.twtrcon = twtrcon = tXXDController(
-            settings.timing.tWTR + write_latency +
-            # tCCD must be added since tWTR begins after the transfer is complete
-            settings.timing.tCCD if settings.timing.tCCD is not None else 0)
-        self.comb += twtrcon.valid.eq(choose_req.accept() & choose_req.write())
+        # Issued commands --------------------------------------------------------------------------
+        self.comb += [
+            timing.act.eq(choose_cmd.accept() & choose_cmd.activate()),
+            timing.act_ba.eq(choose_cmd.cmd.ba),
+            timing.read.eq(choose_req.accept() & choose_req.read()),
+            timing.write.eq(choose_req.accept() & choose_req.write()),
+            timing.cas_ba.eq(choose_req.cmd.ba),
+        ]
 
         # Read/write turnaround --------------------------------------------------------------------
         read_available = Signal()
@@ -295,12 +478,72 @@ class Multiplexer(Module, AutoCSR):
             write_available.eq(reduce(or_, writes))
         ]
 
+        # Scheduling CSRs -------------------------------------------------------------------------
+        # Read/write times, write drain watermarks and write age limit can be tuned at runtime
+        # (0 disables the corresponding timeout/watermark; with read priority, writes are issued
+        # when no read is available once both the drain high watermark and the write age limit
+        # are disabled).
+        read_time        = settings.read_time
+        write_time       = settings.write_time
+        write_drain_high = settings.write_drain_high
+        write_drain_low  = settings.write_drain_low
+        write_age_limit  = settings.write_age_limit
+        if settings.with_sched_csrs:
+            self._read_time        = CSRStorage(16, name="read_time", reset=read_time or 0)
+            self._write_time       = CSRStorage(16, name="write_time", reset=write_time or 0)
+            self._write_drain_high = CSRStorage(bits_for(len(requests)), name="write_drain_high",
+                reset=write_drain_high or 0)
+            self._write_drain_low  = CSRStorage(bits_for(len(requests)), name="write_drain_low",
+                reset=write_drain_low)
+            self._write_age_limit  = CSRStorage(16, name="write_age_limit",
+                reset=write_age_limit or 0)
+            read_time        = self._read_time.storage
+            write_time       = self._write_time.storage
+            write_drain_high = self._write_drain_high.storage
+            write_drain_low  = self._write_drain_low.storage
+            write_age_limit  = self._write_age_limit.storage
+
+        # Write draining ---------------------------------------------------------------------------
+        # When enabled, pending writes (number of BankMachines with a write ready to be issued) are
+        # batched: the FSM switches to WRITE as soon as they reach the high watermark and only goes
+        # back to READ when they are drained below the low watermark.
+        write_drain_start = Signal()
+        write_drain_stop  = Signal()
+        writes_pending    = Signal(max=len(requests) + 1)
+        self.comb += writes_pending.eq(reduce(add, writes))
+        if isinstance(write_drain_high, Signal):
+            self.comb += [
+                write_drain_start.eq((write_drain_high != 0) & (writes_pending >= write_drain_high)),
+                If(write_drain_high != 0,
+                    write_drain_stop.eq(writes_pending <= write_drain_low)
+                ).Else(
+                    write_drain_stop.eq(~write_available)
+                )
+            ]
+        elif write_drain_high is not None:
+            assert 0 <= write_drain_low < write_drain_high <= len(requests)
+            self.comb += [
+                write_drain_start.eq(writes_pending >= write_drain_high),
+                write_drain_stop.eq(writes_pending <= write_drain_low),
+            ]
+        else:
+            self.comb += write_drain_stop.eq(~write_available)
+
         # Anti Starvation --------------------------------------------------------------------------
 
         def anti_starvation(timeout):
             en = Signal()
             max_time = Signal()
-            if timeout:
+            if isinstance(timeout, Signal):
+                # Count up so that a new timeout applies immediately.
+                time = Signal.like(timeout)
+                self.comb += max_time.eq((timeout != 0) & (time >= (timeout - 1)))
+                self.sync += If(~en,
+                        time.eq(0)
+                    ).Elif(~max_time,
+                        time.eq(time + 1)
+                    )
+            elif timeout:
                 t = timeout - 1
                 time = Signal(max=t+1)
                 self.comb += max_time.eq(time == 0)
@@ -313,14 +556,54 @@ class Multiplexer(Module, AutoCSR):
                 self.comb += max_time.eq(0)
             return en, max_time
 
-        read_time_en,   max_read_time = anti_starvation(settings.read_time)
-        write_time_en, max_write_time = anti_starvation(settings.write_time)
+        read_time_en,   max_read_time = anti_starvation(read_time)
+        write_time_en, max_write_time = anti_starvation(write_time)
+
+        # Read priority ----------------------------------------------------------------------------
+        # Writes are held (while reads are serviced or the bus is idle) until the drain high
+        # watermark is reached or the writes have been waiting for write_age_limit cycles. When both
+        # are disabled, writes are issued when no read is available.
+        write_age_en, max_write_age = anti_starvation(write_age_limit if settings.read_priority else 0)
+        if settings.read_priority:
+            if isinstance(write_age_limit, Signal):
+                read_to_write = write_drain_start | max_write_age | (
+                    ~read_available & (write_drain_high == 0) & (write_age_limit == 0))
+            elif (write_drain_high is None) and not write_age_limit:
+                read_to_write = ~read_available
+            else:
+                read_to_write = write_drain_start | max_write_age
+        else:
+            read_to_write = ~read_available | max_read_time | write_drain_start
 
         # Refresh ----------------------------------------------------------------------------------
-        self.comb += [bm.refresh_req.eq(refresher.cmd.valid) for bm in bank_machines]
         go_to_refresh = Signal()
-        bm_refresh_gnts = [bm.refresh_gnt for bm in bank_machines]
-        self.comb += go_to_refresh.eq(reduce(and_, bm_refresh_gnts))
+        if getattr(refresher, "per_rank", False):
+            # Per-rank refresh: only block the BankMachines of the refreshed rank.
+            nbanks = 2**settings.geom.bankbits
+            rank_refresh_gnts = []
+            for r in range(nranks):
+                bms = bank_machines[r*nbanks:(r + 1)*nbanks]
+                self.comb += [bm.refresh_req.eq(refresher.bank_req & (refresher.rank == r)) for bm in bms]
+                rank_refresh_gnts.append(reduce(and_, [bm.refresh_gnt for bm in bms]))
+            self.comb += go_to_refresh.eq(refresher.cmd.valid & Array(rank_refresh_gnts)[refresher.rank])
+        elif getattr(refresher, "per_bank", False):
+            # Per-bank refresh: only block the BankMachines of the refreshed bank (on all ranks).
+            nbanks = 2**settings.geom.bankbits
+            bank_refresh_gnts = []
+            for b in range(nbanks):
+                bms = bank_machines[b::nbanks]
+                self.comb += [bm.refresh_req.eq(refresher.bank_req & (refresher.bank == b)) for bm in bms]
+                bank_refresh_gnts.append(reduce(and_, [bm.refresh_gnt for bm in bms]))
+            self.comb += go_to_refresh.eq(refresher.cmd.valid & Array(bank_refresh_gnts)[refresher.bank])
+        else:
+            self.comb += [bm.refresh_req.eq(refresher.cmd.valid) for bm in bank_machines]
+            bm_refresh_gnts = [bm.refresh_gnt for bm in bank_machines]
+            self.comb += go_to_refresh.eq(reduce(and_, bm_refresh_gnts))
+        if hasattr(refresher, "idle"):
+            self.comb += refresher.idle.eq(~reduce(or_, [bm.cmd.valid for bm in bank_machines]))
+        if hasattr(refresher, "wake"):
+            reqs = [getattr(interface, "bank"+str(n)) for n in range(len(bank_machines))]
+            self.comb += refresher.wake.eq(reduce(or_, [req.valid for req in reqs]))
 
         # Datapath ---------------------------------------------------------------------------------
         all_rddata = [p.rddata for p in dfi.phases]
@@ -332,35 +615,61 @@ class Multiplexer(Module, AutoCSR):
             Cat(*all_wrdata_mask).eq(~interface.wdata_we)
         ]
 
+        # Additional command choosers use the phases following the REQ phase.
+        def extra_cmdphases(phase):
+            r = []
+            for n in range(len(choose_cmds)):
+                if isinstance(phase, Signal):
+                    extra_phase = Signal.like(phase)
+                    self.comb += extra_phase.eq(phase + 1 + n) # Implicit %nphases.
+                else:
+                    extra_phase = (phase + 1 + n)%nphases
+                r.append(extra_phase)
+            return r
+        rdextraphases = extra_cmdphases(rdphase)
+        wrextraphases = extra_cmdphases(wrphase)
+
         def steerer_sel(steerer, access):
             assert access in ["read", "write"]
             r = []
             for i in range(nphases):
                 r.append(steerer.sel[i].eq(STEER_NOP))
                 if access == "read":
+                    for n, phase in enumerate(rdextraphases):
+                        r.append(If(i == phase, steerer.sel[i].eq(STEER_REFRESH + 1 + n)))
                     r.append(If(i == rdphase,    steerer.sel[i].eq(STEER_REQ)))
                     r.append(If(i == rdcmdphase, steerer.sel[i].eq(STEER_CMD)))
                 if access == "write":
+                    for n, phase in enumerate(wrextraphases):
+                        r.append(If(i == phase, steerer.sel[i].eq(STEER_REFRESH + 1 + n)))
                     r.append(If(i == wrphase,    steerer.sel[i].eq(STEER_REQ)))
                     r.append(If(i == wrcmdphase, steerer.sel[i].eq(STEER_CMD)))
             return r
 
+        def choose_cmds_want():
+            # Wanting both reads and writes filters out all CAS requests, leaving non-ACT commands.
+            # Commands are always accepted: with cmd_choosers - 1 <= nphases - 2, the phases
+            # following the REQ phase never reach the CMD phase, so each additional chooser always
+            # has its own DFI phase.
+            return [[
+                c.want_reads.eq(1),
+                c.want_writes.eq(1),
+                c.want_cmds.eq(1),
+                c.cmd.ready.eq(1)
+            ] for c in choose_cmds]
+
         # Control FSM ------------------------------------------------------------------------------
         self.submodules.fsm = fsm = FSM()
         fsm.act("READ",
             read_time_en.eq(1),
             choose_req.want_reads.eq(1),
-            If(settings.phy.nphases == 1,
-                choose_req.cmd.ready.eq(cas_allowed & (~choose_req.activate() | ras_allowed))
-            ).Else(
-                choose_cmd.want_activates.eq(ras_allowed),
-                choose_cmd.cmd.ready.eq(~choose_cmd.activate() | ras_allowed),
-                choose_req.cmd.ready.eq(cas_allowed)
-            ),
+            choose_cmd.want_activates.eq(1),
+            choose_cmd.cmd.ready.eq(1),
+            choose_req.cmd.ready.eq(1),
+            choose_cmds_want(),
             steerer_sel(steerer, access="read"),
             If(write_available,
-                # TODO: switch only after several cycles of ~read_available?
-                If(~read_available | max_read_time,
+                If(read_to_write,
                     NextState("RTW")
                 )
             ),
@@ -371,16 +680,13 @@ class Multiplexer(Module, AutoCSR):
         fsm.act("WRITE",
             write_time_en.eq(1),
             choose_req.want_writes.eq(1),
-            If(settings.phy.nphases == 1,
-                choose_req.cmd.ready.eq(cas_allowed & (~choose_req.activate() | ras_allowed))
-            ).Else(
-                choose_cmd.want_activates.eq(ras_allowed),
-                choose_cmd.cmd.ready.eq(~choose_cmd.activate() | ras_allowed),
-                choose_req.cmd.ready.eq(cas_allowed),
-            ),
+            choose_cmd.want_activates.eq(1),
+            choose_cmd.cmd.ready.eq(1),
+            choose_req.cmd.ready.eq(1),
+            choose_cmds_want(),
             steerer_sel(steerer, access="write"),
             If(read_available,
-                If(~write_available | max_write_time,
+                If(write_drain_stop | max_write_time,
                     NextState("WTR")
                 )
             ),
@@ -396,13 +702,41 @@ class Multiplexer(Module, AutoCSR):
             )
         )
         fsm.act("WTR",
-            If(twtrcon.ready,
+            If(reduce(and_, timing.can_read),
                 NextState("READ")
             )
         )
-        # TODO: reduce this, actual limit is around (cl+1)/nphases
-        fsm.delayed_enter("RTW", "WRITE", settings.phy.read_latency-1)
+        # Read to write turnaround: by default wait for the read data to come back from the PHY.
+        # With with_fast_rtw, only wait for the read burst to leave the DRAM bus: the WRITE data
+        # (CWL after the command) must start at least 2 tCK after the read data ends (CL + BL/2).
+        rtw = settings.phy.read_latency - 1
+        if settings.with_fast_rtw and settings.phy.memtype != "SDR":
+            burst_cycles = burst_lengths[settings.phy.memtype]//2
+            if isinstance(rdphase, Signal) or isinstance(wrphase, Signal):
+                phase_offset = nphases - 1
+            else:
+                phase_offset = rdphase - wrphase
+            rtw_ck = settings.phy.cl + burst_cycles + 2 - settings.phy.cwl + phase_offset
+            # The first cycle is spent leaving READ.
+            rtw = min(rtw, max(math.ceil(rtw_ck/nphases) - 1, 0))
+        fsm_states = set(fsm.actions)
+        fsm.delayed_enter("RTW", "WRITE", rtw)
+        rtw_states = [state for state in fsm.actions if state not in fsm_states]
+
+        if settings.read_priority:
+            self.comb += write_age_en.eq(write_available & ~fsm.ongoing("WRITE"))
 
         if settings.with_bandwidth:
             data_width = settings.phy.dfi_databits*settings.phy.nphases
             self.submodules.bandwidth = Bandwidth(self.choose_req.cmd, data_width)
+
+        if settings.with_perfmon:
+            states = {name.lower(): fsm.ongoing(name) for name in ["READ", "WRITE", "WTR", "REFRESH"]}
+            # RTW spans the states generated by delayed_enter (none when RTW is an alias of WRITE).
+            states["rtw"] = Signal()
+            self.comb += states["rtw"].eq(reduce(or_, [fsm.ongoing(s) for s in rtw_states], 0))
+            # Low power states (spent in REFRESH)
+            if with_lowpower:
+                states["powerdown"]   = refresher.powerdown
+                states["selfrefresh"] = refresher.selfrefresh
+            self.submodules.perfmon = PerformanceMonitor(dfi, bank_machines, states)
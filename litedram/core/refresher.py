@@ -7,13 +7,40 @@
 
 """LiteDRAM Refresher."""
 
+import math
+
 from migen import *
-from migen.genlib.misc import timeline
+from migen.genlib.misc import timeline, WaitTimer
 
 from litex.soc.interconnect import stream
 
 from litedram.core.multiplexer import *
 
+# Helpers ------------------------------------------------------------------------------------------
+
+def runtime_timeline(trigger, events):
+    """migen's timeline, also accepting runtime timings (Signals) in the event times"""
+    if all(isinstance(t, int) for t, actions in events):
+        return timeline(trigger, events)
+    lastevent = events[-1][0]
+    counter   = Signal(max(bits_for(t) if isinstance(t, int) else len(t) for t, actions in events))
+    sync = []
+    for t, actions in events:
+        if isinstance(t, int) and t == 0:
+            sync.append(If(trigger & (counter == 0), *actions))
+        else:
+            sync.append(If(counter == t, *actions))
+    sync.append(
+        If(counter == lastevent,
+            counter.eq(0)
+        ).Elif(counter != 0,
+            counter.eq(counter + 1)
+        ).Elif(trigger,
+            counter.eq(1)
+        )
+    )
+    return sync
+
 # RefreshExecuter ----------------------------------------------------------------------------------
 
 class RefreshExecuter(Module):
@@ -39,7 +66,7 @@ class RefreshExecuter(Module):
             cmd.we.eq( 0),
             self.done.eq(0),
             # Wait start
-            timeline(self.start, [
+            runtime_timeline(self.start, [
                 # Precharge All
                 (0, [
                     cmd.a.eq(  2**10),
@@ -73,21 +100,23 @@ class RefreshExecuter(Module):
 class RefreshSequencer(Module):
     """Refresh Sequencer
 
-    Sequence N refreshs to the DRAM.
+    Sequence N refreshs to the DRAM (`nrefreshs`, up to `postponing`).
     """
     def __init__(self, cmd, trp, trfc, postponing=1):
-        self.start = Signal()
-        self.done  = Signal()
+        self.start     = Signal()
+        self.done      = Signal()
+        self.nrefreshs = Signal(max=postponing + 1, reset=postponing)
+        self.refreshed = Signal()
 
         # # #
 
         executer = RefreshExecuter(cmd, trp, trfc)
         self.submodules += executer
 
-        count = Signal(bits_for(postponing), reset=postponing-1)
+        count = Signal(bits_for(postponing))
         self.sync += [
             If(self.start,
-                count.eq(count.reset)
+                count.eq(self.nrefreshs - 1)
             ).Elif(executer.done,
                 If(count != 0,
                     count.eq(count - 1)
@@ -96,29 +125,37 @@ class RefreshSequencer(Module):
         ]
         self.comb += executer.start.eq(self.start | (count != 0))
         self.comb += self.done.eq(executer.done & (count == 0))
+        self.comb += self.refreshed.eq(executer.done)
 
 # RefreshTimer -------------------------------------------------------------------------------------
 
 class RefreshTimer(Module):
     """Refresh Timer
 
-    Generate periodic pulses (tREFI period) to trigger DRAM refresh.
+    Generate periodic pulses (tREFI period) to trigger DRAM refresh, `trefi` can be a Signal
+    (runtime timing).
     """
     def __init__(self, trefi):
+        width = len(trefi) if isinstance(trefi, Signal) else bits_for(trefi)
         self.wait  = Signal()
         self.done  = Signal()
-        self.count = Signal(bits_for(trefi))
+        self.count = Signal(width)
 
         # # #
 
         done  = Signal()
-        count = Signal(bits_for(trefi), reset=trefi-1)
+        if isinstance(trefi, Signal):
+            count  = Signal(width, reset=trefi.reset.value-1)
+            reload = trefi - 1
+        else:
+            count  = Signal(width, reset=trefi-1)
+            reload = count.reset
 
         self.sync += [
             If(self.wait & ~self.done,
                 count.eq(count - 1)
             ).Else(
-                count.eq(count.reset)
+                count.eq(reload)
             )
         ]
         self.comb += [
@@ -162,8 +199,10 @@ class ZQCSExecuter(Module):
     - Wait tRP
     - Send an "ZQ Short Calibration" command
     - Wait tZQCS
+
+    `ba` selects the rank with per-rank refresh (rank in the MSBs of the bank address).
     """
-    def __init__(self, cmd, trp, tzqcs):
+    def __init__(self, cmd, trp, tzqcs, ba=0):
         self.start = Signal()
         self.done  = Signal()
 
@@ -173,11 +212,11 @@ class ZQCSExecuter(Module):
             # Note: Don't set cmd to 0 since already done in RefreshExecuter
             self.done.eq(0),
             # Wait start
-            timeline(self.start, [
+            runtime_timeline(self.start, [
                 # Precharge All
                 (0, [
                     cmd.a.eq(  2**10),
-                    cmd.ba.eq( 0),
+                    cmd.ba.eq( ba),
                     cmd.cas.eq(0),
                     cmd.ras.eq(1),
                     cmd.we.eq( 1)
@@ -185,7 +224,7 @@ class ZQCSExecuter(Module):
                 # ZQ Short Calibration after tRP
                 (trp, [
                     cmd.a.eq(  0),
-                    cmd.ba.eq( 0),
+                    cmd.ba.eq( ba),
                     cmd.cas.eq(0),
                     cmd.ras.eq(0),
                     cmd.we.eq( 1),
@@ -202,6 +241,78 @@ class ZQCSExecuter(Module):
             ])
         ]
 
+# LowPowerExecuter ---------------------------------------------------------------------------------
+
+class LowPowerExecuter(Module):
+    """Low Power Executer
+
+    Execute the precharge power-down/self-refresh entry and exit sequences to the DRAM:
+    - Send a "Precharge All" command
+    - Wait tRP
+    - Set CKE low (along with an "Auto Refresh" command for self-refresh)
+    - Keep CKE low for at least tCKE
+    - On exit, set CKE high and wait tXP (power-down) or tXS (self-refresh)
+    """
+    def __init__(self, cmd, trp, tcke, txp, txs):
+        self.start_pd    = Signal()
+        self.start_sr    = Signal()
+        self.exit        = Signal()
+        self.ready       = Signal() # can exit
+        self.done        = Signal()
+        self.powerdown   = Signal()
+        self.selfrefresh = Signal()
+        self.cke         = Signal(reset=1)
+
+        # # #
+
+        sr    = Signal()
+        count = Signal(max=tcke + 1)
+        self.sync += [
+            # Note: Don't set cmd to 0 since already done in RefreshExecuter
+            self.done.eq(0),
+            If(self.start_pd | self.start_sr,
+                sr.eq(self.start_sr)
+            ),
+            If(count != 0,
+                count.eq(count - 1)
+            ),
+            # Wait start
+            runtime_timeline(self.start_pd | self.start_sr, [
+                # Precharge All
+                (0, [
+                    cmd.a.eq(  2**10),
+                    cmd.ba.eq( 0),
+                    cmd.cas.eq(0),
+                    cmd.ras.eq(1),
+                    cmd.we.eq( 1)
+                ]),
+                # CKE low after tRP (Self Refresh Entry: "Auto Refresh" with CKE low)
+                (trp, [
+                    If(sr,
+                        cmd.a.eq(  0),
+                        cmd.ba.eq( 0),
+                        cmd.cas.eq(1),
+                        cmd.ras.eq(1),
+                        cmd.we.eq( 0),
+                    ),
+                    self.cke.eq(0),
+                    count.eq(tcke - 1),
+                ]),
+            ]),
+            # Wait exit
+            runtime_timeline(self.exit, [
+                (0, [self.cke.eq(1)]),
+                # Done after tXP/tXS
+                (txp, [If(~sr, self.done.eq(1))]),
+                (txs, [If( sr, self.done.eq(1))]),
+            ])
+        ]
+        self.comb += [
+            self.ready.eq(~self.cke & (count == 0)),
+            self.powerdown.eq(~self.cke & ~sr),
+            self.selfrefresh.eq(~self.cke & sr),
+        ]
+
 # Refresher ----------------------------------------------------------------------------------------
 
 class Refresher(Module):
@@ -217,35 +328,69 @@ class Refresher(Module):
     this allows the Controller to finish the current transaction and block next transactions. Once all
     transactions are done, the Refresher can execute the refresh Sequence and release the Controller.
 
+    Refreshs are tracked with a debt counter incremented every tREFI: owed refreshs are issued one
+    at a time when the controller is idle (`idle` driven by the Multiplexer, no new request on
+    `wake`) and are only forced, back to back, when `postponing` refreshs are owed (8 per JEDEC).
+
+    When `settings.powerdown_timeout`/`settings.selfrefresh_timeout` are set, the Refresher also
+    takes the Controller the same way after the given number of idle cycles to put the DRAM in
+    precharge power-down (CKE low) and then in self-refresh. The DRAM is woken up (tXP/tXS) on new
+    requests and, from power-down, on refresh. The time spent in each state is reported on the
+    `powerdown`/`selfrefresh` signals.
     """
     def __init__(self, settings, clk_freq, zqcs_freq=1e0, postponing=1):
         assert postponing <= 8
         abits  = settings.geom.addressbits
         babits = settings.geom.bankbits + log2_int(settings.phy.nranks)
         self.cmd = cmd = stream.Endpoint(cmd_request_rw_layout(a=abits, ba=babits))
+        self.idle        = Signal()       # no command pending on the BankMachines
+        self.wake        = Signal()       # new request from the user interface
+        self.cke         = Signal(reset=1)
+        self.powerdown   = Signal()
+        self.selfrefresh = Signal()
 
         # # #
 
         wants_refresh = Signal()
         wants_zqcs    = Signal()
+        refresh_due   = Signal()
+
+        powerdown_timeout   = getattr(settings, "powerdown_timeout",   None)
+        selfrefresh_timeout = getattr(settings, "selfrefresh_timeout", None)
+        with_lowpower = powerdown_timeout is not None or selfrefresh_timeout is not None
 
         # Refresh Timer ----------------------------------------------------------------------------
-        if settings.timing.tREFI < 100: # FIXME: Reduce Margin.
+        trefi = settings.timing.tREFI
+        if isinstance(trefi, Signal):
+            trefi = trefi.reset.value
+        if trefi < 100: # FIXME: Reduce Margin.
             raise ValueError("Clk/tREFI is ratio too low , please increase Clk frequency or disable Refresh.")
         timer = RefreshTimer(settings.timing.tREFI)
         self.submodules.timer = timer
         self.comb += timer.wait.eq(~timer.done)
 
-        # Refresh Postponer ------------------------------------------------------------------------
-        postponer = RefreshPostponer(postponing)
-        self.submodules.postponer = postponer
-        self.comb += postponer.req_i.eq(self.timer.done)
-        self.comb += wants_refresh.eq(postponer.req_o)
-
         # Refresh Sequencer ------------------------------------------------------------------------
         sequencer = RefreshSequencer(cmd, settings.timing.tRP, settings.timing.tRFC, postponing)
         self.submodules.sequencer = sequencer
 
+        # Refresh Debt -----------------------------------------------------------------------------
+        # Owed refreshs are issued one at a time when the controller is idle, or all at once when
+        # `postponing` refreshs are owed. No refresh is owed while the DRAM is in self-refresh.
+        debt   = Signal(max=postponing + 2)
+        forced = Signal()
+        self.sync += [
+            If(timer.done & ~self.selfrefresh & ~sequencer.refreshed,
+                debt.eq(debt + 1)
+            ).Elif(~(timer.done & ~self.selfrefresh) & sequencer.refreshed,
+                debt.eq(debt - 1)
+            )
+        ]
+        self.comb += [
+            forced.eq(debt >= postponing),
+            wants_refresh.eq(forced | (self.idle & ~self.wake & (debt != 0))),
+            sequencer.nrefreshs.eq(Mux(forced, postponing, 1)),
+        ]
+
         if settings.timing.tZQCS is not None:
             # ZQCS Timer ---------------------------------------------------------------------------
             zqcs_timer = RefreshTimer(int(clk_freq/zqcs_freq))
@@ -259,13 +404,16 @@ class Refresher(Module):
 
         # Refresh FSM ------------------------------------------------------------------------------
         self.submodules.fsm = fsm = FSM()
-        fsm.act("IDLE",
-            If(settings.with_refresh,
-                If(wants_refresh,
+        if settings.with_refresh:
+            self.comb += refresh_due.eq(wants_refresh)
+        if with_lowpower:
+            self.add_lowpower(settings, clk_freq, refresh_due, powerdown_timeout, selfrefresh_timeout)
+        else:
+            fsm.act("IDLE",
+                If(refresh_due,
                     NextState("WAIT-BANK-MACHINES")
                 )
             )
-        )
         fsm.act("WAIT-BANK-MACHINES",
             cmd.valid.eq(1),
             If(cmd.ready,
@@ -304,3 +452,385 @@ class Refresher(Module):
                     NextState("IDLE")
                 )
             )
+
+    def add_lowpower(self, settings, clk_freq, refresh_due, powerdown_timeout, selfrefresh_timeout):
+        cmd = self.cmd
+        fsm = self.fsm
+        txp = getattr(settings.timing, "tXP", None)
+        txs = getattr(settings.timing, "tXS", None)
+        if txp is None or txs is None:
+            raise ValueError("Power-down/self-refresh require the tXP/tXS timings.")
+        if None not in [powerdown_timeout, selfrefresh_timeout]:
+            assert selfrefresh_timeout > powerdown_timeout
+
+        # CKE minimum low time (max(4 tCK, 7.5ns) covers tCKE/tCKESR of DDR2/DDR3/DDR4).
+        tcke = max(math.ceil(4/settings.phy.nphases), math.ceil(7.5e-9*clk_freq))
+
+        # Low Power Executer -----------------------------------------------------------------------
+        lowpower = LowPowerExecuter(cmd, settings.timing.tRP, tcke, txp, txs)
+        self.submodules.lowpower = lowpower
+        self.comb += [
+            self.cke.eq(lowpower.cke),
+            self.powerdown.eq(lowpower.powerdown),
+            self.selfrefresh.eq(lowpower.selfrefresh),
+        ]
+        start = lowpower.start_sr if powerdown_timeout is None else lowpower.start_pd
+
+        # Idle Timer -------------------------------------------------------------------------------
+        idle_timeout = selfrefresh_timeout if powerdown_timeout is None else powerdown_timeout
+        idle_timer   = WaitTimer(idle_timeout)
+        self.submodules.idle_timer = idle_timer
+        self.comb += idle_timer.wait.eq(fsm.ongoing("IDLE") & self.idle & ~self.wake)
+
+        # Self-Refresh Timer (from power-down) -----------------------------------------------------
+        to_selfrefresh      = Signal()
+        to_selfrefresh_next = Signal()
+        if None not in [powerdown_timeout, selfrefresh_timeout]:
+            sr_timer = WaitTimer(selfrefresh_timeout - powerdown_timeout)
+            self.submodules.sr_timer = sr_timer
+            self.comb += sr_timer.wait.eq(lowpower.powerdown)
+            self.comb += to_selfrefresh.eq(sr_timer.done)
+
+        # Requests arriving while entering/in low power --------------------------------------------
+        wake_pending = Signal()
+        self.sync += [
+            If(self.wake,
+                wake_pending.eq(1)
+            ).Elif(fsm.ongoing("IDLE"),
+                wake_pending.eq(0)
+            )
+        ]
+        wake = Signal()
+        self.comb += wake.eq(self.wake | wake_pending | (refresh_due & lowpower.powerdown))
+
+        # Low Power FSM states ---------------------------------------------------------------------
+        fsm.act("IDLE",
+            If(refresh_due,
+                NextState("WAIT-BANK-MACHINES")
+            ).Elif(idle_timer.done,
+                NextState("LOW-POWER-WAIT-BANK-MACHINES")
+            )
+        )
+        fsm.act("LOW-POWER-WAIT-BANK-MACHINES",
+            cmd.valid.eq(1),
+            If(cmd.ready,
+                start.eq(1),
+                NextState("LOW-POWER")
+            )
+        )
+        fsm.act("LOW-POWER",
+            cmd.valid.eq(1),
+            If(lowpower.ready & (wake | to_selfrefresh),
+                lowpower.exit.eq(1),
+                NextValue(to_selfrefresh_next, ~wake),
+                NextState("LOW-POWER-EXIT")
+            )
+        )
+        fsm.act("LOW-POWER-EXIT",
+            cmd.valid.eq(1),
+            If(lowpower.done,
+                If(to_selfrefresh_next,
+                    lowpower.start_sr.eq(1),
+                    NextState("LOW-POWER")
+                ).Else(
+                    cmd.valid.eq(0),
+                    cmd.last.eq(1),
+                    NextState("IDLE")
+                )
+            )
+        )
+
+# PerBankRefreshExecuter ---------------------------------------------------------------------------
+
+class PerBankRefreshExecuter(Module):
+    """Per-Bank Refresh Executer
+
+    Execute the per-bank refresh sequence to the DRAM:
+    - Send a "Precharge" command to the bank
+    - Wait tRP
+    - Send a "Per-Bank Refresh" command to the bank
+    - Wait tRRD and release the command path
+    - Wait tRFC
+
+    With `a=2**10`, "Precharge All"/"Refresh All" commands are sent instead, to the rank selected by
+    `bank` (rank in the MSBs of the bank address): used for per-rank refresh.
+    """
+    def __init__(self, cmd, bank, trp, trfc, trrd, a=0):
+        assert trrd < trfc
+        self.start  = Signal()
+        self.issued = Signal()
+        self.done   = Signal()
+
+        # # #
+
+        self.sync += [
+            cmd.a.eq(  0),
+            cmd.ba.eq( 0),
+            cmd.cas.eq(0),
+            cmd.ras.eq(0),
+            cmd.we.eq( 0),
+            self.issued.eq(0),
+            self.done.eq(0),
+            # Wait start
+            timeline(self.start, [
+                # Precharge (A10 low: single bank)
+                (0, [
+                    cmd.a.eq(  a),
+                    cmd.ba.eq( bank),
+                    cmd.cas.eq(0),
+                    cmd.ras.eq(1),
+                    cmd.we.eq( 1)
+                ]),
+                # Per-Bank Refresh after tRP (A10/AB low: single bank)
+                (trp, [
+                    cmd.a.eq(  a),
+                    cmd.ba.eq( bank),
+                    cmd.cas.eq(1),
+                    cmd.ras.eq(1),
+                    cmd.we.eq( 0),
+                ]),
+                # Command path released after tRP + tRRD
+                (trp + trrd, [
+                    cmd.a.eq(  0),
+                    cmd.ba.eq( 0),
+                    cmd.cas.eq(0),
+                    cmd.ras.eq(0),
+                    cmd.we.eq( 0),
+                    self.issued.eq(1),
+                ]),
+                # Done after tRP + tRFC
+                (trp + trfc, [
+                    self.done.eq(1),
+                ]),
+            ])
+        ]
+
+# PerBankRefresher ---------------------------------------------------------------------------------
+
+class PerBankRefresher(Module):
+    """Per-Bank Refresher
+
+    Manage DRAM refresh with per-bank refresh and refresh pull-in.
+
+    On memories supporting per-bank refresh (LPDDR4/LPDDR5 REFpb), banks are refreshed one at a time
+    in round-robin order with a tREFI/nbanks period: only the refreshed bank is precharged and
+    blocked until tRFC is elapsed, the other banks keep being serviced once the Precharge/Refresh
+    commands have been issued (the Multiplexer only stalls for tRP + tRRD). Other memories (and
+    LPDDR with ZQCS enabled) use all-bank refreshes, as the Refresher does; DDR4 Fine Granularity
+    Refresh is selected through the module's fine_refresh_mode (shorter tREFI/tRFC).
+
+    In multi-rank systems without per-bank refresh, ranks are refreshed one at a time in round-robin
+    order with a tREFI/nranks period (staggered refresh): only the refreshed rank is precharged and
+    blocked until tRFC is elapsed (and ZQCS is done), the other ranks remain available.
+
+    Refreshes are tracked with a debt counter incremented every refresh interval. A refresh is forced
+    when `postponing` refreshes are owed and is pulled-in when the controller is idle (`idle`
+    driven by the Multiplexer), up to `pullin` refreshes (8 per JEDEC, per bank with per-bank
+    refresh) in advance.
+
+    Attributes
+    ----------
+    per_bank : bool
+        Whether per-bank refresh is used.
+    per_rank : bool
+        Whether per-rank (staggered) refresh is used.
+    bank : Signal(bankbits), out
+        Bank being refreshed (same bank on all ranks).
+    rank : Signal(max=nranks), out
+        Rank being refreshed (with per-rank refresh).
+    bank_req : Signal(), out
+        Refresh request to the BankMachines of `bank`/`rank`, held until tRFC is elapsed.
+    idle : Signal(), in
+        Controller is idle, allows refresh pull-in.
+    """
+    def __init__(self, settings, clk_freq, zqcs_freq=1e0, postponing=1, pullin=8):
+        assert postponing <= 8
+        assert pullin <= 8
+        for timeout in ["powerdown_timeout", "selfrefresh_timeout"]:
+            if getattr(settings, timeout, None) is not None:
+                raise ValueError("Power-down/self-refresh are only supported by the Refresher.")
+        if isinstance(settings.timing.tREFI, Signal):
+            raise ValueError("Runtime timings are only supported by the Refresher.")
+        abits  = settings.geom.addressbits
+        babits = settings.geom.bankbits + log2_int(settings.phy.nranks)
+        nbanks = 2**settings.geom.bankbits
+        nranks = settings.phy.nranks
+        self.cmd = cmd = stream.Endpoint(cmd_request_rw_layout(a=abits, ba=babits))
+
+        self.per_bank = settings.phy.memtype in ["LPDDR4", "LPDDR5"] and settings.timing.tZQCS is None
+        self.per_rank = nranks > 1 and not self.per_bank
+        self.bank     = Signal(settings.geom.bankbits)
+        self.rank     = Signal(max=max(nranks, 2))
+        self.bank_req = Signal()
+        self.idle     = Signal()
+
+        # # #
+
+        wants_refresh = Signal()
+        wants_zqcs    = Signal()
+        refreshed     = Signal()
+
+        # Refresh Timer ----------------------------------------------------------------------------
+        if settings.timing.tREFI < 100: # FIXME: Reduce Margin.
+            raise ValueError("Clk/tREFI is ratio too low , please increase Clk frequency or disable Refresh.")
+        nrefreshs = nbanks if self.per_bank else nranks
+        timer = RefreshTimer(settings.timing.tREFI//nrefreshs)
+        self.submodules.timer = timer
+        self.comb += timer.wait.eq(~timer.done)
+
+        # Refresh Debt -----------------------------------------------------------------------------
+        debt = Signal(min=-pullin*nrefreshs, max=postponing + 1)
+        self.sync += [
+            If(timer.done & ~refreshed,
+                debt.eq(debt + 1)
+            ).Elif(~timer.done & refreshed,
+                debt.eq(debt - 1)
+            )
+        ]
+        self.comb += wants_refresh.eq((debt >= postponing) | (self.idle & (debt > -pullin*nrefreshs)))
+
+        # Refresh Executer -------------------------------------------------------------------------
+        if self.per_bank:
+            executer = PerBankRefreshExecuter(cmd, self.bank,
+                trp  = settings.timing.tRP,
+                trfc = settings.timing.tRFC,
+                trrd = max(settings.timing.tRRD or 1, 1))
+            self.sync += If(refreshed, self.bank.eq(self.bank + 1))
+        elif self.per_rank:
+            rank_ba  = Signal(babits)
+            self.comb += rank_ba.eq(self.rank << settings.geom.bankbits)
+            executer = PerBankRefreshExecuter(cmd, rank_ba,
+                trp  = settings.timing.tRP,
+                trfc = settings.timing.tRFC,
+                trrd = max(settings.timing.tRRD or 1, 1),
+                a    = 2**10)
+            self.sync += If(refreshed, self.rank.eq(self.rank + 1))
+        else:
+            executer = RefreshSequencer(cmd, settings.timing.tRP, settings.timing.tRFC)
+        self.submodules.executer = executer
+
+        if settings.timing.tZQCS is not None:
+            # ZQCS Timer ---------------------------------------------------------------------------
+            zqcs_timer = RefreshTimer(int(clk_freq/zqcs_freq))
+            self.submodules.zqcs_timer = zqcs_timer
+            self.comb += wants_zqcs.eq(zqcs_timer.done)
+
+            # ZQCS Executer ------------------------------------------------------------------------
+            zqcs_executer = ZQCSExecuter(cmd, settings.timing.tRP, settings.timing.tZQCS,
+                ba = rank_ba if self.per_rank else 0)
+            self.submodules.zqs_executer = zqcs_executer
+            self.comb += zqcs_timer.wait.eq(~zqcs_executer.done)
+
+            # Per-rank ZQCS: each rank is calibrated after its next refresh.
+            if self.per_rank:
+                zqcs_pending = Signal(nranks)
+                zqcs_ranks   = Array(zqcs_pending[r] for r in range(nranks))
+                self.sync += [
+                    If(zqcs_timer.done,
+                        zqcs_pending.eq(2**nranks - 1)
+                    ).Elif(zqcs_executer.done,
+                        zqcs_ranks[self.rank].eq(0)
+                    )
+                ]
+
+        # Refresh FSM ------------------------------------------------------------------------------
+        self.submodules.fsm = fsm = FSM()
+        fsm.act("IDLE",
+            If(settings.with_refresh,
+                If(wants_refresh,
+                    NextState("WAIT-BANK-MACHINES")
+                )
+            )
+        )
+        fsm.act("WAIT-BANK-MACHINES",
+            self.bank_req.eq(1),
+            cmd.valid.eq(1),
+            If(cmd.ready,
+                executer.start.eq(1),
+                NextState("DO-REFRESH")
+            )
+        )
+        if self.per_bank or self.per_rank:
+            fsm.act("DO-REFRESH",
+                self.bank_req.eq(1),
+                cmd.valid.eq(1),
+                If(executer.issued,
+                    cmd.valid.eq(0),
+                    cmd.last.eq(1),
+                    NextState("WAIT-TRFC")
+                )
+            )
+            if self.per_rank and settings.timing.tZQCS is not None:
+                fsm.act("WAIT-TRFC",
+                    self.bank_req.eq(1),
+                    If(executer.done,
+                        If(zqcs_ranks[self.rank],
+                            NextState("WAIT-ZQCS")
+                        ).Else(
+                            refreshed.eq(1),
+                            NextState("IDLE")
+                        )
+                    )
+                )
+                fsm.act("WAIT-ZQCS",
+                    self.bank_req.eq(1),
+                    cmd.valid.eq(1),
+                    If(cmd.ready,
+                        zqcs_executer.start.eq(1),
+                        NextState("DO-ZQCS")
+                    )
+                )
+                fsm.act("DO-ZQCS",
+                    self.bank_req.eq(1),
+                    cmd.valid.eq(1),
+                    If(zqcs_executer.done,
+                        refreshed.eq(1),
+                        cmd.valid.eq(0),
+                        cmd.last.eq(1),
+                        NextState("IDLE")
+                    )
+                )
+            else:
+                fsm.act("WAIT-TRFC",
+                    self.bank_req.eq(1),
+                    If(executer.done,
+                        refreshed.eq(1),
+                        NextState("IDLE")
+                    )
+                )
+        elif settings.timing.tZQCS is None:
+            fsm.act("DO-REFRESH",
+                self.bank_req.eq(1),
+                cmd.valid.eq(1),
+                If(executer.done,
+                    refreshed.eq(1),
+                    cmd.valid.eq(0),
+                    cmd.last.eq(1),
+                    NextState("IDLE")
+                )
+            )
+        else:
+            fsm.act("DO-REFRESH",
+                self.bank_req.eq(1),
+                cmd.valid.eq(1),
+                If(executer.done,
+                    refreshed.eq(1),
+                    If(wants_zqcs,
+                        zqcs_executer.start.eq(1),
+                        NextState("DO-ZQCS")
+                    ).Else(
+                        cmd.valid.eq(0),
+                        cmd.last.eq(1),
+                        NextState("IDLE")
+                    )
+                )
+            )
+            fsm.act("DO-ZQCS",
+                self.bank_req.eq(1),
+                cmd.valid.eq(1),
+                If(zqcs_executer.done,
+                    cmd.valid.eq(0),
+                    cmd.last.eq(1),
+                    NextState("IDLE")
+                )
+            )
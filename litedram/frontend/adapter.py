@@ -374,3 +374,218 @@ class LiteDRAMNativePortConverter(Module):
         else:
             # Identity
             self.comb += port_from.connect(port_to)
+
+# LiteDRAMNativePortWriteBuffer --------------------------------------------------------------------
+
+class LiteDRAMNativePortWriteBuffer(Module):
+    """LiteDRAM port posted-write buffer
+
+    Writes from the user are acknowledged as soon as they are stored in one of the `depth` entries
+    of the buffer and are written to the controller later: when the buffer is full, when a command
+    is stalled on the buffer, on flush or when no write has been received for `timeout` cycles. A
+    write to an address already in the buffer is merged into its entry (using the byte enables),
+    so partial writes to the same address only generate one controller write.
+
+    A read hitting an entry with all its bytes written is served from the buffer (once the reads
+    already sent to the controller have returned, to keep the read data in order). A read hitting
+    an entry with missing bytes waits for the entry to be written to the controller before being
+    sent to it.
+    """
+    def __init__(self, port_from, port_to, depth=4, timeout=16):
+        assert port_from.clock_domain == port_to.clock_domain
+        assert port_from.data_width   == port_to.data_width
+        assert port_from.mode         == port_to.mode
+        assert port_from.mode in ["write", "both"]
+
+        # # #
+
+        mode      = port_from.mode
+        nbytes    = len(port_from.wdata.we)
+        idx_width = bits_for(max(depth - 1, 1))
+
+        self.comb += [
+            port_to.flush.eq(port_from.flush),
+            port_from.lock.eq(port_to.lock),
+        ]
+
+        # Entries ----------------------------------------------------------------------------------
+        valids = Array(Signal()                        for n in range(depth))
+        addrs  = Array(Signal(port_from.address_width) for n in range(depth))
+        datas  = Array(Signal(port_from.data_width)    for n in range(depth))
+        masks  = Array(Signal(nbytes)                  for n in range(depth))
+
+        # Lookup of the user command address (lowest index first).
+        hit      = Signal()
+        hit_idx  = Signal(idx_width)
+        free     = Signal()
+        free_idx = Signal(idx_width)
+        for n in reversed(range(depth)):
+            self.comb += [
+                If(valids[n] & (addrs[n] == port_from.cmd.addr),
+                    hit.eq(1),
+                    hit_idx.eq(n)
+                ),
+                If(~valids[n],
+                    free.eq(1),
+                    free_idx.eq(n)
+                )
+            ]
+
+        # Entries being written to the controller (can't be merged into or read from): entry of the
+        # write command presented to the controller and entries waiting for their write data.
+        drain_cmd = Signal()
+        drain_idx = Signal(idx_width)
+        draining  = Array(Signal() for n in range(depth))
+        # Entry waiting for the write data of an accepted write command.
+        wr_data   = Signal()
+        wr_idx    = Signal(idx_width)
+        hit_busy  = (draining[hit_idx] | (drain_cmd & (drain_idx == hit_idx)) |
+            (wr_data & (wr_idx == hit_idx)))
+        # Read command, forwarded from the buffer or sent to the controller.
+        rd_cmd    = Signal()
+        rd_fwd    = Signal()
+        rd_req    = Signal()  # Read presented to the controller.
+        rd_to     = Signal()  # Read accepted by the controller.
+        fwd_wait  = Signal()  # Forwarded data not accepted yet.
+
+        # Write Datapath ---------------------------------------------------------------------------
+        wr_cmd    = Signal()
+        wr_new    = Signal(idx_width)
+        wr_alloc  = Signal()
+        self.comb += [
+            wr_new.eq(Mux(hit, hit_idx, free_idx)),
+            wr_alloc.eq(~hit),
+            wr_cmd.eq(port_from.cmd.valid & port_from.cmd.we & ~wr_data & Mux(hit, ~hit_busy, free)),
+            port_from.wdata.ready.eq(wr_cmd | wr_data),
+        ]
+
+        # Merge the write data into the entry (bytes not written yet are kept/ignored).
+        merge_idx  = Mux(wr_data, wr_idx, wr_new)
+        merge_mask = Mux(wr_cmd & wr_alloc, 0, masks[merge_idx])
+        merge_data = Signal(port_from.data_width)
+        self.comb += merge_data.eq(datas[merge_idx])
+        for i in range(nbytes):
+            self.comb += If(port_from.wdata.we[i],
+                merge_data[8*i:8*(i + 1)].eq(port_from.wdata.data[8*i:8*(i + 1)])
+            )
+
+        self.sync += [
+            If(wr_cmd,
+                valids[wr_new].eq(1),
+                addrs[wr_new].eq(port_from.cmd.addr),
+                If(wr_alloc, masks[wr_new].eq(0)),
+                wr_data.eq(~port_from.wdata.valid),
+                wr_idx.eq(wr_new)
+            ).Elif(port_from.wdata.valid,
+                wr_data.eq(0)
+            ),
+            If(port_from.wdata.valid & port_from.wdata.ready,
+                datas[merge_idx].eq(merge_data),
+                masks[merge_idx].eq(merge_mask | port_from.wdata.we)
+            )
+        ]
+
+        # Drain ------------------------------------------------------------------------------------
+        # Write entries to the controller when the buffer is full, the user port is stalled on the
+        # buffer (write or read hitting an entry), flushed or has not written for `timeout` cycles.
+        # Write commands are issued back to back, the indexes of their entries being queued until
+        # their write data is accepted.
+        drain      = Signal()
+        drain_new  = Signal(idx_width)
+        idle       = Signal(max=timeout + 1, reset=timeout)
+        eligible   = [valids[n] & ~draining[n] & ~(drain_cmd & (drain_idx == n)) &
+            ~(wr_data & (wr_idx == n)) & ~(wr_cmd & (wr_new == n)) for n in range(depth)]
+        self.sync += \
+            If(wr_cmd,
+                idle.eq(timeout)
+            ).Elif(idle != 0,
+                idle.eq(idle - 1)
+            )
+        self.comb += [
+            drain.eq(~free | port_from.flush | (idle == 0) |
+                (port_from.cmd.valid & port_from.cmd.we & ~wr_cmd) | (rd_cmd & hit & ~rd_fwd)),
+            [If(eligible[n], drain_new.eq(n)) for n in reversed(range(depth))],
+        ]
+
+        # An entry is queued at most once, so the queue can't overflow.
+        drain_queue = stream.SyncFIFO([("idx", idx_width)], depth)
+        self.submodules += drain_queue
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            # Wait for a read presented to the controller to be accepted.
+            If(drain & (Cat(*eligible) != 0) & ~rd_req,
+                NextValue(drain_idx, drain_new),
+                NextState("CMD")
+            )
+        )
+        fsm.act("CMD",
+            drain_cmd.eq(1),
+            port_to.cmd.valid.eq(1),
+            port_to.cmd.we.eq(1),
+            port_to.cmd.addr.eq(addrs[drain_idx]),
+            If(port_to.cmd.ready,
+                drain_queue.sink.valid.eq(1),
+                # Continue with the next entry, unless a read is waiting for the controller.
+                If(drain & (Cat(*eligible) != 0) & ~rd_cmd,
+                    NextValue(drain_idx, drain_new)
+                ).Else(
+                    NextState("IDLE")
+                )
+            )
+        )
+        self.comb += [
+            drain_queue.sink.idx.eq(drain_idx),
+            port_to.wdata.valid.eq(drain_queue.source.valid),
+            port_to.wdata.data.eq(datas[drain_queue.source.idx]),
+            port_to.wdata.we.eq(masks[drain_queue.source.idx]),
+            drain_queue.source.ready.eq(port_to.wdata.ready),
+        ]
+        self.sync += [
+            If(drain_queue.sink.valid,
+                draining[drain_idx].eq(1)
+            ),
+            If(drain_queue.source.valid & drain_queue.source.ready,
+                valids[drain_queue.source.idx].eq(0),
+                draining[drain_queue.source.idx].eq(0)
+            )
+        ]
+
+        # Read Datapath ----------------------------------------------------------------------------
+        if mode == "both":
+            reads    = Signal(8)  # Reads sent to the controller and not returned yet.
+            fwd_data = Signal(port_from.data_width)
+            self.comb += [
+                rd_cmd.eq(port_from.cmd.valid & ~port_from.cmd.we),
+                rd_fwd.eq(rd_cmd & hit & ~hit_busy & (masks[hit_idx] == 2**nbytes - 1) &
+                    (reads == 0) & ~fwd_wait),
+                port_from.rdata.valid.eq(fwd_wait | port_to.rdata.valid),
+                port_from.rdata.data.eq(Mux(fwd_wait, fwd_data, port_to.rdata.data)),
+                port_to.rdata.ready.eq(port_from.rdata.ready),
+            ]
+            self.sync += [
+                If(rd_fwd,
+                    fwd_wait.eq(1),
+                    fwd_data.eq(datas[hit_idx])
+                ).Elif(port_from.rdata.ready,
+                    fwd_wait.eq(0)
+                ),
+                If(rd_to & ~port_to.rdata.valid,
+                    reads.eq(reads + 1)
+                ).Elif(~rd_to & port_to.rdata.valid,
+                    reads.eq(reads - 1)
+                )
+            ]
+
+            # Reads missing the buffer are sent to the controller when it is not used by the drain.
+            self.comb += [
+                rd_req.eq(~fsm.ongoing("CMD") & rd_cmd & ~hit & ~fwd_wait & (reads != 2**8 - 1)),
+                If(rd_req,
+                    port_to.cmd.valid.eq(1),
+                    port_to.cmd.we.eq(0),
+                    port_to.cmd.addr.eq(port_from.cmd.addr),
+                    rd_to.eq(port_to.cmd.ready)
+                )
+            ]
+
+        self.comb += port_from.cmd.ready.eq(wr_cmd | rd_fwd | rd_to)
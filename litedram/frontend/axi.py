@@ -10,15 +10,19 @@ AXI frontend for LiteDRAM
 Converts AXI ports to Native ports.
 
 Features:
-- Write/Read arbitration.
+- Write/Read arbitration (per burst, per beat or read priority with write aging) or separate Write/Read
+  Native ports.
 - Write/Read data buffers (configurable depth).
 - Burst support (FIXED/INCR/WRAP).
 - ID support (configurable width).
 - Optional Read-Modify-Write support (When only full words can be written on the DRAM, ex with ECC).
+- Optional burst mode (INCR bursts issued as Native command bursts, requires cmd_burst_max > 1).
+- Out-of-order read completion across IDs with a tagged Native port (Crossbar port with id_width).
 
 Limitations:
 - Response always okay.
-- No reordering.
+- No reordering (except reads of different IDs with a tagged Native port, that can complete out of
+  order and be interleaved).
 """
 
 from migen import *
@@ -32,10 +36,97 @@ from litex.soc.interconnect.axi import *
 
 class LiteDRAMAXIPort(AXIInterface): pass
 
+# AXI Burst to Chunk -------------------------------------------------------------------------------
+
+class _AXIBurst2Chunk(Module):
+    """Split AXI bursts in chunks that can be issued as a single Native command burst.
+
+    INCR bursts at full data width are split at ``max_beats``-aligned boundaries (so a chunk never
+    crosses a DRAM row) and the beat count of each chunk (minus one) is returned in ``len``. FIXED,
+    WRAP and narrow bursts are split in single beats, as with ``AXIBurst2Beat``.
+    """
+    def __init__(self, ax_burst, ax_chunk, max_beats, ashift):
+        # # #
+
+        burst       = Signal()
+        beat_count  = Signal(8)
+        beat_size   = Signal(8 + 4)
+        beat_offset = Signal((8 + 4 + 1, True))
+        beat_wrap   = Signal(8 + 4)
+        chunk_len   = Signal(8)
+        chunk_room  = Signal(max=max_beats + 1)
+        remaining   = Signal(8)
+
+        # Compute parameters
+        self.comb += burst.eq((ax_burst.burst == BURST_INCR) & (ax_burst.size == ashift))
+        self.comb += beat_size.eq(1 << ax_burst.size)
+        self.comb += beat_wrap.eq(ax_burst.len << ax_burst.size)
+        self.comb += [
+            chunk_room.eq(max_beats - ((ax_chunk.addr >> ashift) & (max_beats - 1))),
+            remaining.eq(ax_burst.len - beat_count),
+            If(burst,
+                If(remaining < chunk_room,
+                    chunk_len.eq(remaining)
+                ).Else(
+                    chunk_len.eq(chunk_room - 1)
+                )
+            )
+        ]
+
+        # Combinatorial logic
+        self.comb += [
+            ax_chunk.valid.eq(ax_burst.valid),
+            ax_chunk.first.eq(beat_count == 0),
+            ax_chunk.last.eq(chunk_len == remaining),
+            ax_chunk.addr.eq(ax_burst.addr + beat_offset),
+            ax_chunk.burst.eq(ax_burst.burst),
+            ax_chunk.len.eq(chunk_len),
+            ax_chunk.size.eq(ax_burst.size),
+            ax_chunk.id.eq(ax_burst.id),
+            If(ax_chunk.ready,
+                If(ax_chunk.last,
+                    ax_burst.ready.eq(1)
+                )
+            )
+        ]
+
+        # Synchronous logic
+        self.sync += [
+            If(ax_chunk.valid & ax_chunk.ready,
+                If(ax_chunk.last,
+                    beat_count.eq(0),
+                    beat_offset.eq(0)
+                ).Else(
+                    beat_count.eq(beat_count + chunk_len + 1),
+                    If((ax_burst.burst == BURST_INCR) | (ax_burst.burst == BURST_WRAP),
+                        beat_offset.eq(beat_offset + ((chunk_len + 1) << ax_burst.size))
+                    )
+                ),
+                If(ax_burst.burst == BURST_WRAP,
+                    If((ax_chunk.addr & beat_wrap) == beat_wrap,
+                        beat_offset.eq(beat_offset - beat_wrap)
+                    )
+                )
+            )
+        ]
+
+def _axi_burst_max_beats(port, buffer_depth, base_address, with_read_modify_write):
+    if with_read_modify_write:
+        raise ValueError("AXI burst mode is not supported with Read-Modify-Write.")
+    if not hasattr(port.cmd, "len"):
+        raise ValueError("AXI burst mode requires a Native port with command bursts "
+                         "(cmd_burst_max > 1 and no reordering).")
+    max_beats = min(2**len(port.cmd.len), buffer_depth)
+    max_beats = 2**(max_beats.bit_length() - 1) # Round down to a power of 2.
+    if base_address % (max_beats*port.data_width//8):
+        raise ValueError("AXI burst mode requires a base_address aligned on {} bytes.".format(
+            max_beats*port.data_width//8))
+    return max_beats
+
 # LiteDRAMAXI2NativeW ------------------------------------------------------------------------------
 
 class LiteDRAMAXI2NativeW(Module):
-    def __init__(self, axi, port, buffer_depth, base_address, with_read_modify_write=False):
+    def __init__(self, axi, port, buffer_depth, base_address, with_read_modify_write=False, with_burst=False):
         assert axi.address_width >= log2_int(base_address)
         assert axi.data_width    == port.data_width
         self.cmd_request = Signal()
@@ -52,8 +143,13 @@ class LiteDRAMAXI2NativeW(Module):
         aw_buffer = stream.Buffer(aw.description)
         self.submodules += aw_buffer
         self.comb += axi.aw.connect(aw_buffer.sink)
-        aw_burst2beat = AXIBurst2Beat(aw_buffer.source, aw)
-        self.submodules.aw_burst2beat = aw_burst2beat
+        if with_burst:
+            max_beats      = _axi_burst_max_beats(port, buffer_depth, base_address, with_read_modify_write)
+            aw_burst2chunk = _AXIBurst2Chunk(aw_buffer.source, aw, max_beats, ashift)
+            self.submodules.aw_burst2chunk = aw_burst2chunk
+        else:
+            aw_burst2beat = AXIBurst2Beat(aw_buffer.source, aw)
+            self.submodules.aw_burst2beat = aw_burst2beat
 
         # Write Buffer -----------------------------------------------------------------------------
         w = AXIStreamInterface(layout=w_description(axi.data_width), id_width=axi.id_width)
@@ -80,7 +176,7 @@ class LiteDRAMAXI2NativeW(Module):
         ]
 
         # Write Buffer reservation ------------------------------------------------------------------
-        # - Incremented when data cmd is send
+        # - Incremented when data cmd is send (by the number of beats of the cmd in burst mode)
         # - Decremented when data is read
         w_buffer_queue   = Signal()
         w_buffer_dequeue = Signal()
@@ -89,14 +185,25 @@ class LiteDRAMAXI2NativeW(Module):
             w_buffer_queue.eq(port.cmd.valid & port.cmd.ready & port.cmd.we),
             w_buffer_dequeue.eq(w_buffer.source.valid & w_buffer.source.ready)
         ]
-        self.sync += [
-            If(w_buffer_queue,
-                If(~w_buffer_dequeue, w_buffer_level.eq(w_buffer_level + 1))
-            ).Elif(w_buffer_dequeue,
-                w_buffer_level.eq(w_buffer_level - 1)
-            )
-        ]
-        self.comb += can_write.eq(w_buffer.level > w_buffer_level)
+        if with_burst:
+            self.sync += [
+                If(w_buffer_queue,
+                    w_buffer_level.eq(w_buffer_level + port.cmd.len + 1 - w_buffer_dequeue)
+                ).Elif(w_buffer_dequeue,
+                    w_buffer_level.eq(w_buffer_level - 1)
+                )
+            ]
+            # Only issue a cmd when all the data of the chunk is buffered.
+            self.comb += can_write.eq(w_buffer.level > (w_buffer_level + aw.len))
+        else:
+            self.sync += [
+                If(w_buffer_queue,
+                    If(~w_buffer_dequeue, w_buffer_level.eq(w_buffer_level + 1))
+                ).Elif(w_buffer_dequeue,
+                    w_buffer_level.eq(w_buffer_level - 1)
+                )
+            ]
+            self.comb += can_write.eq(w_buffer.level > w_buffer_level)
 
         # Command ----------------------------------------------------------------------------------
         # Accept and send command to the controller only if:
@@ -109,6 +216,7 @@ class LiteDRAMAXI2NativeW(Module):
                 port.cmd.last.eq(aw.last),
                 port.cmd.we.eq(1),
                 port.cmd.addr.eq((aw.addr - base_address) >> ashift),
+                *([port.cmd.len.eq(aw.len)] if with_burst else []),
                 If(port.cmd.ready,
                     aw.ready.eq(1),
                 )
@@ -218,7 +326,7 @@ class LiteDRAMAXI2NativeW(Module):
 # LiteDRAMAXI2NativeR ------------------------------------------------------------------------------
 
 class LiteDRAMAXI2NativeR(Module):
-    def __init__(self, axi, port, buffer_depth, base_address, with_read_modify_write=False):
+    def __init__(self, axi, port, buffer_depth, base_address, with_read_modify_write=False, with_burst=False):
         assert axi.address_width >= log2_int(base_address)
         assert axi.data_width    == port.data_width
         self.cmd_request = Signal()
@@ -235,8 +343,13 @@ class LiteDRAMAXI2NativeR(Module):
         ar_buffer = stream.Buffer(ar.description)
         self.submodules += ar_buffer
         self.comb += axi.ar.connect(ar_buffer.sink)
-        ar_burst2beat = AXIBurst2Beat(ar_buffer.source, ar)
-        self.submodules.ar_burst2beat = ar_burst2beat
+        if with_burst:
+            max_beats      = _axi_burst_max_beats(port, buffer_depth, base_address, with_read_modify_write)
+            ar_burst2chunk = _AXIBurst2Chunk(ar_buffer.source, ar, max_beats, ashift)
+            self.submodules.ar_burst2chunk = ar_burst2chunk
+        else:
+            ar_burst2beat = AXIBurst2Beat(ar_buffer.source, ar)
+            self.submodules.ar_burst2beat = ar_burst2beat
 
         # Read buffer ------------------------------------------------------------------------------
         r = AXIStreamInterface(layout=r_description(axi.data_width), id_width=axi.id_width)
@@ -244,7 +357,8 @@ class LiteDRAMAXI2NativeR(Module):
         self.submodules.r_buffer = r_buffer
 
         # Read Buffer reservation ------------------------------------------------------------------
-        # - Incremented when data is planned to be queued
+        # - Incremented when data is planned to be queued (by the number of beats of the cmd in burst
+        #   mode)
         # - Decremented when data is dequeued
         r_buffer_queue   = Signal()
         r_buffer_dequeue = Signal()
@@ -253,26 +367,89 @@ class LiteDRAMAXI2NativeR(Module):
             r_buffer_queue.eq(port.cmd.valid & port.cmd.ready & ~port.cmd.we),
             r_buffer_dequeue.eq(r_buffer.source.valid & r_buffer.source.ready)
         ]
-        self.sync += [
-            If(r_buffer_queue,
-                If(~r_buffer_dequeue, r_buffer_level.eq(r_buffer_level + 1))
-            ).Elif(r_buffer_dequeue,
-                r_buffer_level.eq(r_buffer_level - 1)
-            )
-        ]
-        self.comb += can_read.eq(r_buffer_level != buffer_depth)
+        if with_burst:
+            self.sync += [
+                If(r_buffer_queue,
+                    r_buffer_level.eq(r_buffer_level + port.cmd.len + 1 - r_buffer_dequeue)
+                ).Elif(r_buffer_dequeue,
+                    r_buffer_level.eq(r_buffer_level - 1)
+                )
+            ]
+            self.comb += can_read.eq((r_buffer_level + ar.len) < buffer_depth)
+        else:
+            self.sync += [
+                If(r_buffer_queue,
+                    If(~r_buffer_dequeue, r_buffer_level.eq(r_buffer_level + 1))
+                ).Elif(r_buffer_dequeue,
+                    r_buffer_level.eq(r_buffer_level - 1)
+                )
+            ]
+            self.comb += can_read.eq(r_buffer_level != buffer_depth)
 
         # Read ID Buffer ---------------------------------------------------------------------------
-        id_buffer = stream.SyncFIFO([("id", axi.id_width)], buffer_depth)
-        self.submodules += id_buffer
-        self.comb += [
-            id_buffer.sink.valid.eq(ar.valid & ar.ready),
-            id_buffer.sink.last.eq(ar.last),
-            id_buffer.sink.id.eq(ar.id),
-            axi.r.last.eq(id_buffer.source.last),
-            axi.r.id.eq(id_buffer.source.id),
-            id_buffer.source.ready.eq(axi.r.valid & axi.r.ready)
-        ]
+        # In burst mode, one entry per chunk: the beat counter generates last/ready on the last beat.
+        # With a tagged Native port, each AXI ID in flight is mapped to a port ID (slot): reads of a
+        # slot are returned in order by the Crossbar, but reads of different slots can complete out
+        # of order. Each slot then queues the AXI ID/last of its reads to tag the read data on return.
+        with_reordering = hasattr(port.rdata, "id")
+        if with_reordering:
+            nslots     = 2**len(port.rdata.id)
+            slot       = Signal(len(port.rdata.id))
+            slot_ok    = Signal()
+            slot_ids   = [Signal(axi.id_width) for i in range(nslots)]
+            slot_fifos = [stream.SyncFIFO([("id", axi.id_width)], buffer_depth) for i in range(nslots)]
+            self.submodules += slot_fifos
+            # Select the slot of the AXI ID if in flight (to keep reads in order), else a free slot.
+            for i in reversed(range(nslots)):
+                self.comb += If(~slot_fifos[i].source.valid,
+                    slot.eq(i),
+                    slot_ok.eq(1)
+                )
+            for i in range(nslots):
+                self.comb += If(slot_fifos[i].source.valid & (slot_ids[i] == ar.id),
+                    slot.eq(i),
+                    slot_ok.eq(1)
+                )
+            self.comb += If(~slot_ok, can_read.eq(0))
+            for i in range(nslots):
+                self.comb += [
+                    slot_fifos[i].sink.valid.eq(ar.valid & ar.ready & (slot == i)),
+                    slot_fifos[i].sink.last.eq(ar.last),
+                    slot_fifos[i].sink.id.eq(ar.id),
+                    If(r_buffer.sink.valid & (port.rdata.id == i),
+                        r_buffer.sink.last.eq(slot_fifos[i].source.last),
+                        r_buffer.sink.id.eq(slot_fifos[i].source.id),
+                        slot_fifos[i].source.ready.eq(1)
+                    )
+                ]
+                self.sync += If(slot_fifos[i].sink.valid, slot_ids[i].eq(ar.id))
+        else:
+            id_buffer_layout = [("id", axi.id_width)]
+            if with_burst:
+                id_buffer_layout += [("len", len(ar.len))]
+            id_buffer = stream.SyncFIFO(id_buffer_layout, buffer_depth)
+            self.submodules += id_buffer
+            id_buffer_done = Signal(reset=1)
+            self.comb += [
+                id_buffer.sink.valid.eq(ar.valid & ar.ready),
+                id_buffer.sink.last.eq(ar.last),
+                id_buffer.sink.id.eq(ar.id),
+                axi.r.last.eq(id_buffer.source.last & id_buffer_done),
+                axi.r.id.eq(id_buffer.source.id),
+                id_buffer.source.ready.eq(axi.r.valid & axi.r.ready & id_buffer_done)
+            ]
+        if with_burst:
+            r_beat = Signal(len(ar.len))
+            self.comb += [
+                id_buffer.sink.len.eq(ar.len),
+                id_buffer_done.eq(r_beat == id_buffer.source.len),
+            ]
+            self.sync += If(axi.r.valid & axi.r.ready,
+                r_beat.eq(r_beat + 1),
+                If(id_buffer_done,
+                    r_beat.eq(0)
+                )
+            )
 
         # Command ----------------------------------------------------------------------------------
         self.comb += [
@@ -282,6 +459,8 @@ class LiteDRAMAXI2NativeR(Module):
                 port.cmd.last.eq(ar.last),
                 port.cmd.we.eq(0),
                 port.cmd.addr.eq((ar.addr - base_address) >> ashift),
+                *([port.cmd.len.eq(ar.len)] if with_burst else []),
+                *([port.cmd.id.eq(slot)] if with_reordering else []),
                 If(port.cmd.ready,
                     ar.ready.eq(1),
                 )
@@ -289,11 +468,18 @@ class LiteDRAMAXI2NativeR(Module):
         ]
 
         # Read data --------------------------------------------------------------------------------
-        self.comb += [
-            port.rdata.connect(r_buffer.sink, omit={"bank"}),
-            r_buffer.source.connect(axi.r, omit={"id", "last"}),
-            axi.r.resp.eq(RESP_OKAY)
-        ]
+        if with_reordering:
+            self.comb += [
+                port.rdata.connect(r_buffer.sink, omit={"bank", "id", "last"}),
+                r_buffer.source.connect(axi.r),
+                axi.r.resp.eq(RESP_OKAY)
+            ]
+        else:
+            self.comb += [
+                port.rdata.connect(r_buffer.sink, omit={"bank"}),
+                r_buffer.source.connect(axi.r, omit={"id", "last"}),
+                axi.r.resp.eq(RESP_OKAY)
+            ]
 
         # Read-Modify-Write ------------------------------------------------------------------------
         if with_read_modify_write:
@@ -321,23 +507,66 @@ class LiteDRAMAXI2NativeR(Module):
 # LiteDRAMAXI2Native -------------------------------------------------------------------------------
 
 class LiteDRAMAXI2Native(Module):
-    def __init__(self, axi, port, w_buffer_depth=16, r_buffer_depth=16, base_address=0x00000000, with_read_modify_write=False):
+    def __init__(self, axi, port, w_buffer_depth=16, r_buffer_depth=16, base_address=0x00000000, with_read_modify_write=False,
+        with_burst=False, arbitration="burst", write_age_max=16, read_port=None):
+        if arbitration not in ["burst", "beat", "read"]:
+            raise ValueError("AXI arbitration must be burst, beat or read, got {}".format(arbitration))
+        if (read_port is not None) and with_read_modify_write and (port.mode != "both"):
+            raise ValueError("AXI Read-Modify-Write with a read_port requires a write port in both mode.")
 
         # # #
 
         # Write path -------------------------------------------------------------------------------
-        self.submodules.write = LiteDRAMAXI2NativeW(axi, port, w_buffer_depth, base_address, with_read_modify_write)
+        self.submodules.write = LiteDRAMAXI2NativeW(axi, port, w_buffer_depth, base_address, with_read_modify_write, with_burst)
 
         # Read path --------------------------------------------------------------------------------
-        self.submodules.read = LiteDRAMAXI2NativeR(axi, port, r_buffer_depth, base_address, with_read_modify_write)
+        if read_port is None:
+            read_port = port
+        self.submodules.read = LiteDRAMAXI2NativeR(axi, read_port, r_buffer_depth, base_address, with_read_modify_write, with_burst)
 
         # Write / Read arbitration -----------------------------------------------------------------
-        arbiter = RoundRobin(2, SP_CE)
-        self.submodules += arbiter
-        self.comb += arbiter.ce.eq(~port.cmd.valid | (port.cmd.ready & port.cmd.last))
-        for i, master in enumerate([self.write, self.read]):
-            self.comb += arbiter.request[i].eq(master.cmd_request)
-            self.comb += master.cmd_grant.eq(arbiter.grant == i)
+        # - Separate read_port: no arbitration, writes and reads are issued concurrently.
+        # - burst: RoundRobin, the grant only switches at the end of a burst.
+        # - beat:  RoundRobin, the grant can switch after each cmd (beat, or chunk in burst mode).
+        # - read:  Reads are granted first, unless the pending write has waited write_age_max cycles.
+        if read_port is not port:
+            self.comb += [
+                self.write.cmd_grant.eq(1),
+                self.read.cmd_grant.eq(1),
+            ]
+        elif arbitration in ["burst", "beat"]:
+            arbiter = RoundRobin(2, SP_CE)
+            self.submodules += arbiter
+            if arbitration == "burst":
+                self.comb += arbiter.ce.eq(~port.cmd.valid | (port.cmd.ready & port.cmd.last))
+            else:
+                self.comb += arbiter.ce.eq(~port.cmd.valid | port.cmd.ready)
+            for i, master in enumerate([self.write, self.read]):
+                self.comb += arbiter.request[i].eq(master.cmd_request)
+                self.comb += master.cmd_grant.eq(arbiter.grant == i)
+        else:
+            write_age  = Signal(max=write_age_max + 1)
+            write_aged = Signal()
+            read_grant = Signal()
+            self.comb += write_aged.eq(write_age == write_age_max)
+            self.sync += [
+                If(~self.write.cmd_request | (self.write.cmd_grant & port.cmd.valid & port.cmd.ready),
+                    write_age.eq(0)
+                ).Elif(~write_aged,
+                    write_age.eq(write_age + 1)
+                ),
+                If(~port.cmd.valid | port.cmd.ready,
+                    If(self.read.cmd_request & ~(self.write.cmd_request & write_aged),
+                        read_grant.eq(1)
+                    ).Elif(self.write.cmd_request,
+                        read_grant.eq(0)
+                    )
+                )
+            ]
+            self.comb += [
+                self.write.cmd_grant.eq(~read_grant),
+                self.read.cmd_grant.eq(read_grant),
+            ]
 
         # Read-Modify-Write ------------------------------------------------------------------------
         if with_read_modify_write:
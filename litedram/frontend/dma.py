@@ -14,11 +14,303 @@ from math import log2
 from migen import *
 
 from litex.soc.interconnect.csr import *
+from litex.soc.interconnect.csr_eventmanager import *
 from litex.soc.interconnect import stream
 
 from litedram.common import LiteDRAMNativePort
 from litedram.frontend.axi import LiteDRAMAXIPort
 
+# Descriptors --------------------------------------------------------------------------------------
+
+# Descriptor control flags.
+DMA_DESC_LAST = (1 <<  0) # Last descriptor of the chain.
+DMA_DESC_IRQ  = (1 <<  1) # Raise an interrupt on completion.
+DMA_DESC_EOP  = (1 <<  2) # Buffer ended by the end of a packet (written back by the DMA).
+DMA_DESC_OWN  = (1 << 31) # Descriptor owned by the DMA (cleared on completion).
+
+class LiteDRAMDMADescriptorEngine(Module):
+    """Fetch chained DMA descriptors from DRAM and write back their status.
+
+    A descriptor is 128-bit wide, made of four 32-bit words: buffer address (bytes), buffer length
+    (bytes), address of the next descriptor (bytes) and control flags (DMA_DESC_XXX). Descriptors
+    are stored in the LSBs of `port` words (so aligned on `port` words) and are fetched from `base`
+    following the next addresses, until a descriptor with DMA_DESC_LAST or without DMA_DESC_OWN
+    (the latter not being processed).
+
+    Up to `depth` descriptors are fetched in advance and up to `depth` descriptors can be processed
+    by the DMA at once. When all the data of a descriptor has been transferred, its length is
+    updated with the transferred length and its control is written back with DMA_DESC_OWN cleared.
+
+    Parameters
+    ----------
+    port : LiteDRAMNativePort
+        Port to fetch/write back the descriptors (mode "both", at least 128-bit).
+
+    data_width : int
+        Data width of the DMA, in which buffer addresses/lengths are given on `source`.
+
+    depth : int
+        Number of descriptors fetched in advance/in flight.
+
+    Attributes
+    ----------
+    base : Signal(32), in
+        Address of the first descriptor (bytes).
+
+    source : Record("address", "length")
+        Descriptors to process (in DMA words).
+
+    sink : Record("length", "last")
+        Number of DMA words issued for the descriptors in `source` order, `last` when the buffer
+        has been ended by the end of a packet. Pushed once the words have been issued.
+
+    complete : Signal, in
+        A DMA word has been transferred.
+
+    last : Signal, out
+        The next transferred DMA word is the last of its descriptor.
+
+    done : Signal, out
+        Chain has been processed.
+
+    count : Signal(32), out
+        Number of processed descriptors.
+
+    irq : Signal, out
+        A descriptor with DMA_DESC_IRQ has been processed.
+    """
+    def __init__(self, port, data_width, depth=4):
+        assert isinstance(port, LiteDRAMNativePort)
+        assert port.mode == "both"
+        assert port.data_width >= 128
+        self.base     = Signal(32)
+        self.source   = source = stream.Endpoint([("address", 32), ("length", 32)])
+        self.sink     = sink   = stream.Endpoint([("length", 32)])
+        self.complete = Signal()
+        self.last     = Signal()
+        self.done     = Signal()
+        self.count    = Signal(32)
+        self.irq      = Signal()
+
+        # # #
+
+        desc_shift = log2_int(port.data_width//8)
+        data_shift = log2_int(data_width//8)
+
+        # Descriptors FIFOs ------------------------------------------------------------------------
+        # - fetched:   descriptors fetched from DRAM, not yet processed.
+        # - inflight:  descriptors being processed.
+        # - markers:   number of words issued for the descriptors being processed.
+        # - writeback: processed descriptors, status to be written back.
+        fetched   = stream.SyncFIFO(
+            [("desc", 32), ("address", 32), ("length", 32), ("control", 32)], depth)
+        inflight  = stream.SyncFIFO([("desc", 32), ("control", 32)], depth)
+        markers   = stream.SyncFIFO([("length", 32)], depth)
+        writeback = stream.SyncFIFO([("desc", 32), ("length", 32), ("control", 32)], depth)
+        self.submodules += fetched, inflight, markers, writeback
+
+        # Descriptors processing -------------------------------------------------------------------
+        # Limit the descriptors being processed or written back to depth, so no FIFO can overflow.
+        # Empty descriptors are only processed once the previous ones have been completed, so that
+        # no word can be transferred while their marker is completed.
+        pending = Signal(max=depth + 1)
+        empty   = Signal()
+        self.sync += pending.eq(pending +
+            (source.valid & source.ready) -
+            (writeback.source.valid & writeback.source.ready))
+        self.comb += [
+            empty.eq(fetched.source.length[data_shift:] == 0),
+            source.valid.eq(fetched.source.valid & Mux(empty, pending == 0, pending != depth)),
+            source.address.eq(fetched.source.address[data_shift:]),
+            source.length.eq(fetched.source.length[data_shift:]),
+            fetched.source.ready.eq(source.valid & source.ready),
+            inflight.sink.valid.eq(source.valid & source.ready),
+            inflight.sink.desc.eq(fetched.source.desc),
+            inflight.sink.control.eq(fetched.source.control),
+            sink.connect(markers.sink),
+        ]
+
+        # Descriptors completion -------------------------------------------------------------------
+        # Words are transferred in order: a descriptor is completed once its number of words has
+        # been transferred. Empty descriptors are completed without consuming a transferred word.
+        words  = Signal(32)
+        finish = Signal()
+        self.comb += [
+            self.last.eq(markers.source.valid & (words + 1 == markers.source.length)),
+            finish.eq(markers.source.valid & ((markers.source.length == 0) |
+                (words + self.complete == markers.source.length))),
+            markers.source.ready.eq(finish),
+            inflight.source.ready.eq(finish),
+            writeback.sink.valid.eq(finish),
+            writeback.sink.desc.eq(inflight.source.desc),
+            writeback.sink.length.eq(markers.source.length << data_shift),
+            writeback.sink.control.eq(inflight.source.control |
+                Mux(markers.source.last, DMA_DESC_EOP, 0)),
+        ]
+        self.sync += [
+            If(finish & (markers.source.length != 0),
+                words.eq(0)
+            ).Else(
+                words.eq(words + self.complete)
+            )
+        ]
+
+        # Fetch / Write back -----------------------------------------------------------------------
+        desc     = Signal(32)       # Address of the next descriptor to fetch.
+        fetching = Signal(reset=1)  # End of the chain not reached.
+        control  = Signal(32)
+        self.comb += control.eq(port.rdata.data[96:128])
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            NextValue(desc, self.base),
+            NextState("CHECK")
+        )
+        fsm.act("CHECK",
+            self.done.eq(~fetching & ~fetched.source.valid & (pending == 0)),
+            If(writeback.source.valid,
+                NextState("WRITEBACK-CMD")
+            ).Elif(fetching & fetched.sink.ready,
+                NextState("FETCH-CMD")
+            )
+        )
+        fsm.act("FETCH-CMD",
+            port.cmd.valid.eq(1),
+            port.cmd.we.eq(0),
+            port.cmd.addr.eq(desc[desc_shift:]),
+            If(port.cmd.ready,
+                NextState("FETCH-DATA")
+            )
+        )
+        fsm.act("FETCH-DATA",
+            port.rdata.ready.eq(1),
+            fetched.sink.desc.eq(desc),
+            fetched.sink.address.eq(port.rdata.data[0:32]),
+            fetched.sink.length.eq(port.rdata.data[32:64]),
+            fetched.sink.control.eq(control),
+            If(port.rdata.valid,
+                If(control & DMA_DESC_OWN,
+                    fetched.sink.valid.eq(1),
+                    NextValue(desc, port.rdata.data[64:96]),
+                    If(control & DMA_DESC_LAST,
+                        NextValue(fetching, 0)
+                    )
+                ).Else(
+                    NextValue(fetching, 0)
+                ),
+                NextState("CHECK")
+            )
+        )
+        fsm.act("WRITEBACK-CMD",
+            port.cmd.valid.eq(1),
+            port.cmd.we.eq(1),
+            port.cmd.addr.eq(writeback.source.desc[desc_shift:]),
+            If(port.cmd.ready,
+                NextState("WRITEBACK-DATA")
+            )
+        )
+        fsm.act("WRITEBACK-DATA",
+            # Only write length and control.
+            port.wdata.valid.eq(1),
+            port.wdata.data.eq(Cat(Constant(0, 32), writeback.source.length,
+                Constant(0, 32), writeback.source.control & ~Constant(DMA_DESC_OWN, 32))),
+            port.wdata.we.eq(0xf0f0),
+            If(port.wdata.ready,
+                writeback.source.ready.eq(1),
+                self.irq.eq((writeback.source.control & DMA_DESC_IRQ) != 0),
+                NextValue(self.count, self.count + 1),
+                NextState("CHECK")
+            )
+        )
+
+# LiteDRAMDMAAddressGenerator ----------------------------------------------------------------------
+
+class LiteDRAMDMAAddressGenerator(Module):
+    """Generate the addresses of a 2D/3D strided region.
+
+    Addresses are generated line by line (`width` words, lines `pitch` words apart) and plane by
+    plane (`height` lines, planes `plane_pitch` words apart) for `depth` planes, one per cycle,
+    including across line/plane boundaries so that a DMA keeps its reads outstanding.
+
+    Attributes
+    ----------
+    source : Record("address")
+        Generated addresses, `last` on the last address of the region.
+
+    done : Signal, out
+        Region has been generated (and `loop` is not set).
+    """
+    def __init__(self, address_width):
+        self.base        = Signal(address_width)
+        self.width       = Signal(address_width)
+        self.height      = Signal(32)
+        self.depth       = Signal(32)
+        self.pitch       = Signal(address_width)
+        self.plane_pitch = Signal(address_width)
+        self.loop        = Signal()
+        self.done        = Signal()
+        self.source      = source = stream.Endpoint([("address", address_width)])
+
+        # # #
+
+        x     = Signal(address_width)
+        y     = Signal(32)
+        z     = Signal(32)
+        line  = Signal(address_width) # Address of the current line.
+        plane = Signal(address_width) # Address of the current plane.
+
+        last_x = Signal()
+        last_y = Signal()
+        last_z = Signal()
+        self.comb += [
+            last_x.eq(x == (self.width  - 1)),
+            last_y.eq(y == (self.height - 1)),
+            last_z.eq(z == (self.depth  - 1)),
+        ]
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            NextValue(x, 0),
+            NextValue(y, 0),
+            NextValue(z, 0),
+            NextValue(line,  self.base),
+            NextValue(plane, self.base),
+            If((self.width == 0) | (self.height == 0) | (self.depth == 0),
+                NextState("DONE")
+            ).Else(
+                NextState("RUN")
+            )
+        )
+        fsm.act("RUN",
+            source.valid.eq(1),
+            source.last.eq(last_x & last_y & last_z),
+            source.address.eq(line + x),
+            If(source.ready,
+                NextValue(x, x + 1),
+                If(last_x,
+                    NextValue(x, 0),
+                    NextValue(y, y + 1),
+                    NextValue(line, line + self.pitch),
+                    If(last_y,
+                        NextValue(y, 0),
+                        NextValue(z, z + 1),
+                        NextValue(line,  plane + self.plane_pitch),
+                        NextValue(plane, plane + self.plane_pitch),
+                        If(last_z,
+                            If(self.loop,
+                                NextValue(z, 0),
+                                NextValue(line,  self.base),
+                                NextValue(plane, self.base)
+                            ).Else(
+                                NextState("DONE")
+                            )
+                        )
+                    )
+                )
+            )
+        )
+        fsm.act("DONE", self.done.eq(1))
+
 # LiteDRAMDMAReader --------------------------------------------------------------------------------
 
 class LiteDRAMDMAReader(Module, AutoCSR):
@@ -158,6 +450,98 @@ class LiteDRAMDMAReader(Module, AutoCSR):
         )
         fsm.act("DONE", self._done.status.eq(1))
 
+    def add_strided_csr(self, default_base=0, default_width=0, default_height=1, default_depth=1,
+        default_pitch=0, default_plane_pitch=0, default_enable=0, default_loop=0):
+        """Read a 2D/3D strided region (see LiteDRAMDMAAddressGenerator)
+
+        Base, width and pitches are given in bytes (aligned on the DMA words), height in lines and
+        depth in planes.
+        """
+        self._base        = CSRStorage(32, reset=default_base, name="base")
+        self._width       = CSRStorage(32, reset=default_width, name="width")
+        self._height      = CSRStorage(32, reset=default_height, name="height")
+        self._depth       = CSRStorage(32, reset=default_depth, name="depth")
+        self._pitch       = CSRStorage(32, reset=default_pitch, name="pitch")
+        self._plane_pitch = CSRStorage(32, reset=default_plane_pitch, name="plane_pitch")
+        self._enable      = CSRStorage(reset=default_enable, name="enable")
+        self._done        = CSRStatus(name="done")
+        self._loop        = CSRStorage(reset=default_loop, name="loop")
+
+        # # #
+
+        shift     = log2_int(self.port.data_width//8)
+        generator = LiteDRAMDMAAddressGenerator(self.port.address_width)
+        generator = ResetInserter()(generator)
+        self.submodules.generator = generator
+        self.comb += [
+            generator.reset.eq(~self._enable.storage),
+            generator.base.eq(self._base.storage[shift:]),
+            generator.width.eq(self._width.storage[shift:]),
+            generator.height.eq(self._height.storage),
+            generator.depth.eq(self._depth.storage),
+            generator.pitch.eq(self._pitch.storage[shift:]),
+            generator.plane_pitch.eq(self._plane_pitch.storage[shift:]),
+            generator.loop.eq(self._loop.storage),
+            generator.source.connect(self.sink),
+            self.enable.eq(self._enable.storage),
+            self._done.status.eq(generator.done),
+        ]
+
+    def add_scatter_gather(self, port, depth=4, with_irq=True):
+        """Read the buffers described by a chain of descriptors (see LiteDRAMDMADescriptorEngine)
+
+        Buffers are read from `_base` when `_enable` is set, `source.last` is set on the last word
+        of each buffer. Buffer addresses/lengths have to be aligned on the DMA words. With `with_irq`,
+        descriptors with DMA_DESC_IRQ pulse the `done` event of `ev`.
+        """
+        self._base   = CSRStorage(32, name="base")
+        self._enable = CSRStorage(name="enable")
+        self._done   = CSRStatus(name="done")
+        self._count  = CSRStatus(32, name="count")
+
+        if with_irq:
+            self.ev      = EventManager()
+            self.ev.done = EventSourcePulse(name="done")
+            self.ev.finalize()
+
+        # # #
+
+        sg = LiteDRAMDMADescriptorEngine(port, self.port.data_width, depth)
+        sg = ResetInserter()(sg)
+        self.submodules.sg = sg
+        self.comb += [
+            sg.reset.eq(~self._enable.storage),
+            sg.base.eq(self._base.storage),
+            self.enable.eq(self._enable.storage),
+            self._done.status.eq(sg.done),
+            self._count.status.eq(sg.count),
+        ]
+        if with_irq:
+            self.comb += self.ev.done.trigger.eq(sg.irq)
+
+        offset = Signal(32)
+        empty  = Signal()
+        self.comb += [
+            empty.eq(sg.source.length == 0),
+            self.sink.valid.eq(sg.source.valid & ~empty),
+            self.sink.last.eq(offset == (sg.source.length - 1)),
+            self.sink.address.eq(sg.source.address + offset),
+            sg.source.ready.eq(
+                (self.sink.valid & self.sink.ready & self.sink.last) |
+                (sg.source.valid & empty)),
+            sg.sink.valid.eq(sg.source.valid & sg.source.ready),
+            sg.sink.length.eq(sg.source.length),
+            sg.complete.eq(self.source.valid & self.source.ready),
+            self.source.last.eq(sg.last),
+        ]
+        self.sync += [
+            If(~self._enable.storage,
+                offset.eq(0)
+            ).Elif(self.sink.valid & self.sink.ready,
+                offset.eq(Mux(self.sink.last, 0, offset + 1))
+            )
+        ]
+
 # LiteDRAMDMAWriter --------------------------------------------------------------------------------
 
 class LiteDRAMDMAWriter(Module, AutoCSR):
@@ -276,3 +660,64 @@ class LiteDRAMDMAWriter(Module, AutoCSR):
             )
         )
         fsm.act("DONE", self._done.status.eq(1))
+
+    def add_scatter_gather(self, port, depth=4, with_irq=True):
+        """Write the buffers described by a chain of descriptors (see LiteDRAMDMADescriptorEngine)
+
+        Buffers are written from `_base` when `_enable` is set. `sink.last` ends the current buffer
+        (DMA_DESC_EOP is then set in its written back control), so a buffer gets at most a packet.
+        Buffer addresses/lengths have to be aligned on the DMA words. With `with_irq`, descriptors
+        with DMA_DESC_IRQ pulse the `done` event of `ev`.
+        """
+        self._sink = self.sink
+        self.sink  = stream.Endpoint([("data", self.port.data_width)])
+
+        self._base   = CSRStorage(32, name="base")
+        self._enable = CSRStorage(name="enable")
+        self._done   = CSRStatus(name="done")
+        self._count  = CSRStatus(32, name="count")
+
+        if with_irq:
+            self.ev      = EventManager()
+            self.ev.done = EventSourcePulse(name="done")
+            self.ev.finalize()
+
+        # # #
+
+        sg = LiteDRAMDMADescriptorEngine(port, self.port.data_width, depth)
+        sg = ResetInserter()(sg)
+        self.submodules.sg = sg
+        self.comb += [
+            sg.reset.eq(~self._enable.storage),
+            sg.base.eq(self._base.storage),
+            self._done.status.eq(sg.done),
+            self._count.status.eq(sg.count),
+        ]
+        if with_irq:
+            self.comb += self.ev.done.trigger.eq(sg.irq)
+
+        wdata  = self.port.wdata if isinstance(self.port, LiteDRAMNativePort) else self.port.w
+        offset = Signal(32)
+        empty  = Signal()
+        self.comb += [
+            empty.eq(sg.source.length == 0),
+            self._sink.valid.eq(self.sink.valid & sg.source.valid & ~empty),
+            self._sink.last.eq(self.sink.last | (offset == (sg.source.length - 1))),
+            self._sink.address.eq(sg.source.address + offset),
+            self._sink.data.eq(self.sink.data),
+            self.sink.ready.eq(self._sink.ready & sg.source.valid & ~empty),
+            sg.source.ready.eq(
+                (self._sink.valid & self._sink.ready & self._sink.last) |
+                (sg.source.valid & empty)),
+            sg.sink.valid.eq(sg.source.valid & sg.source.ready),
+            sg.sink.last.eq(self.sink.last & ~empty),
+            sg.sink.length.eq(Mux(empty, 0, offset + 1)),
+            sg.complete.eq(wdata.valid & wdata.ready),
+        ]
+        self.sync += [
+            If(~self._enable.storage,
+                offset.eq(0)
+            ).Elif(self._sink.valid & self._sink.ready,
+                offset.eq(Mux(self._sink.last, 0, offset + 1))
+            )
+        ]
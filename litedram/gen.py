@@ -777,7 +777,8 @@ class LiteDRAMCore(SoCCore):
                 axi2native = LiteDRAMAXI2Native(
                     axi  = axi_port,
                     port = user_port,
-                    with_read_modify_write = port.get("ecc", False)
+                    with_read_modify_write = port.get("ecc", False),
+                    arbitration            = port.get("arbitration", "burst")
                 )
                 self.submodules += axi2native
                 platform.add_extension(get_axi_user_port_ios(name,
@@ -10,6 +10,7 @@
 # Copyright (c) 2020-2021 Antmicro <www.antmicro.com>
 # SPDX-License-Identifier: BSD-2-Clause
 
+import copy
 import math
 from contextlib import contextmanager
 
@@ -799,7 +800,17 @@ def get_lpddr5_phy_init_sequence(phy_settings, timing_settings):
 
 # Init Sequence ------------------------------------------------------------------------------------
 
+def get_runtime_timings(timing_settings):
+    # Timings turned into CSRs by the controller (with_timing_csrs), with their reset values.
+    return {name: value.reset.value for name, value in vars(timing_settings).items()
+        if isinstance(value, Signal)}
+
 def get_sdram_phy_init_sequence(phy_settings, timing_settings):
+    runtime_timings = get_runtime_timings(timing_settings)
+    if runtime_timings:
+        timing_settings = copy.copy(timing_settings)
+        for name, value in runtime_timings.items():
+            setattr(timing_settings, name, value)
     return {
         "SDR":    get_sdr_phy_init_sequence,
         "DDR":    get_ddr_phy_init_sequence,
@@ -971,6 +982,17 @@ def get_sdram_phy_c_header(phy_settings, timing_settings, geom_settings):
                 s += "default: return 0;"
     r.newline()
 
+    # Runtime timings (CSRs) reset values
+    runtime_timings = get_runtime_timings(timing_settings)
+    if runtime_timings:
+        for name, value in runtime_timings.items():
+            r.define(f"SDRAM_TIMING_{name.upper()}", value)
+        r.newline()
+        with r.block("__attribute__((unused)) static inline void sdram_timings_reset(void)") as b:
+            for name in runtime_timings:
+                b += f"sdram_controller_timing_{name.lower()}_write(SDRAM_TIMING_{name.upper()});"
+        r.newline()
+
     init_sequence, mr = get_sdram_phy_init_sequence(phy_settings, timing_settings)
 
     if phy_settings.memtype in ["DDR3", "DDR4"]:
@@ -1040,6 +1062,14 @@ def get_sdram_phy_py_header(phy_settings, timing_settings):
     r += "dfii_command_rddata = 0x20\n"
     r += "\n"
 
+    runtime_timings = get_runtime_timings(timing_settings)
+    if runtime_timings:
+        r += "timings = {\n"
+        for name, value in runtime_timings.items():
+            r += f"    \"{name.lower()}\": {value},\n"
+        r += "}\n"
+        r += "\n"
+
     init_sequence, mr = get_sdram_phy_init_sequence(phy_settings, timing_settings)
 
     if mr is not None and 1 in mr:
@@ -24,10 +24,12 @@ from litedram.common import Settings, GeomSettings, TimingSettings
 
 # Timings ------------------------------------------------------------------------------------------
 
-_technology_timings = ["tREFI", "tWTR", "tCCD", "tRRD", "tZQCS"]
+_technology_timings = ["tREFI", "tWTR", "tCCD", "tRRD", "tZQCS", "tCCD_S", "tRRD_S"]
 
+# With bank groups (DDR4), tCCD/tRRD are the timings between banks of the same group (tCCD_L/tRRD_L)
+# and tCCD_S/tRRD_S the timings between banks of different groups.
 class _TechnologyTimings(Settings):
-    def __init__(self, tREFI, tWTR, tCCD, tRRD, tZQCS=None):
+    def __init__(self, tREFI, tWTR, tCCD, tRRD, tZQCS=None, tCCD_S=None, tRRD_S=None):
         self.set_attributes(locals())
 
 
@@ -249,11 +251,13 @@ class DDR4SPDData(DDR3SPDData):
         }[page_size_bytes]
 
         technology_timings = _TechnologyTimings(
-            tREFI = self.trefi,
-            tWTR  = (4, twtr_l_min),
-            tCCD  = (4, tccd_l_min),
-            tRRD  = (4, trrd_l_min),
-            tZQCS = (128, 80),
+            tREFI  = self.trefi,
+            tWTR   = (4, twtr_l_min),
+            tCCD   = (4, tccd_l_min),
+            tRRD   = (4, trrd_l_min),
+            tZQCS  = (128, 80),
+            tCCD_S = (4, None),
+            tRRD_S = (4, trrd_s_min),
         )
         speedgrade_timings = _SpeedgradeTimings(
             tRP  = trp_min,
@@ -317,27 +321,40 @@ class SDRAMModule:
         self.rate          = rate
         self.speedgrade    = speedgrade
         self.geom_settings = GeomSettings(
-            bankbits = log2_int(self.nbanks),
-            rowbits  = log2_int(self.nrows),
-            colbits  = log2_int(self.ncols),
+            bankbits      = log2_int(self.nbanks),
+            rowbits       = log2_int(self.nrows),
+            colbits       = log2_int(self.ncols),
+            bankgroupbits = log2_int(getattr(self, "ngroups", 1)),
         )
         assert not (self.memtype != "DDR4" and fine_refresh_mode != None)
         assert fine_refresh_mode in [None, "1x", "2x", "4x"]
         if (fine_refresh_mode is None) and (self.memtype == "DDR4"):
             fine_refresh_mode = "1x"
+        txp = {"DDR2": Timing(2, 0), "DDR3": Timing(3, 7.5), "DDR4": Timing(4, 6)}.get(self.memtype)
+        txs = {"DDR2": 200, "DDR3": 512, "DDR4": 1024}.get(self.memtype)
+        if txs is not None:
+            txs = Timing(txs, self.get("tRFC", fine_refresh_mode).ns + 10)
         self.timing_settings = TimingSettings(
-            tRP   = self.ck_ns_to_cycles(self.get("tRP")),
-            tRCD  = self.ck_ns_to_cycles(self.get("tRCD")),
-            tWR   = self.ck_ns_to_cycles(self.get("tWR")),
-            tREFI = self.ck_ns_to_cycles(self.get("tREFI", fine_refresh_mode), margin=False),
-            tRFC  = self.ck_ns_to_cycles(self.get("tRFC", fine_refresh_mode)),
-            tWTR  = self.ck_ns_to_cycles(self.get("tWTR")),
-            tFAW  = None if self.get("tFAW") is None else self.ck_ns_to_cycles(self.get("tFAW")),
-            tCCD  = None if self.get("tCCD") is None else self.ck_ns_to_cycles(self.get("tCCD")),
-            tRRD  = None if self.get("tRRD") is None else self.ck_ns_to_cycles(self.get("tRRD")),
-            tRC   = None if self.get("tRAS") is None else self.ck_ns_to_cycles(self.get("tRP") + self.get("tRAS")),
-            tRAS  = None if self.get("tRAS") is None else self.ck_ns_to_cycles(self.get("tRAS")),
-            tZQCS = None if self.get("tZQCS") is None else self.ck_ns_to_cycles(self.get("tZQCS"))
+            tRP    = self.ck_ns_to_cycles(self.get("tRP")),
+            tRCD   = self.ck_ns_to_cycles(self.get("tRCD")),
+            tWR    = self.ck_ns_to_cycles(self.get("tWR")),
+            tREFI  = self.ck_ns_to_cycles(self.get("tREFI", fine_refresh_mode), margin=False),
+            tRFC   = self.ck_ns_to_cycles(self.get("tRFC", fine_refresh_mode)),
+            tWTR   = self.ck_ns_to_cycles(self.get("tWTR")),
+            tFAW   = None if self.get("tFAW") is None else self.ck_ns_to_cycles(self.get("tFAW")),
+            tCCD   = None if self.get("tCCD") is None else self.ck_ns_to_cycles(self.get("tCCD")),
+            tRRD   = None if self.get("tRRD") is None else self.ck_ns_to_cycles(self.get("tRRD")),
+            tRC    = None if self.get("tRAS") is None else self.ck_ns_to_cycles(self.get("tRP") + self.get("tRAS")),
+            tRAS   = None if self.get("tRAS") is None else self.ck_ns_to_cycles(self.get("tRAS")),
+            tZQCS  = None if self.get("tZQCS") is None else self.ck_ns_to_cycles(self.get("tZQCS")),
+            # Read to Precharge (JEDEC: max(4 tCK, 7.5ns))
+            tRTP   = self.ck_ns_to_cycles(Timing(4, 7.5)) if self.memtype in ["DDR3", "DDR4"] else None,
+            tCCD_S = None if self.get("tCCD_S") is None else self.ck_ns_to_cycles(self.get("tCCD_S")),
+            tRRD_S = None if self.get("tRRD_S") is None else self.ck_ns_to_cycles(self.get("tRRD_S")),
+            # Power-down exit (JEDEC: DDR2 2 tCK, DDR3 max(3 tCK, 7.5ns), DDR4 max(4 tCK, 6ns))
+            tXP    = None if txp is None else self.ck_ns_to_cycles(txp),
+            # Self-refresh exit to any command, DLL locking included (JEDEC: tXSRD/tXSDLL/tDLLK)
+            tXS    = None if txs is None else self.ck_ns_to_cycles(txs),
         )
         self.timing_settings.fine_refresh_mode = fine_refresh_mode
 
@@ -415,6 +432,7 @@ class SDRAMModule:
         # Create a deriving class to avoid modifying this one
         class _SDRAMModule(cls):
             memtype = spd.memtype
+            ngroups = getattr(spd, "ngroups", 1)
             nbanks = spd.nbanks
             nrows = spd.nrows
             ncols = spd.ncols
@@ -950,7 +968,7 @@ class EDY4016A(DDR4Module):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 260), "2x": (None, 160),   "4x": (None, 110)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 3.3))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(28, 30), tRAS=32),
     }
@@ -966,7 +984,7 @@ class MT40A1G8(DDR4Module):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 6.4), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5), tRRD=(4, 6.4), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 5.3))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=32),
         "2666": _SpeedgradeTimings(tRP=13.50, tRCD=13.50, tWR=15, tRFC=trfc, tFAW=(20, 21), tRAS=32),
@@ -983,7 +1001,7 @@ class MT40A2G8(DDR4Module):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 6.4), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5), tRRD=(4, 6.4), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 5.3))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=32),
         "2666": _SpeedgradeTimings(tRP=13.50, tRCD=13.50, tWR=15, tRFC=trfc, tFAW=(20, 21), tRAS=32),
@@ -1003,7 +1021,7 @@ class MT40A256M16(DDR4Module):
     # timings
     trefi = {"1x": 64e6/8192, "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 260), "2x": (None, 160), "4x": (None, 110)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 3.3))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(28, 35), tRAS=32),
     }
@@ -1019,7 +1037,7 @@ class MT40A512M8(DDR4Module):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 3.3))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=32),
         "2666": _SpeedgradeTimings(tRP=13.50, tRCD=13.50, tWR=15, tRFC=trfc, tFAW=(20, 21), tRAS=32),
@@ -1036,7 +1054,7 @@ class MT40A512M16(DDR4Module):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 3.3))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=13.32, tRCD=13.32, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=32),
     }
@@ -1054,7 +1072,7 @@ class KVR21SE15S84(DDR4Module):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5.355), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 3.7))
     speedgrade_timings = {
         "2133": _SpeedgradeTimings(tRP=13.5, tRCD=13.5, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=33),
     }
@@ -1070,7 +1088,7 @@ class MTA4ATF51264HZ(DDR4Module):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5.355), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 3.7))
     speedgrade_timings = {
         "2133": _SpeedgradeTimings(tRP=13.5, tRCD=13.5, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=33),
     }
@@ -1088,7 +1106,7 @@ class MTA18ASF2G72PZ(DDR4RegisteredModule):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, None), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 3.3))
     speedgrade_timings = {
         "2400": _SpeedgradeTimings(tRP=14.16, tRCD=14.16, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=32),
         "2666": _SpeedgradeTimings(tRP=14.25, tRCD=14.25, tWR=15, tRFC=trfc, tFAW=(20, 25), tRAS=32),
@@ -1111,7 +1129,7 @@ class HMA82GR7DJR4N(DDR4RegisteredModule):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, 5), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 2.5))
     speedgrade_timings = {
         "3200": _SpeedgradeTimings(tRP=13.75, tRCD=13.75, tWR=15, tRFC=trfc, tFAW=10, tRAS=32),
     }
@@ -1131,7 +1149,7 @@ class M393A2K40DB3(DDR4RegisteredModule):
     # timings
     trefi = {"1x": 64e6/8192,   "2x": (64e6/8192)/2, "4x": (64e6/8192)/4}
     trfc  = {"1x": (None, 350), "2x": (None, 260),   "4x": (None, 160)}
-    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(4, 5), tRRD=(4, 4.9), tZQCS=(128, 80))
+    technology_timings = _TechnologyTimings(tREFI=trefi, tWTR=(4, 7.5), tCCD=(5, 5), tRRD=(4, 4.9), tZQCS=(128, 80), tCCD_S=(4, None), tRRD_S=(4, 2.5))
     speedgrade_timings = {
         "3200": _SpeedgradeTimings(tRP=13.75, tRCD=13.75, tWR=15, tRFC=trfc, tFAW=10, tRAS=32),
     }
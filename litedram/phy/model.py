@@ -6,8 +6,7 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 # SDRAM simulation PHY at DFI level tested with SDR/DDR/DDR2/LPDDR/DDR3
-# TODO:
-# - add multirank support.
+# Multi-rank: each rank has its own banks, selected by cs_n.
 
 from migen import *
 
@@ -16,7 +15,7 @@ from litedram.phy.dfi import *
 from litedram.modules import _speedgrade_timings, _technology_timings
 
 from functools import reduce
-from operator import or_
+from operator import or_, and_
 
 import struct
 
@@ -93,6 +92,7 @@ class DFIPhaseModel(Module):
 
         self.bank         = phase.bank
         self.address      = phase.address
+        self.cs           = Signal(len(phase.cs_n))
 
         self.wrdata       = phase.wrdata
         self.wrdata_mask  = phase.wrdata_mask
@@ -107,12 +107,13 @@ class DFIPhaseModel(Module):
 
         # # #
 
+        self.comb += self.cs.eq(~phase.cs_n)
         self.comb += [
-            If(~phase.cs_n & ~phase.ras_n & phase.cas_n,
+            If((self.cs != 0) & ~phase.ras_n & phase.cas_n,
                 self.activate.eq(phase.we_n),
                 self.precharge.eq(~phase.we_n)
             ),
-            If(~phase.cs_n & phase.ras_n & ~phase.cas_n,
+            If((self.cs != 0) & phase.ras_n & ~phase.cas_n,
                 self.write.eq(~phase.we_n),
                 self.read.eq(phase.we_n)
             )
@@ -224,7 +225,7 @@ class DFITimingsChecker(Module):
 
         self.timings = new_timings
 
-    def __init__(self, dfi, nbanks, nphases, timings, refresh_mode, memtype, verbose=False):
+    def __init__(self, dfi, nbanks, nphases, timings, refresh_mode, memtype, verbose=False, nranks=1):
         self.logging_enabled = Signal(reset=1)
 
         self.prepare_timings(timings, refresh_mode, memtype)
@@ -236,19 +237,21 @@ class DFITimingsChecker(Module):
 
         phases = [getattr(dfi, "p" + str(n)) for n in range(nphases)]
 
-        last_cmd_ps = [[Signal.like(cnt) for _ in range(len(self.cmds))] for _ in range(nbanks)]
-        last_cmd    = [Signal(4) for i in range(nbanks)]
+        # Banks of all the ranks (rank in the MSBs of the bank index).
+        last_cmd_ps = [[Signal.like(cnt) for _ in range(len(self.cmds))] for _ in range(nranks*nbanks)]
+        last_cmd    = [Signal(4) for i in range(nranks*nbanks)]
 
-        act_ps   = Array([Signal().like(cnt) for i in range(4)])
-        act_curr = Signal(max=4)
+        act_ps   = [Array([Signal().like(cnt) for i in range(4)]) for r in range(nranks)]
+        act_curr = [Signal(max=4) for r in range(nranks)]
 
-        ref_issued = Signal(nphases)
+        ref_issued = [Signal(nphases) for r in range(nranks)]
 
         for np, phase in enumerate(phases):
             ps = Signal().like(cnt)
             self.comb += ps.eq((cnt + np)*self.timings["tCK"])
             state = Signal(4)
-            self.comb += state.eq(Cat(phase.we_n, phase.cas_n, phase.ras_n, phase.cs_n))
+            cs_n  = reduce(and_, [phase.cs_n[r] for r in range(nranks)])
+            self.comb += state.eq(Cat(phase.we_n, phase.cas_n, phase.ras_n, cs_n))
             all_banks = Signal()
 
             self.comb += all_banks.eq(
@@ -257,7 +260,8 @@ class DFITimingsChecker(Module):
             )
 
             # tREFI
-            self.comb += ref_issued[np].eq(self.cmds["REF"].enc == state)
+            for r in range(nranks):
+                self.comb += ref_issued[r][np].eq((self.cmds["REF"].enc == state) & ~phase.cs_n[r])
 
             # Print debug information
             if verbose:
@@ -273,10 +277,12 @@ class DFITimingsChecker(Module):
                     ]
 
             # Bank command monitoring
-            for i in range(nbanks):
+            for i in range(nranks*nbanks):
+                r = i//nbanks
                 for _, curr in self.cmds.items():
                     cmd_recv = Signal()
-                    self.comb += cmd_recv.eq(((phase.bank == i) | all_banks) & (state == curr.enc))
+                    self.comb += cmd_recv.eq(((phase.bank == i%nbanks) | all_banks) & ~phase.cs_n[r] &
+                        (state == curr.enc))
 
                     # Checking rules from self.rules
                     for _, prev in self.cmds.items():
@@ -292,87 +298,90 @@ class DFITimingsChecker(Module):
                     # Save command timestamp in an array
                     self.sync += If(cmd_recv, last_cmd_ps[i][curr.idx].eq(ps), last_cmd[i].eq(state))
 
-                    # tRRD & tFAW
+                    # tRRD & tFAW (per rank)
                     if curr.name == "ACT":
-                        act_next = Signal().like(act_curr)
-                        self.comb += act_next.eq(act_curr+1)
+                        act_next = Signal().like(act_curr[r])
+                        self.comb += act_next.eq(act_curr[r]+1)
 
                         # act_curr points to newest ACT timestamp
                         self.sync += [
-                            If(self.logging_enabled & cmd_recv & (ps < (act_ps[act_curr] + self.timings["tRRD"])),
+                            If(self.logging_enabled & cmd_recv & (ps < (act_ps[r][act_curr[r]] + self.timings["tRRD"])),
                                 Display("[%016dps] tRRD violation on bank %0d", ps, i)
                             )
                         ]
 
                         # act_next points to the oldest ACT timestamp
                         self.sync += [
-                            If(self.logging_enabled & cmd_recv & (ps < (act_ps[act_next] + self.timings["tFAW"])),
+                            If(self.logging_enabled & cmd_recv & (ps < (act_ps[r][act_next] + self.timings["tFAW"])),
                                 Display("[%016dps] tFAW violation on bank %0d", ps, i)
                             )
                         ]
 
                         # Save ACT timestamp in a circular buffer
-                        self.sync += If(cmd_recv, act_ps[act_next].eq(ps), act_curr.eq(act_next))
-
-        # tREFI
-        ref_ps      = Signal().like(cnt)
-        ref_ps_mod  = Signal().like(cnt)
-        ref_ps_diff = Signal(min=-2**63, max=2**63)
-        curr_diff   = Signal().like(ref_ps_diff)
-
-        self.comb += curr_diff.eq(ps - (ref_ps + self.timings["tREFI"]))
-
-        # Work in 64ms periods
-        self.sync += [
-            If(ref_ps_mod < int(64e9),
-                ref_ps_mod.eq(ref_ps_mod + nphases * self.timings["tCK"])
-            ).Else(
-                ref_ps_mod.eq(0)
-            )
-        ]
+                        self.sync += If(cmd_recv, act_ps[r][act_next].eq(ps), act_curr[r].eq(act_next))
 
-        # Update timestamp and difference
-        self.sync += If(ref_issued != 0, ref_ps.eq(ps), ref_ps_diff.eq(ref_ps_diff - curr_diff))
+        # tREFI (per rank)
+        for r in range(nranks):
+            rank_ref_issued = ref_issued[r]
 
-        self.sync += [
-            If((self.logging_enabled & ref_ps_mod == 0) & (ref_ps_diff > 0),
-                Display("[%016dps] tREFI violation (64ms period): %0d", ps, ref_ps_diff)
-            )
-        ]
+            ref_ps      = Signal().like(cnt)
+            ref_ps_mod  = Signal().like(cnt)
+            ref_ps_diff = Signal(min=-2**63, max=2**63)
+            curr_diff   = Signal().like(ref_ps_diff)
 
-        # Report any refresh periods longer than tREFI
-        if verbose:
-            ref_done = Signal()
-            self.sync += [
-                If(ref_issued != 0,
-                    ref_done.eq(1),
-                    If(self.logging_enabled & ~ref_done,
-                        Display("[%016dps] Late refresh", ps)
-                    )
-                )
-            ]
+            self.comb += curr_diff.eq(ps - (ref_ps + self.timings["tREFI"]))
 
+            # Work in 64ms periods
             self.sync += [
-                If(self.logging_enabled & (curr_diff > 0) & ref_done & (ref_issued == 0),
-                    Display("[%016dps] tREFI violation", ps),
-                    ref_done.eq(0)
+                If(ref_ps_mod < int(64e9),
+                    ref_ps_mod.eq(ref_ps_mod + nphases * self.timings["tCK"])
+                ).Else(
+                    ref_ps_mod.eq(0)
                 )
             ]
 
-        # There is a maximum delay between refreshes on >=DDR
-        ref_limit = {"1x": 9, "2x": 17, "4x": 36}
-        if memtype != "SDR":
-            refresh_mode = "1x" if refresh_mode is None else refresh_mode
-            ref_done = Signal()
-            self.sync += If(ref_issued != 0, ref_done.eq(1))
+            # Update timestamp and difference
+            self.sync += If(rank_ref_issued != 0, ref_ps.eq(ps), ref_ps_diff.eq(ref_ps_diff - curr_diff))
+
             self.sync += [
-                If(self.logging_enabled & (ref_issued == 0) & ref_done &
-                   (ref_ps > (ps + ref_limit[refresh_mode] * self.timings['tREFI'])),
-                    Display("[%016dps] tREFI violation (too many postponed refreshes)", ps),
-                    ref_done.eq(0)
+                If((self.logging_enabled & ref_ps_mod == 0) & (ref_ps_diff > 0),
+                    Display("[%016dps] tREFI violation (64ms period): %0d", ps, ref_ps_diff)
                 )
             ]
 
+            # Report any refresh periods longer than tREFI
+            if verbose:
+                ref_done = Signal()
+                self.sync += [
+                    If(rank_ref_issued != 0,
+                        ref_done.eq(1),
+                        If(self.logging_enabled & ~ref_done,
+                            Display("[%016dps] Late refresh", ps)
+                        )
+                    )
+                ]
+
+                self.sync += [
+                    If(self.logging_enabled & (curr_diff > 0) & ref_done & (rank_ref_issued == 0),
+                        Display("[%016dps] tREFI violation", ps),
+                        ref_done.eq(0)
+                    )
+                ]
+
+            # There is a maximum delay between refreshes on >=DDR
+            ref_limit = {"1x": 9, "2x": 17, "4x": 36}
+            if memtype != "SDR":
+                refresh_mode = "1x" if refresh_mode is None else refresh_mode
+                ref_done = Signal()
+                self.sync += If(rank_ref_issued != 0, ref_done.eq(1))
+                self.sync += [
+                    If(self.logging_enabled & (rank_ref_issued == 0) & ref_done &
+                       (ref_ps > (ps + ref_limit[refresh_mode] * self.timings['tREFI'])),
+                        Display("[%016dps] tREFI violation (too many postponed refreshes)", ps),
+                        ref_done.eq(0)
+                    )
+                ]
+
 # SDRAM PHY Settings -------------------------------------------------------------------------------
 
 sdram_module_nphases = {
@@ -384,7 +393,7 @@ sdram_module_nphases = {
     "DDR4":  4,
 }
 
-def get_sdram_phy_settings(memtype, data_width, clk_freq):
+def get_sdram_phy_settings(memtype, data_width, clk_freq, nranks=1):
     nphases = sdram_module_nphases[memtype]
 
     if memtype == "SDR":
@@ -439,13 +448,16 @@ def get_sdram_phy_settings(memtype, data_width, clk_freq):
         memtype      = memtype,
         databits     = data_width,
         dfi_databits = data_width if memtype == "SDR" else 2*data_width,
+        nranks       = nranks,
         **sdram_phy_settings,
     )
 
 # SDRAM PHY Model ----------------------------------------------------------------------------------
 
 class SDRAMPHYModel(Module):
-    def __prepare_bank_init_data(self, init, nbanks, nrows, ncols, data_width, address_mapping):
+    def __prepare_bank_init_data(self, init, nbanks, nrows, ncols, data_width, address_mapping, nranks=1):
+        # Banks of all the ranks are filled as nranks*nbanks banks (rank in the MSBs of the bank).
+        nbanks = nranks*nbanks
         mem_size          = (self.settings.databits//8)*(nrows*ncols*nbanks)
         bank_size         = mem_size // nbanks
         column_size       = bank_size // nrows
@@ -480,14 +492,21 @@ class SDRAMPHYModel(Module):
                 )[0:model_data_ratio]
             init = new_init
 
-        if address_mapping == "ROW_BANK_COL":
+        if address_mapping in ["ROW_BANK_COL", "ROW_BANK_RANK_COL", "ROW_BANK_COL_XOR"]:
             for row in range(nrows):
                 for bank in range(nbanks):
                     start = (row*nbanks*model_column_size + bank*model_column_size)
                     end   = min(start + model_column_size, len(init))
                     if start > len(init):
                         break
-                    bank_init[bank].extend(init[start:end])
+                    if address_mapping == "ROW_BANK_COL_XOR":
+                        bank_init[bank ^ (row % nbanks)].extend(init[start:end])
+                    elif address_mapping == "ROW_BANK_RANK_COL":
+                        # Rank bits below bank bits in the address.
+                        rank = bank % nranks
+                        bank_init[rank*(nbanks//nranks) + bank//nranks].extend(init[start:end])
+                    else:
+                        bank_init[bank].extend(init[start:end])
         elif address_mapping == "BANK_ROW_COL":
             for bank in range(nbanks):
                 start = bank*model_bank_size
@@ -499,6 +518,7 @@ class SDRAMPHYModel(Module):
         return bank_init
 
     def __init__(self, module, settings=None, data_width=None, clk_freq=100e6,
+        nranks                 = 1,
         we_granularity         = 8,
         init                   = [],
         address_mapping        = "ROW_BANK_COL",
@@ -510,7 +530,8 @@ class SDRAMPHYModel(Module):
             settings = get_sdram_phy_settings(
                 memtype    = module.memtype,
                 data_width = data_width,
-                clk_freq   = clk_freq
+                clk_freq   = clk_freq,
+                nranks     = nranks
             )
 
         # Parameters -------------------------------------------------------------------------------
@@ -544,6 +565,7 @@ class SDRAMPHYModel(Module):
         # # #
 
         nphases    = self.settings.nphases
+        nranks     = self.settings.nranks
         nbanks     = 2**bankbits
         nrows      = 2**rowbits
         ncols      = 2**colbits
@@ -570,11 +592,12 @@ class SDRAMPHYModel(Module):
                 timings      = timings,
                 refresh_mode = self.module.timing_settings.fine_refresh_mode,
                 memtype      = settings.memtype,
-                verbose      = verbosity > SDRAM_VERBOSE_DBG)
+                verbose      = verbosity > SDRAM_VERBOSE_DBG,
+                nranks       = nranks)
             self.submodules += timing_checker
 
         # Bank init data ---------------------------------------------------------------------------
-        bank_init  = [None for i in range(nbanks)]
+        bank_init  = [None for i in range(nranks*nbanks)]
 
         if init:
             bank_init = self.__prepare_bank_init_data(
@@ -583,10 +606,11 @@ class SDRAMPHYModel(Module):
                 nrows           = nrows,
                 ncols           = ncols,
                 data_width      = data_width,
-                address_mapping = address_mapping
+                address_mapping = address_mapping,
+                nranks          = nranks
             )
 
-        # Banks ------------------------------------------------------------------------------------
+        # Banks (of all the ranks, rank in the MSBs of the bank index) -----------------------------
         banks = [BankModel(
             data_width     = data_width,
             nrows          = nrows,
@@ -594,18 +618,19 @@ class SDRAMPHYModel(Module):
             burst_length   = burst_length,
             nphases        = nphases,
             we_granularity = we_granularity,
-            init           = bank_init[i]) for i in range(nbanks)]
+            init           = bank_init[i]) for i in range(nranks*nbanks)]
         self.submodules += banks
 
         # Connect DFI phases to Banks (CMDs, Write datapath) ---------------------------------------
-        for nb, bank in enumerate(banks):
+        for i, bank in enumerate(banks):
+            nr, nb = i//nbanks, i%nbanks
             # Bank activate
             activates = Signal(len(phases))
             cases     = {}
             for np, phase in enumerate(phases):
                 self.comb += activates[np].eq(phase.activate)
                 cases[2**np] = [
-                    bank.activate.eq(phase.bank == nb),
+                    bank.activate.eq((phase.bank == nb) & phase.cs[nr]),
                     bank.activate_row.eq(phase.address)
                 ]
             self.comb += Case(activates, cases)
@@ -616,7 +641,7 @@ class SDRAMPHYModel(Module):
             for np, phase in enumerate(phases):
                 self.comb += precharges[np].eq(phase.precharge)
                 cases[2**np] = [
-                    bank.precharge.eq((phase.bank == nb) | phase.address[10])
+                    bank.precharge.eq(((phase.bank == nb) | phase.address[10]) & phase.cs[nr])
                 ]
             self.comb += Case(precharges, cases)
 
@@ -628,7 +653,7 @@ class SDRAMPHYModel(Module):
             for np, phase in enumerate(phases):
                 self.comb += writes[np].eq(phase.write)
                 cases[2**np] = [
-                    bank_write.eq(phase.bank == nb),
+                    bank_write.eq((phase.bank == nb) & phase.cs[nr]),
                     bank_write_col.eq(phase.address)
                 ]
             self.comb += Case(writes, cases)
@@ -659,7 +684,7 @@ class SDRAMPHYModel(Module):
             for np, phase in enumerate(phases):
                 self.comb += reads[np].eq(phase.read)
                 cases[2**np] = [
-                    bank.read.eq(phase.bank == nb),
+                    bank.read.eq((phase.bank == nb) & phase.cs[nr]),
                     bank.read_col.eq(phase.address)
             ]
             self.comb += Case(reads, cases)
@@ -249,10 +249,13 @@ class DRAMMemory:
                 yield
                 yield dram_port.rdata.valid.eq(0)
                 yield dram_port.rdata.data.eq(0)
-                pending = 0
+                pending -= 1
+                address += 1
             elif (yield dram_port.cmd.valid):
                 pending = not (yield dram_port.cmd.we)
                 address = (yield dram_port.cmd.addr)
+                if pending and hasattr(dram_port.cmd, "len"):
+                    pending += (yield dram_port.cmd.len)
                 if pending:
                     yield dram_port.cmd.ready.eq(1)
                     yield
@@ -277,11 +280,14 @@ class DRAMMemory:
                 self._write(address, (yield dram_port.wdata.data), (yield dram_port.wdata.we))
                 yield dram_port.wdata.ready.eq(0)
                 yield
-                pending = 0
+                pending -= 1
+                address += 1
                 yield
             elif (yield dram_port.cmd.valid):
                 pending = (yield dram_port.cmd.we)
                 address = (yield dram_port.cmd.addr)
+                if pending and hasattr(dram_port.cmd, "len"):
+                    pending += (yield dram_port.cmd.len)
                 if pending:
                     yield dram_port.cmd.ready.eq(1)
                     yield
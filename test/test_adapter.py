@@ -5,6 +5,7 @@
 # Copyright (c) 2020 Antmicro <www.antmicro.com>
 # SPDX-License-Identifier: BSD-2-Clause
 
+import random
 import unittest
 
 from migen import *
@@ -13,6 +14,7 @@ from litex.soc.interconnect.stream import *
 
 from litedram.common import LiteDRAMNativePort, LiteDRAMNativeWritePort, LiteDRAMNativeReadPort
 from litedram.frontend.adapter import LiteDRAMNativePortConverter, LiteDRAMNativePortCDC
+from litedram.frontend.adapter import LiteDRAMNativePortWriteBuffer
 
 from test.common import *
 
@@ -79,6 +81,42 @@ class CDCDUT(ConverterDUT):
             port_to   = self.read_crossbar_port)
 
 
+class WriteBufferDUT(Module):
+    def __init__(self, data_width, mem_depth, depth=4):
+        self.user_port     = LiteDRAMNativePort(mode="both", address_width=32, data_width=data_width)
+        self.crossbar_port = LiteDRAMNativePort(mode="both", address_width=32, data_width=data_width)
+        self.driver        = NativePortDriver(self.user_port)
+        self.submodules.write_buffer = LiteDRAMNativePortWriteBuffer(
+            self.user_port, self.crossbar_port, depth=depth)
+
+        # Memory
+        self.memory = DRAMMemory(data_width, mem_depth)
+
+        # Commands received by the memory
+        self.crossbar_reads  = 0
+        self.crossbar_writes = 0
+
+    @passive
+    def crossbar_monitor(self):
+        while True:
+            if (yield self.crossbar_port.cmd.valid) and (yield self.crossbar_port.cmd.ready):
+                if (yield self.crossbar_port.cmd.we):
+                    self.crossbar_writes += 1
+                else:
+                    self.crossbar_reads += 1
+            yield
+
+    def generators(self, main_generator):
+        return [
+            main_generator(self),
+            *self.driver.generators(),
+            self.memory.write_handler(self.crossbar_port),
+            self.memory.read_handler(self.crossbar_port),
+            self.crossbar_monitor(),
+            timeout_generator(10000),
+        ]
+
+
 class TestAdapter(MemoryTestDataMixin, unittest.TestCase):
     def test_down_converter_ratio_must_be_integer(self):
         with self.assertRaises(ValueError) as cm:
@@ -406,3 +444,114 @@ class TestAdapter(MemoryTestDataMixin, unittest.TestCase):
             "native": (7, 3),
         }
         self.cdc_readback_test(dut, data["pattern"], data["expected"], clocks=clocks)
+
+    def test_write_buffer_readback(self):
+        # Verify that data written through the write buffer is read back and written to memory.
+        data = self.pattern_test_data["32bit"]
+
+        def main_generator(dut):
+            for adr, value in data["pattern"]:
+                yield from dut.driver.write(adr, value)
+            for adr, _ in data["pattern"]:
+                yield from dut.driver.read(adr, wait_data=False)
+            yield from dut.driver.wait_all()
+            for _ in range(64):  # Let the buffer drain.
+                yield
+
+        dut = WriteBufferDUT(data_width=32, mem_depth=len(data["expected"]))
+        run_simulation(dut, dut.generators(main_generator))
+        self.assertEqual(dut.memory.mem, data["expected"])
+        self.assertEqual(dut.driver.rdata, [value for adr, value in data["pattern"]])
+
+    def test_write_buffer_merge_and_forward(self):
+        # Verify that partial writes to the same address are merged in a single write and that a
+        # read hitting the buffer is served from it.
+        def main_generator(dut):
+            yield from dut.driver.write(1, 0x000000aa, we=0b0001)
+            yield from dut.driver.write(1, 0x0000bb00, we=0b0010)
+            yield from dut.driver.write(1, 0xcccc0000, we=0b1100)
+            self.assertEqual((yield from dut.driver.read(1)), 0xccccbbaa)
+            self.assertEqual(dut.crossbar_writes, 0)
+            for _ in range(64):  # Let the buffer drain.
+                yield
+
+        dut = WriteBufferDUT(data_width=32, mem_depth=4)
+        run_simulation(dut, dut.generators(main_generator))
+        self.assertEqual(dut.memory.mem, [0, 0xccccbbaa, 0, 0])
+        self.assertEqual((dut.crossbar_writes, dut.crossbar_reads), (1, 0))
+
+    def test_write_buffer_partial_read(self):
+        # Verify that a read hitting a partially written entry gets the memory data merged with the
+        # buffered bytes.
+        def main_generator(dut):
+            yield from dut.driver.write(2, 0x000000aa, we=0b0001)
+            self.assertEqual((yield from dut.driver.read(2)), 0x112233aa)
+
+        dut = WriteBufferDUT(data_width=32, mem_depth=4)
+        dut.memory.mem[2] = 0x11223344
+        run_simulation(dut, dut.generators(main_generator))
+        self.assertEqual(dut.memory.mem, [0, 0, 0x112233aa, 0])
+        self.assertEqual((dut.crossbar_writes, dut.crossbar_reads), (1, 1))
+
+    def test_write_buffer_pipelined_drain(self):
+        # Verify that the drain issues the write commands back to back, without waiting for the
+        # write data of the previous ones.
+        cmds  = []
+        wdata = []
+
+        def main_generator(dut):
+            for adr in range(4):
+                yield from dut.driver.write(adr, 0x10 + adr)
+            yield from dut.driver.wait_all()
+            for _ in range(64):  # Let the buffer drain.
+                yield
+
+        @passive
+        def crossbar_handler(dut):
+            yield dut.crossbar_port.cmd.ready.eq(1)
+            while True:
+                if (yield dut.crossbar_port.cmd.valid):
+                    cmds.append((yield dut.crossbar_port.cmd.addr))
+                    if len(cmds) == 4:
+                        yield dut.crossbar_port.wdata.ready.eq(1)
+                if (yield dut.crossbar_port.wdata.valid) & (yield dut.crossbar_port.wdata.ready):
+                    wdata.append(((yield dut.crossbar_port.wdata.data), len(cmds)))
+                yield
+
+        dut = WriteBufferDUT(data_width=32, mem_depth=4)
+        run_simulation(dut, [
+            main_generator(dut),
+            *dut.driver.generators(),
+            crossbar_handler(dut),
+            timeout_generator(1000),
+        ])
+        self.assertEqual(cmds, [0, 1, 2, 3])
+        # All the write commands are accepted before the first write data.
+        self.assertEqual(wdata, [(0x10, 4), (0x11, 4), (0x12, 4), (0x13, 4)])
+
+    def test_write_buffer_random(self):
+        # Verify random partial writes and reads against a reference model.
+        prng      = random.Random(42)
+        reference = [0]*8
+        expected  = []
+
+        def main_generator(dut):
+            for i in range(128):
+                adr = prng.randrange(8)
+                if prng.randrange(2):
+                    value = prng.randrange(2**32)
+                    we    = prng.randrange(1, 16)
+                    mask  = sum(0xff << 8*b for b in range(4) if we & (1 << b))
+                    reference[adr] = (reference[adr] & ~mask) | (value & mask)
+                    yield from dut.driver.write(adr, value, we=we)
+                else:
+                    expected.append(reference[adr])
+                    yield from dut.driver.read(adr, wait_data=prng.randrange(2))
+            yield from dut.driver.wait_all()
+            for _ in range(64):  # Let the buffer drain.
+                yield
+
+        dut = WriteBufferDUT(data_width=32, mem_depth=8)
+        run_simulation(dut, dut.generators(main_generator))
+        self.assertEqual(dut.driver.rdata, expected)
+        self.assertEqual(dut.memory.mem, reference)
@@ -70,7 +70,8 @@ def strb_to_mask(strb, data_width):
 
 class TestAXI(unittest.TestCase):
     def _test_axi2native(self,
-        naccesses=16, simultaneous_writes_reads=False,
+        naccesses=16, simultaneous_writes_reads=False, with_burst=False, arbitration="burst",
+        with_read_port=False, reads_wait_responses=False,
         # Random: 0: min (no random), 100: max.
         # Burst randomness
         id_rand_enable   = False,
@@ -139,12 +140,18 @@ class TestAXI(unittest.TestCase):
                 yield
                 if (yield axi_port.b.id) != write.id:
                     self.writes_id_errors += 1
+            axi_port.writes_done = True
 
         def reads_cmd_generator(axi_port, reads):
             prng = random.Random(42)
             while not axi_port.reads_enable:
                 yield
-            for read in reads:
+            for i, read in enumerate(reads):
+                # AXI doesn't order reads with writes: wait for the write responses before reading the
+                # written data (when reads can overtake writes).
+                if reads_wait_responses and (i == len(dummy_reads)):
+                    while not axi_port.writes_done:
+                        yield
                 while prng.randrange(100) < ar_valid_random:
                     yield
                 # Send command
@@ -191,10 +198,23 @@ class TestAXI(unittest.TestCase):
                         if (yield axi_port.r.last) != 0:
                             self.reads_last_errors += 1
 
+        @passive
+        def cmds_counter(dram_port):
+            self.cmds = 0
+            while True:
+                if (yield dram_port.cmd.valid) and (yield dram_port.cmd.ready):
+                    self.cmds += 1
+                yield
+
         # DUT
         axi_port  = LiteDRAMAXIPort(data_width=32, address_width=32, id_width=8)
-        dram_port = LiteDRAMNativePort("both", 32, 32)
-        dut       = LiteDRAMAXI2Native(axi_port, dram_port, with_read_modify_write=True)
+        dram_port = LiteDRAMNativePort("both", 32, 32, len_width=4 if with_burst else 0)
+        read_port = LiteDRAMNativePort("read", 32, 32) if with_read_port else None
+        dut       = LiteDRAMAXI2Native(axi_port, dram_port,
+            with_read_modify_write = not with_burst,
+            with_burst             = with_burst,
+            arbitration            = arbitration,
+            read_port              = read_port)
         mem       = DRAMMemory(32, 1024)
 
         # Generate writes/reads
@@ -213,6 +233,7 @@ class TestAXI(unittest.TestCase):
         reads = dummy_reads + writes
 
         # Simulation
+        axi_port.writes_done = False
         if simultaneous_writes_reads:
             axi_port.reads_enable = True
         else:
@@ -224,8 +245,11 @@ class TestAXI(unittest.TestCase):
             reads_cmd_generator(axi_port, reads),
             reads_response_data_generator(axi_port, reads),
             mem.read_handler(dram_port, rdata_valid_random=r_valid_random),
-            mem.write_handler(dram_port, wdata_ready_random=w_ready_random)
+            mem.write_handler(dram_port, wdata_ready_random=w_ready_random),
+            cmds_counter(dram_port)
         ]
+        if with_read_port:
+            generators += [mem.read_handler(read_port, rdata_valid_random=r_valid_random)]
         run_simulation(dut, generators, vcd_name="sim.vcd")
         #mem.show_content()
         self.assertEqual(self.writes_id_errors, 0)
@@ -290,3 +314,225 @@ class TestAXI(unittest.TestCase):
             r_valid_random  = 90,
             r_ready_random  = 90
         )
+
+    # Burst mode
+    def test_axi2native_burst_no_random(self):
+        self._test_axi2native(simultaneous_writes_reads=False, with_burst=True)
+        # 16 INCR bursts of 1 to 16 beats (136 beats) written then read back in chunks of up to 16
+        # beats, plus 32 single beat dummy reads.
+        self.assertLess(self.cmds, 32 + 2*136//4)
+
+    def test_axi2native_burst_random_bursts(self):
+        self._test_axi2native(
+            simultaneous_writes_reads = True,
+            with_burst       = True,
+            id_rand_enable   = True,
+            len_rand_enable  = True,
+            data_rand_enable = True)
+
+    def test_axi2native_burst_random_all(self):
+        self._test_axi2native(
+            simultaneous_writes_reads=True,
+            with_burst      = True,
+            id_rand_enable  = True,
+            len_rand_enable = True,
+            aw_valid_random = 50,
+            w_ready_random  = 50,
+            b_ready_random  = 50,
+            w_valid_random  = 50,
+            ar_valid_random = 90,
+            r_valid_random  = 90,
+            r_ready_random  = 90
+        )
+
+    def test_axi2native_burst_check(self):
+        axi_port = LiteDRAMAXIPort(data_width=32, address_width=32, id_width=8)
+        with self.assertRaises(ValueError):
+            LiteDRAMAXI2Native(axi_port, LiteDRAMNativePort("both", 32, 32), with_burst=True)
+        with self.assertRaises(ValueError):
+            LiteDRAMAXI2Native(axi_port, LiteDRAMNativePort("both", 32, 32, len_width=4),
+                with_read_modify_write=True, with_burst=True)
+        with self.assertRaises(ValueError):
+            LiteDRAMAXI2Native(axi_port, LiteDRAMNativePort("both", 32, 32, len_width=4),
+                base_address=0x20, with_burst=True)
+
+    # Out-of-order reads
+    def test_axi2native_reordering(self):
+        # With a tagged Native port, reads of different AXI IDs can complete out of order, but reads
+        # of the same AXI ID must be returned in order with the right last.
+        axi_port  = LiteDRAMAXIPort(data_width=32, address_width=32, id_width=8)
+        dram_port = LiteDRAMNativePort("both", 32, 32, id_width=2)
+        dut       = LiteDRAMAXI2Native(axi_port, dram_port)
+        mem       = DRAMMemory(32, 1024, init=[0x1000 + i for i in range(1024)])
+
+        prng  = random.Random(42)
+        reads = []
+        for i in range(32):
+            _id  = prng.choice([1, 2, 3, 4, 5, 6]) # More IDs than port slots.
+            _len = prng.randrange(4)
+            _adr = prng.randrange(1024 - _len)
+            reads.append(Read(_adr, [0x1000 + _adr + j for j in range(_len + 1)], None, _id,
+                type=BURST_INCR, len=_len, size=log2_int(32//8)))
+
+        def reads_cmd_generator():
+            for read in reads:
+                yield axi_port.ar.valid.eq(1)
+                yield axi_port.ar.addr.eq(read.addr<<2)
+                yield axi_port.ar.burst.eq(read.type)
+                yield axi_port.ar.len.eq(read.len)
+                yield axi_port.ar.size.eq(read.size)
+                yield axi_port.ar.id.eq(read.id)
+                yield
+                while (yield axi_port.ar.ready) == 0:
+                    yield
+            yield axi_port.ar.valid.eq(0)
+
+        @passive
+        def tagged_read_handler():
+            # Queue reads per port ID and complete them in random order across IDs.
+            queues = {}
+            yield dram_port.cmd.ready.eq(1)
+            while True:
+                yield dram_port.rdata.valid.eq(0)
+                if (yield dram_port.cmd.valid):
+                    queues.setdefault((yield dram_port.cmd.id), []).append((yield dram_port.cmd.addr))
+                ids = [i for i, queue in queues.items() if queue]
+                if ids and prng.randrange(100) < 50:
+                    i = prng.choice(ids)
+                    yield dram_port.rdata.valid.eq(1)
+                    yield dram_port.rdata.id.eq(i)
+                    yield dram_port.rdata.data.eq(mem._read(queues[i].pop(0)))
+                yield
+
+        beats = []
+        def reads_response_generator():
+            yield axi_port.r.ready.eq(1)
+            while len(beats) < sum(len(read.data) for read in reads):
+                if (yield axi_port.r.valid):
+                    beats.append(((yield axi_port.r.id), (yield axi_port.r.data), (yield axi_port.r.last)))
+                yield
+
+        run_simulation(dut, [reads_cmd_generator(), tagged_read_handler(), reads_response_generator()])
+        for _id in set(read.id for read in reads):
+            expected = [(data, int(j == len(read.data) - 1))
+                for read in reads if read.id == _id for j, data in enumerate(read.data)]
+            self.assertEqual([(data, last) for i, data, last in beats if i == _id], expected)
+        in_order = [(read.id, data) for read in reads for data in read.data]
+        self.assertNotEqual([(i, data) for i, data, last in beats], in_order)
+
+    # Write/Read arbitration
+    def test_axi2native_beat_arbitration(self):
+        self._test_axi2native(simultaneous_writes_reads=True, arbitration="beat")
+
+    def test_axi2native_read_arbitration(self):
+        self._test_axi2native(simultaneous_writes_reads=True, arbitration="read",
+            reads_wait_responses=True)
+
+    def test_axi2native_read_arbitration_random_all(self):
+        self._test_axi2native(
+            simultaneous_writes_reads = True,
+            arbitration               = "read",
+            reads_wait_responses      = True,
+            id_rand_enable            = True,
+            len_rand_enable           = True,
+            aw_valid_random           = 50,
+            w_ready_random            = 50,
+            b_ready_random            = 50,
+            w_valid_random            = 50,
+            ar_valid_random           = 90,
+            r_valid_random            = 90,
+            r_ready_random            = 90
+        )
+
+    def test_axi2native_read_port(self):
+        self._test_axi2native(simultaneous_writes_reads=True, with_read_port=True,
+            reads_wait_responses=True)
+
+    def test_axi2native_read_port_random_all(self):
+        self._test_axi2native(
+            simultaneous_writes_reads = True,
+            with_read_port            = True,
+            reads_wait_responses      = True,
+            id_rand_enable            = True,
+            len_rand_enable           = True,
+            aw_valid_random           = 50,
+            w_ready_random            = 50,
+            b_ready_random            = 50,
+            w_valid_random            = 50,
+            ar_valid_random           = 90,
+            r_valid_random            = 90,
+            r_ready_random            = 90
+        )
+
+    def _test_axi2native_arbitration(self, arbitration, read_len=3, **kwargs):
+        # Issue a 16-beat write burst, then a read burst (4-beat by default) once the first write cmd
+        # has been sent, and return the sequence of cmds (1: write, 0: read) sent to the Native port.
+        axi_port  = LiteDRAMAXIPort(data_width=32, address_width=32, id_width=8)
+        dram_port = LiteDRAMNativePort("both", 32, 32)
+        dut       = LiteDRAMAXI2Native(axi_port, dram_port, arbitration=arbitration, **kwargs)
+        mem       = DRAMMemory(32, 1024)
+        cmds      = []
+
+        def axi_generator():
+            yield axi_port.aw.valid.eq(1)
+            yield axi_port.aw.burst.eq(BURST_INCR)
+            yield axi_port.aw.len.eq(15)
+            yield axi_port.aw.size.eq(log2_int(32//8))
+            yield axi_port.w.valid.eq(1)
+            yield axi_port.w.strb.eq(0xf)
+            yield axi_port.b.ready.eq(1)
+            yield axi_port.r.ready.eq(1)
+            for i in range(16):
+                yield axi_port.w.data.eq(i)
+                yield axi_port.w.last.eq(i == 15)
+                yield
+                while (yield axi_port.w.ready) == 0:
+                    yield
+                yield axi_port.aw.valid.eq(0)
+            yield axi_port.w.valid.eq(0)
+            while len(cmds) == 0:
+                yield
+            yield axi_port.ar.valid.eq(1)
+            yield axi_port.ar.addr.eq(0x100)
+            yield axi_port.ar.burst.eq(BURST_INCR)
+            yield axi_port.ar.len.eq(read_len)
+            yield axi_port.ar.size.eq(log2_int(32//8))
+            yield
+            while (yield axi_port.ar.ready) == 0:
+                yield
+            yield axi_port.ar.valid.eq(0)
+            while len(cmds) < (16 + read_len + 1):
+                yield
+
+        @passive
+        def cmds_monitor():
+            while True:
+                if (yield dram_port.cmd.valid) and (yield dram_port.cmd.ready):
+                    cmds.append((yield dram_port.cmd.we))
+                yield
+
+        run_simulation(dut, [axi_generator(), cmds_monitor(),
+            mem.read_handler(dram_port), mem.write_handler(dram_port)])
+        self.assertEqual(sorted(cmds), [0]*(read_len + 1) + [1]*16)
+        return "".join(str(cmd) for cmd in cmds)
+
+    def test_axi2native_arbitration_order(self):
+        # burst: the reads wait for the end of the write burst.
+        self.assertEqual(self._test_axi2native_arbitration("burst"), "1"*16 + "0"*4)
+        # beat: reads and writes alternate.
+        self.assertIn("01010101", self._test_axi2native_arbitration("beat")[:12])
+        # read: the reads are issued back to back in the middle of the write burst.
+        self.assertIn("0000", self._test_axi2native_arbitration("read")[:12])
+        # read: a write waiting for more than write_age_max cycles is granted over the reads.
+        cmds = self._test_axi2native_arbitration("read", read_len=31, write_age_max=8)
+        self.assertIn("1", cmds[cmds.index("0"):cmds.rindex("0")])
+        cmds = self._test_axi2native_arbitration("read", read_len=31, write_age_max=255)
+        self.assertNotIn("1", cmds[cmds.index("0"):cmds.rindex("0")])
+
+    def test_axi2native_arbitration_check(self):
+        axi_port = LiteDRAMAXIPort(data_width=32, address_width=32, id_width=8)
+        with self.assertRaises(ValueError):
+            LiteDRAMAXI2Native(axi_port, LiteDRAMNativePort("both", 32, 32), arbitration="fifo")
+        with self.assertRaises(ValueError):
+            LiteDRAMAXI2Native(axi_port, LiteDRAMNativePort("write", 32, 32),
+                read_port=LiteDRAMNativePort("read", 32, 32), with_read_modify_write=True)
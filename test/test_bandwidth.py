@@ -14,7 +14,8 @@ from migen import *
 from litex.soc.interconnect import stream
 
 from litedram.common import *
-from litedram.core.bandwidth import Bandwidth
+from litedram.phy import dfi
+from litedram.core.bandwidth import Bandwidth, PerformanceMonitor, LatencyHistogram
 
 from test.common import timeout_generator, CmdRequestRWDriver
 
@@ -26,6 +27,22 @@ class BandwidthDUT(Module):
         self.submodules.bandwidth = Bandwidth(self.cmd, data_width, **kwargs)
 
 
+class BankMachineEventsStub:
+    def __init__(self):
+        self.row_hit_event      = Signal()
+        self.row_miss_event     = Signal()
+        self.row_conflict_event = Signal()
+
+
+class PerformanceMonitorDUT(Module):
+    def __init__(self, nbanks=2, nphases=2):
+        self.dfi = dfi.Interface(addressbits=13, bankbits=3, nranks=1, databits=16, nphases=nphases)
+        self.bank_machines = [BankMachineEventsStub() for _ in range(nbanks)]
+        self.read = Signal()
+        self.submodules.perfmon = PerformanceMonitor(self.dfi, self.bank_machines,
+            states={"read": self.read})
+
+
 class CommandDriver:
     def __init__(self, cmd, cmd_options=None):
         self.cmd = cmd
@@ -243,3 +260,98 @@ class TestBandwidth(unittest.TestCase):
             cmd_driver.timeline_generator(timeline.items()),
         ]
         run_simulation(dut, generators)
+
+    def test_perfmon_counts(self):
+        # Verify that the performance monitor counts DFI commands, bank events and FSM state cycles
+        # and that counters are copied to the CSRs and cleared on update.
+        def dfi_cmd(phase, cas_n, ras_n, we_n):
+            yield phase.cs_n.eq(0)
+            yield phase.cas_n.eq(cas_n)
+            yield phase.ras_n.eq(ras_n)
+            yield phase.we_n.eq(we_n)
+
+        def main_generator(dut):
+            p0, p1 = dut.dfi.phases
+            # Cycle 0: ACT + PRE, cycle 1: ACT + ACT, cycle 2: REF
+            yield from dfi_cmd(p0, cas_n=1, ras_n=0, we_n=1)
+            yield from dfi_cmd(p1, cas_n=1, ras_n=0, we_n=0)
+            yield dut.bank_machines[0].row_hit_event.eq(1)
+            yield dut.bank_machines[1].row_conflict_event.eq(1)
+            yield dut.read.eq(1)
+            yield
+            yield from dfi_cmd(p1, cas_n=1, ras_n=0, we_n=1)
+            yield dut.bank_machines[1].row_conflict_event.eq(0)
+            yield dut.bank_machines[1].row_miss_event.eq(1)
+            yield
+            yield from dfi_cmd(p0, cas_n=0, ras_n=0, we_n=1)
+            yield p1.cs_n.eq(1)
+            yield dut.bank_machines[0].row_hit_event.eq(0)
+            yield dut.bank_machines[1].row_miss_event.eq(0)
+            yield dut.read.eq(0)
+            yield
+            yield p0.cs_n.eq(1)
+            yield
+
+            # Counters only copied on update
+            self.assertEqual((yield from dut.perfmon.nactivates.read()), 0)
+            yield from dut.perfmon.update.write(1)
+            yield
+            expected = {
+                "nactivates":          3,
+                "nprecharges":         1,
+                "nrefreshes":          1,
+                "bank0_row_hits":      2,
+                "bank0_row_misses":    0,
+                "bank1_row_conflicts": 1,
+                "bank1_row_misses":    1,
+                "read_cycles":         2,
+            }
+            for name, value in expected.items():
+                self.assertEqual((yield from getattr(dut.perfmon, name).read()), value, name)
+
+            # Counters cleared on update
+            yield from dut.perfmon.update.write(1)
+            yield
+            for name in expected.keys():
+                self.assertEqual((yield from getattr(dut.perfmon, name).read()), 0, name)
+
+        dut = PerformanceMonitorDUT()
+        run_simulation(dut, main_generator(dut))
+
+    def test_latency_histogram(self):
+        # Verify that request-to-data latencies are accumulated in power-of-two buckets.
+        read_latencies  = [1, 5, 5, 12, 300]
+        write_latencies = [3]
+
+        def main_generator(dut):
+            port = dut.port
+            yield port.cmd.ready.eq(1)
+            for we, latencies, data in [(0, read_latencies, port.rdata), (1, write_latencies, port.wdata)]:
+                for latency in latencies:
+                    yield port.cmd.valid.eq(1)
+                    yield port.cmd.we.eq(we)
+                    yield
+                    yield port.cmd.valid.eq(0)
+                    for _ in range(latency - 1):
+                        yield
+                    yield data.valid.eq(1)
+                    yield data.ready.eq(1)
+                    yield
+                    yield data.valid.eq(0)
+                    yield data.ready.eq(0)
+            yield from dut.histogram.update.write(1)
+            yield
+            read_buckets, write_buckets = [], []
+            for i in range(8):
+                read_buckets.append((yield from getattr(dut.histogram, "read_bucket{}".format(i)).read()))
+                write_buckets.append((yield from getattr(dut.histogram, "write_bucket{}".format(i)).read()))
+            self.assertEqual(read_buckets,  [1, 0, 2, 1, 0, 0, 0, 1])
+            self.assertEqual(write_buckets, [0, 1, 0, 0, 0, 0, 0, 0])
+
+        class DUT(Module):
+            def __init__(self):
+                self.port = LiteDRAMNativePort("both", address_width=16, data_width=32)
+                self.submodules.histogram = LatencyHistogram(self.port)
+
+        dut = DUT()
+        run_simulation(dut, main_generator(dut))
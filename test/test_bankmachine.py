@@ -5,12 +5,15 @@
 # SPDX-License-Identifier: BSD-2-Clause
 
 import math
+import random
 import unittest
 
 from migen import *
 
+from litex.soc.interconnect import stream
+
 from litedram.common import *
-from litedram.core.bankmachine import BankMachine
+from litedram.core.bankmachine import BankMachine, CommandPool
 
 from test.common import timeout_generator
 
@@ -21,6 +24,12 @@ class BankMachineDUT(Module):
         cmd_buffer_depth    = 8,
         cmd_buffer_buffered = False,
         with_auto_precharge = True,
+        cmd_reorder_depth   = 0,
+        cmd_reorder_age     = 16,
+        cmd_burst_max       = 1,
+        page_policy         = "open",
+        page_idle_timeout   = 16,
+        page_hit_threshold  = 2,
     )
     default_phy_settings = dict(
         cwl          = 2,
@@ -110,7 +119,7 @@ class TestBankMachine(unittest.TestCase):
     def test_init(self):
         BankMachineDUT(1)
 
-    def bankmachine_commands_test(self, dut, requests, generators=None):
+    def bankmachine_commands_test(self, dut, requests, generators=None, in_order=True):
         # Perform a test by simulating requests producer and return registered commands
         commands = []
 
@@ -118,6 +127,8 @@ class TestBankMachine(unittest.TestCase):
             for req in requests:
                 yield dut.bankmachine.req.addr.eq(req["addr"])
                 yield dut.bankmachine.req.we.eq(req["we"])
+                if "len" in req:
+                    yield dut.bankmachine.req.len.eq(req["len"])
                 yield dut.bankmachine.req.valid.eq(1)
                 yield
                 while not (yield dut.bankmachine.req.ready):
@@ -132,7 +143,15 @@ class TestBankMachine(unittest.TestCase):
                     signal = dut.bankmachine.req.wdata_ready
                 else:
                     signal = dut.bankmachine.req.rdata_valid
-                while not (yield signal):
+                for _ in range(req.get("len", 0) + 1):
+                    while not (yield signal):
+                        yield
+                    yield
+
+        def req_consumer_any_order(dut):
+            for req in requests:
+                while not ((yield dut.bankmachine.req.wdata_ready) or
+                           (yield dut.bankmachine.req.rdata_valid)):
                     yield
                 yield
 
@@ -149,7 +168,7 @@ class TestBankMachine(unittest.TestCase):
 
         all_generators = [
             producer(dut),
-            req_consumer(dut),
+            req_consumer(dut) if in_order else req_consumer_any_order(dut),
             cmd_consumer(dut),
             timeout_generator(50 * len(requests)),
         ]
@@ -241,6 +260,36 @@ class TestBankMachine(unittest.TestCase):
         ]
         self.assertEqual(commands, expected)
 
+    def test_burst(self):
+        # Verify that a burst request issues its CASes at consecutive columns, auto-precharge only
+        # being used on the last one.
+        settings = dict(cmd_burst_max=4)
+        dut      = BankMachineDUT(1, controller_settings=settings)
+        requests = [
+            dict(addr=dut.req_address(row=0xba, col=0x10), we=0, len=3),
+            dict(addr=dut.req_address(row=0xda, col=0x20), we=1, len=1),
+        ]
+        commands = self.bankmachine_commands_test(dut=dut, requests=requests)
+        commands = [(cmd["type"], cmd["a"]) for cmd in commands]
+        expected = [
+            ("activate",  0xba),
+            ("read",      0x10 << dut.address_align),
+            ("read",      0x11 << dut.address_align),
+            ("read",      0x12 << dut.address_align),
+            ("read",     (0x13 << dut.address_align) | (1 << 10)),
+            ("activate",  0xda),
+            ("write",     0x20 << dut.address_align),
+            ("write",     0x21 << dut.address_align),
+        ]
+        self.assertEqual(commands, expected)
+
+    def test_burst_check(self):
+        # Bursts can't be longer than a row or be used with command reordering.
+        with self.assertRaises(ValueError):
+            BankMachineDUT(1, controller_settings=dict(cmd_burst_max=2**10))
+        with self.assertRaises(ValueError):
+            BankMachineDUT(1, controller_settings=dict(cmd_burst_max=4, cmd_reorder_depth=4))
+
     def test_write_different_rows_without_auto_precharge(self):
         # Verify that auto-precharge is used when changing row without delay.
         settings = dict(with_auto_precharge=False)
@@ -355,6 +404,19 @@ class TestBankMachine(unittest.TestCase):
             time_expected   = 32,
             timing_settings = timing_settings)
 
+    def test_timing_runtime(self):
+        # Timings given as Signals (runtime timing CSRs) are enforced as the static timings.
+        for name, from_cmd, to_cmd, ts in [
+            ("tRCD", "activate",  "write",    [3, 5]),
+            ("tRP",  "precharge", "activate", [3, 5]),
+            ("tRC",  "activate",  "activate", [16, 24])]:
+            for t in ts:
+                with self.subTest(name=name, t=t):
+                    self.timing_test(from_cmd, to_cmd,
+                        time_expected       = t,
+                        controller_settings = dict(with_auto_precharge=False),
+                        timing_settings     = {name: Signal(8, reset=t)})
+
     def test_refresh(self):
         # Verify that no commands are issued during refresh and after it the row is re-activated.
         @passive
@@ -428,3 +490,265 @@ class TestBankMachine(unittest.TestCase):
         self.bankmachine_commands_test(dut=dut, requests=requests, generators=[cmd_checker])
         # Bankmachine does not produce refresh commands
         self.assertEqual(checked, {"activate", "precharge", "write", "read"})
+
+    def test_reorder_row_hit_first(self):
+        # Verify that with a reorder window, a row hit is served before an older row miss.
+        settings = dict(cmd_reorder_depth=4)
+        dut = BankMachineDUT(1, controller_settings=settings, timing_settings=dict(tRCD=8))
+        requests = [
+            dict(addr=dut.req_address(row=0xba, col=0x01), we=1),
+            dict(addr=dut.req_address(row=0xda, col=0x01), we=0),
+            dict(addr=dut.req_address(row=0xba, col=0x02), we=1),
+        ]
+        commands = self.bankmachine_commands_test(dut=dut, requests=requests, in_order=False)
+        commands = [(cmd["type"], cmd["a"]) for cmd in commands]
+        expected = [
+            ("activate",  0xba),
+            ("write",     0x01 << dut.address_align),
+            ("write",    (0x02 << dut.address_align) | (1 << 10)),
+            ("activate",  0xda),
+            ("read",      0x01 << dut.address_align),
+        ]
+        self.assertEqual(commands, expected)
+
+    def test_reorder_keeps_data_order(self):
+        # Verify that reads (and writes) are never reordered between themselves, nor accesses to
+        # the same address.
+        settings = dict(cmd_reorder_depth=4)
+        dut = BankMachineDUT(1, controller_settings=settings, timing_settings=dict(tRCD=8))
+        requests = [
+            dict(addr=dut.req_address(row=0xba, col=0x01), we=0),
+            dict(addr=dut.req_address(row=0xda, col=0x01), we=0),
+            dict(addr=dut.req_address(row=0xba, col=0x02), we=0),
+            dict(addr=dut.req_address(row=0xda, col=0x01), we=1),
+        ]
+        commands = self.bankmachine_commands_test(dut=dut, requests=requests, in_order=False)
+        commands = [(cmd["type"], cmd["a"] & ~(1 << 10)) for cmd in commands]
+        expected = [
+            ("activate",  0xba),
+            ("read",      0x01 << dut.address_align),
+            ("precharge", 0x01 << dut.address_align),
+            ("activate",  0xda),
+            ("read",      0x01 << dut.address_align),
+            ("write",     0x01 << dut.address_align),
+            ("activate",  0xba),
+            ("read",      0x02 << dut.address_align),
+        ]
+        self.assertEqual(commands, expected)
+
+    def test_reorder_age_limit(self):
+        # Verify that the oldest request is not bypassed more than cmd_reorder_age times.
+        settings = dict(cmd_reorder_depth=8, cmd_reorder_age=2, with_auto_precharge=False)
+        dut = BankMachineDUT(1, controller_settings=settings, timing_settings=dict(tRCD=8))
+        requests = [dict(addr=dut.req_address(row=0xba, col=0x01), we=1)]
+        requests += [dict(addr=dut.req_address(row=0xda, col=0x01), we=0)]
+        requests += [dict(addr=dut.req_address(row=0xba, col=i), we=1) for i in range(2, 6)]
+        commands = self.bankmachine_commands_test(dut=dut, requests=requests, in_order=False)
+        commands = [(cmd["type"], cmd["a"]) for cmd in commands]
+        expected = [
+            ("activate",  0xba),
+            ("write",     0x01 << dut.address_align),
+            ("write",     0x02 << dut.address_align),
+            ("write",     0x03 << dut.address_align),
+            ("precharge", 0x01 << dut.address_align),
+            ("activate",  0xda),
+            ("read",      0x01 << dut.address_align),
+            ("precharge", 0x04 << dut.address_align),
+            ("activate",  0xba),
+            ("write",     0x04 << dut.address_align),
+            ("write",     0x05 << dut.address_align),
+        ]
+        self.assertEqual(commands, expected)
+
+    def test_adaptive_page_policy_random(self):
+        # Verify that an idle row is precharged early when it has not been hit.
+        for page_policy in ["open", "adaptive"]:
+            with self.subTest(page_policy=page_policy):
+                settings = dict(page_policy=page_policy, page_idle_timeout=8)
+                dut      = BankMachineDUT(1, controller_settings=settings)
+                requests = [
+                    dict(addr=dut.req_address(row=0xba, col=0xad), we=1, delay=32),
+                    dict(addr=dut.req_address(row=0xda, col=0xad), we=1, delay=32),
+                ]
+                commands = self.bankmachine_commands_test(dut=dut, requests=requests)
+                commands = [(cmd["type"], cmd["a"] & (1 << 10)) for cmd in commands]
+                expected = {
+                    "open": [
+                        ("activate",  0),
+                        ("write",     0),
+                        ("precharge", 0),
+                        ("activate",  0),
+                        ("write",     0),
+                    ],
+                    "adaptive": [
+                        ("activate",  0),
+                        ("write",     0),
+                        ("precharge", 0),
+                        ("activate",  0),
+                        ("write",     0),
+                        ("precharge", 0),
+                    ],
+                }[page_policy]
+                self.assertEqual(commands, expected)
+
+    def test_adaptive_page_policy_streaming(self):
+        # Verify that an idle row is kept open when it has been hit.
+        settings = dict(page_policy="adaptive", page_idle_timeout=8)
+        dut      = BankMachineDUT(1, controller_settings=settings)
+        requests = [dict(addr=dut.req_address(row=0xba, col=i), we=1) for i in range(4)]
+        requests[-1]["delay"] = 32
+        requests += [dict(addr=dut.req_address(row=0xba, col=4), we=1, delay=32)]
+        commands = self.bankmachine_commands_test(dut=dut, requests=requests)
+        commands = [(cmd["type"], cmd["a"]) for cmd in commands]
+        expected = [("activate", 0xba)] + [("write", i << dut.address_align) for i in range(5)]
+        self.assertEqual(commands, expected)
+
+    def test_adaptive_page_policy_early_precharge_timing(self):
+        # Verify that the row is closed after page_idle_timeout cycles of inactivity.
+        @passive
+        def precharge_checker(dut):
+            cmd = dut.bankmachine.cmd
+            while not ((yield cmd.valid) and (yield cmd.ready) and (yield cmd.cas)):
+                yield
+            time = 0
+            while not ((yield cmd.valid) and (yield cmd.ras) and (yield cmd.we)):
+                yield
+                time += 1
+            times.append(time)
+
+        times    = []
+        settings = dict(page_policy="adaptive", page_idle_timeout=12)
+        dut      = BankMachineDUT(1, controller_settings=settings)
+        requests = [dict(addr=dut.req_address(row=0xba, col=0xad), we=1, delay=32)]
+        self.bankmachine_commands_test(dut=dut, requests=requests, generators=[precharge_checker])
+        self.assertEqual(len(times), 1)
+        self.assertGreaterEqual(times[0], 12)
+        self.assertLessEqual(times[0], 12 + 2)
+
+    def command_pool_test(self, requests, depth, bank_limit, consumers_ready=True):
+        # Push per-bank requests (list of (we, addr)) to a CommandPool and collect the output.
+        dut = CommandPool(nbanks=len(requests), address_width=16, depth=depth, bank_limit=bank_limit)
+        rng = random.Random(42)
+        received = [[] for _ in requests]
+        accepted = [0 for _ in requests]
+
+        def producer(n):
+            sink = dut.sinks[n]
+            for we, addr in requests[n]:
+                while rng.randrange(3) == 0:
+                    yield
+                yield sink.valid.eq(1)
+                yield sink.we.eq(we)
+                yield sink.addr.eq(addr)
+                yield
+                for _ in range(256):
+                    if (yield sink.ready):
+                        break
+                    yield
+                else:
+                    break # Stalled (consumers not ready).
+                accepted[n] += 1
+                yield sink.valid.eq(0)
+            for _ in range(64):
+                yield
+
+        @passive
+        def consumer(n):
+            source = dut.sources[n]
+            while True:
+                ready = consumers_ready and rng.randrange(2)
+                yield source.ready.eq(ready)
+                yield
+                if ready and (yield source.valid):
+                    received[n].append(((yield source.we), (yield source.addr)))
+
+        generators = [producer(n) for n in range(len(requests))]
+        generators += [consumer(n) for n in range(len(requests))]
+        generators += [timeout_generator(2000)]
+        run_simulation(dut, generators)
+        return accepted, received
+
+    def test_command_pool_order(self):
+        # Verify that requests of each bank are forwarded in order and none is lost.
+        rng      = random.Random(0)
+        requests = [[(rng.randrange(2), rng.randrange(2**16)) for _ in range(32)] for _ in range(4)]
+        requests[3] = requests[3][:4]
+        _, received = self.command_pool_test(requests, depth=8, bank_limit=4)
+        self.assertEqual(received, requests)
+
+    def test_command_pool_bank_limit(self):
+        # Verify that a stalled bank cannot take more than bank_limit entries of the pool, leaving
+        # room for the other banks.
+        requests = [[(0, i) for i in range(16)] for _ in range(2)]
+        accepted, _ = self.command_pool_test(requests, depth=8, bank_limit=4, consumers_ready=False)
+        # bank_limit pool entries + 1 in the per-bank head register.
+        self.assertEqual(accepted, [4 + 1, 4 + 1])
+
+    def test_command_pool_bankmachines(self):
+        # Verify that a pool of 4 entries shared by 4 BankMachines replaces their per-bank FIFOs
+        # and still provides the lookahead used for auto-precharge.
+        class DUT(Module):
+            def __init__(self, nbanks=4):
+                self.bankmachines = []
+                for n in range(nbanks):
+                    bm = BankMachineDUT(n, controller_settings=dict(cmd_pool_depth=4))
+                    self.submodules += bm
+                    self.bankmachines.append(bm)
+                self.address_width = self.bankmachines[0].address_width
+                self.submodules.pool = CommandPool(nbanks, self.address_width, depth=4)
+                for n, bm in enumerate(self.bankmachines):
+                    req = bm.bankmachine.req
+                    self.comb += [
+                        req.valid.eq(self.pool.sources[n].valid),
+                        self.pool.sources[n].ready.eq(req.ready),
+                        req.we.eq(self.pool.sources[n].we),
+                        req.addr.eq(self.pool.sources[n].addr),
+                    ]
+
+        def fifos(bm):
+            return [m for _, m in bm.bankmachine._submodules if isinstance(m, stream.SyncFIFO)]
+
+        dut = DUT()
+        self.assertEqual(len(fifos(BankMachineDUT(0))), 1)
+        for bm in dut.bankmachines:
+            self.assertEqual(fifos(bm), [])
+        commands = [[] for _ in dut.bankmachines]
+
+        def producer(dut):
+            # Two writes to different rows on each bank.
+            for n, bm in enumerate(dut.bankmachines):
+                for row in [0xba, 0xda]:
+                    sink = dut.pool.sinks[n]
+                    yield sink.valid.eq(1)
+                    yield sink.we.eq(1)
+                    yield sink.addr.eq(bm.req_address(row=row, col=0xad))
+                    yield
+                    while not (yield sink.ready):
+                        yield
+                    yield sink.valid.eq(0)
+
+        @passive
+        def cmd_consumer(bm, commands):
+            cmd = bm.bankmachine.cmd
+            yield cmd.ready.eq(1)
+            while True:
+                if (yield cmd.valid):
+                    c = yield from bm.get_cmd()
+                    if c["type"] != "nop":
+                        commands.append((c["type"], c["a"]))
+                yield
+
+        def checker(dut):
+            while any(len(c) < 4 for c in commands):
+                yield
+
+        run_simulation(dut, [producer(dut), checker(dut), timeout_generator(500)] +
+            [cmd_consumer(bm, c) for bm, c in zip(dut.bankmachines, commands)])
+        align = dut.bankmachines[0].address_align
+        for c in commands:
+            self.assertEqual(c, [
+                ("activate",  0xba),
+                ("write",    (0xad << align) | (1 << 10)),
+                ("activate",  0xda),
+                ("write",     0xad << align),
+            ])
@@ -16,10 +16,10 @@ from test.common import CmdRequestRWDriver
 
 
 class CommandChooserDUT(Module):
-    def __init__(self, n_requests, addressbits, bankbits):
+    def __init__(self, n_requests, addressbits, bankbits, pipelined=False):
         self.requests = [stream.Endpoint(cmd_request_rw_layout(a=addressbits, ba=bankbits))
                          for _ in range(n_requests)]
-        self.submodules.chooser = _CommandChooser(self.requests)
+        self.submodules.chooser = _CommandChooser(self.requests, pipelined)
 
         self.drivers = [CmdRequestRWDriver(req, i) for i, req in enumerate(self.requests)]
 
@@ -143,7 +143,7 @@ class TestCommandChooser(unittest.TestCase):
         dut = CommandChooserDUT(n_requests=4, bankbits=3, addressbits=13)
         run_simulation(dut, main_generator(dut))
 
-    def selection_test(self, requests, expected_order, wants):
+    def selection_test(self, requests, expected_order, wants, pipelined=False, prefer=0):
         # Set requests to given states and tests whether they are being connected
         # to chooser.cmd in the expected order. Using `ba` value to distinguish
         # requests (as initialised in CommandChooserDUT).
@@ -151,6 +151,7 @@ class TestCommandChooser(unittest.TestCase):
         def main_generator(dut):
             for want in wants:
                 yield getattr(dut.chooser, want).eq(1)
+            yield dut.chooser.prefer.eq(prefer)
 
             yield from dut.set_requests(requests)
             yield
@@ -174,7 +175,7 @@ class TestCommandChooser(unittest.TestCase):
                 yield
 
         assert len(requests) == 8
-        dut = CommandChooserDUT(n_requests=8, bankbits=3, addressbits=13)
+        dut = CommandChooserDUT(n_requests=8, bankbits=3, addressbits=13, pipelined=pipelined)
         run_simulation(dut, main_generator(dut))
 
     @unittest.skip("Issue #174")
@@ -224,3 +225,44 @@ class TestCommandChooser(unittest.TestCase):
         requests = "pr_aa_pw"
         order    = "0670670"
         self.selection_test(requests, order, wants=["want_cmds", "want_writes"])
+
+    def test_selects_preferred(self):
+        # Preferred requests are selected on the next arbitration (the current selection is kept
+        # until accepted), preference for non-valid requests has no effect.
+        for pipelined in [False, True]:
+            with self.subTest(pipelined=pipelined):
+                self.selection_test("rp_awrrw", "056565", wants=["want_reads"],
+                    pipelined=pipelined, prefer=0b01100000)
+                self.selection_test("rp_awrrw", "0560560", wants=["want_reads"],
+                    pipelined=pipelined, prefer=0b00000110)
+
+    def test_pipelined_selection(self):
+        # Verify that pipelined arbitration selects requests in the same order.
+        self.selection_test("w_rawpwr", "0460460",   wants=["want_writes"], pipelined=True)
+        self.selection_test("rp_awrrw", "0560560",   wants=["want_reads"], pipelined=True)
+        self.selection_test("pr_aa_pw", "034603460", wants=["want_cmds", "want_activates"],
+            pipelined=True)
+        self.selection_test("pr_aa_pw", "0670670",   wants=["want_cmds", "want_writes"], pipelined=True)
+
+    def test_pipelined_latency(self):
+        # Verify that pipelined arbitration takes one more cycle to select a new request, but never
+        # selects a request that is not valid anymore.
+        def main_generator(dut, latencies):
+            yield dut.chooser.want_cmds.eq(1)
+            yield from dut.set_requests("_p__")
+            latency = 0
+            yield
+            while not (yield dut.chooser.cmd.valid):
+                latency += 1
+                yield
+            self.assertEqual((yield dut.chooser.cmd.ba), 1)
+            yield from dut.set_requests("____")
+            yield
+            self.assertEqual((yield dut.chooser.cmd.valid), 0)
+            latencies.append(latency)
+
+        latencies = []
+        for pipelined in [False, True]:
+            dut = CommandChooserDUT(n_requests=4, bankbits=3, addressbits=13, pipelined=pipelined)
+            run_simulation(dut, main_generator(dut, latencies))
+        self.assertEqual(latencies, [1, 2])
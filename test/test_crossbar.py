@@ -103,6 +103,7 @@ class ControllerStub:
             # Latch the command to the internal buffer
             cmd_addr = (yield bank.addr)
             cmd_we = (yield bank.we)
+            cmd_len = (yield bank.len) if hasattr(bank, "len") else 0
             # Lock the buffer as soon as command is valid on the interface.
             # We do this 1 cycle after we see the command, but BankMachine
             # also has latency, because cmd_buffer_lookahead.source must
@@ -122,23 +123,25 @@ class ControllerStub:
             yield
             # After READ/WRITE has been issued, this is signalized by using
             # rdata_valid/wdata_ready. The actual data will appear with latency.
-            if cmd_we:  # WRITE
-                yield bank.wdata_ready.eq(1)
-                yield
-                yield bank.wdata_ready.eq(0)
-                # Send a request to the data_handler, it will check what
-                # has been sent from the crossbar port.
-                wdata = self.W(bank=n, addr=cmd_addr,
-                               data=None, we=None)  # to be filled in callback
-                self._waiting.append(self.WaitingData(data=wdata, delay=self.write_latency))
-            else:  # READ
-                yield bank.rdata_valid.eq(1)
-                yield
-                yield bank.rdata_valid.eq(0)
-                # Send a request with "data from memory" to the data_handler
-                rdata = self.R(bank=n, addr=cmd_addr, data=next(self._read_data))
-                # Decrease latecy, as data_handler sets data with 1 cycle delay
-                self._waiting.append(self.WaitingData(data=rdata, delay=self.read_latency - 1))
+            # Bursts issue a READ/WRITE per beat.
+            for beat in range(cmd_len + 1):
+                if cmd_we:  # WRITE
+                    yield bank.wdata_ready.eq(1)
+                    yield
+                    yield bank.wdata_ready.eq(0)
+                    # Send a request to the data_handler, it will check what
+                    # has been sent from the crossbar port.
+                    wdata = self.W(bank=n, addr=cmd_addr + beat,
+                                   data=None, we=None)  # to be filled in callback
+                    self._waiting.append(self.WaitingData(data=wdata, delay=self.write_latency))
+                else:  # READ
+                    yield bank.rdata_valid.eq(1)
+                    yield
+                    yield bank.rdata_valid.eq(0)
+                    # Send a request with "data from memory" to the data_handler
+                    rdata = self.R(bank=n, addr=cmd_addr + beat, data=next(self._read_data))
+                    # Decrease latecy, as data_handler sets data with 1 cycle delay
+                    self._waiting.append(self.WaitingData(data=rdata, delay=self.read_latency - 1))
             # At this point cmd_buffer.source.ready has been activated and the
             # command in internal buffer has been discarded. The lock will be
             self._multiplexer_lock = None
@@ -149,6 +152,7 @@ class ControllerStub:
 class CrossbarDUT(Module):
     default_controller_settings = dict(
         cmd_buffer_depth = 8,
+        cmd_burst_max    = 1,
         address_mapping  = "ROW_BANK_COL",
     )
     default_phy_settings = dict(
@@ -191,16 +195,23 @@ class CrossbarDUT(Module):
         self.submodules.crossbar = LiteDRAMCrossbar(self.interface)
 
     def addr_port(self, bank, row, col):
-        # construct an address the way port master would do it
-        assert self.settings.address_mapping == "ROW_BANK_COL"
+        # construct an address the way port master would do it (bank includes rank in its MSBs)
+        mapping = self.settings.address_mapping
         aa = self.address_align
         cb = self.settings.geom.colbits
         rb = self.settings.geom.rowbits
-        bb = self.settings.geom.bankbits
+        bb = self.settings.geom.bankbits + log2_int(self.settings.phy.nranks)
+        kb = log2_int(self.settings.phy.nranks)
         col  = (col  & (2**cb - 1)) >> aa
-        bank = (bank & (2**bb - 1)) << (cb - aa)
-        row  = (row  & (2**rb - 1)) << (cb + bb - aa)
-        return row | bank | col
+        row  = (row  & (2**rb - 1))
+        bank = (bank & (2**bb - 1))
+        if mapping == "ROW_BANK_COL_XOR":
+            bank = bank ^ (row & (2**bb - 1))
+        if mapping == "ROW_BANK_RANK_COL":
+            bank = ((bank << kb) | (bank >> (bb - kb))) & (2**bb - 1)
+        if mapping == "BANK_ROW_COL":
+            return (bank << (cb + rb - aa)) | (row << (cb - aa)) | col
+        return (row << (cb + bb - aa)) | (bank << (cb - aa)) | col
 
     def addr_iface(self, row, col):
         # construct address the way bankmachine should receive it
@@ -233,16 +244,18 @@ class TestCrossbar(unittest.TestCase):
         run_simulation(dut, generators)
         return controller.data
 
+    address_mappings = ["ROW_BANK_COL", "BANK_ROW_COL", "ROW_BANK_COL_XOR", "ROW_BANK_RANK_COL"]
+
     def test_available_address_mappings(self):
-        # Check that the only supported address mapping is ROW_BANK_COL (if we start supporting new
-        # mappings, then update these tests to also test these other mappings).
+        # Check that the supported address mappings can be used and that unknown ones are rejected
+        # (if we start supporting new mappings, then update these tests to also test them).
         def finalize_crossbar(mapping):
             dut = CrossbarDUT(controller_settings=dict(address_mapping=mapping))
             dut.crossbar.get_port()
             dut.crossbar.finalize()
 
-        for mapping in ["ROW_BANK_COL", "BANK_ROW_COL"]:
-            if mapping in ["ROW_BANK_COL"]:
+        for mapping in self.address_mappings + ["COL_ROW_BANK"]:
+            if mapping in self.address_mappings:
                 finalize_crossbar(mapping)
             else:
                 with self.assertRaises(KeyError):
@@ -250,6 +263,17 @@ class TestCrossbar(unittest.TestCase):
 
     def test_address_mappings(self):
         # Verify that address is translated correctly.
+        for mapping in self.address_mappings:
+            with self.subTest(mapping=mapping):
+                self.address_mapping_test(mapping)
+
+    def test_address_mappings_multirank(self):
+        # Verify that address is translated correctly when rank bits are present.
+        for mapping in self.address_mappings:
+            with self.subTest(mapping=mapping):
+                self.address_mapping_test(mapping, nranks=2)
+
+    def address_mapping_test(self, mapping, nranks=1):
         reads = []
 
         def producer(dut, driver):
@@ -264,18 +288,22 @@ class TestCrossbar(unittest.TestCase):
                     raise TypeError(t["rw"])
 
         geom_settings = dict(colbits=10, rowbits=13, bankbits=2)
-        dut  = CrossbarDUT(geom_settings=geom_settings)
+        dut  = CrossbarDUT(
+            controller_settings = dict(address_mapping=mapping),
+            phy_settings        = dict(nranks=nranks),
+            geom_settings       = geom_settings)
         port = dut.crossbar.get_port()
         driver = NativePortDriver(port)
+        rank = (nranks - 1) << geom_settings["bankbits"]
         transfers = [
-            dict(rw=self.W, bank=2, row=0x30, col=0x03, data=0x20),
-            dict(rw=self.W, bank=3, row=0x30, col=0x03, data=0x21),
-            dict(rw=self.W, bank=2, row=0xab, col=0x03, data=0x22),
-            dict(rw=self.W, bank=2, row=0x30, col=0x13, data=0x23),
-            dict(rw=self.R, bank=1, row=0x10, col=0x99),
-            dict(rw=self.R, bank=0, row=0x10, col=0x99),
-            dict(rw=self.R, bank=1, row=0xcd, col=0x99),
-            dict(rw=self.R, bank=1, row=0x10, col=0x77),
+            dict(rw=self.W, bank=2,        row=0x30, col=0x03, data=0x20),
+            dict(rw=self.W, bank=3 | rank, row=0x30, col=0x03, data=0x21),
+            dict(rw=self.W, bank=2,        row=0xab, col=0x03, data=0x22),
+            dict(rw=self.W, bank=2 | rank, row=0x30, col=0x13, data=0x23),
+            dict(rw=self.R, bank=1,        row=0x10, col=0x99),
+            dict(rw=self.R, bank=0 | rank, row=0x10, col=0x99),
+            dict(rw=self.R, bank=1,        row=0xcd, col=0x99),
+            dict(rw=self.R, bank=1 | rank, row=0x10, col=0x77),
         ]
         expected = []
         read_data = ControllerStub.read_data_counter()
@@ -391,6 +419,254 @@ class TestCrossbar(unittest.TestCase):
         ]
         self.assertEqual(data, expected)
 
+    def qos_test(self, qos_a, qos_b, n_a=8, n_b=2, delay_b=4, urgent_b=None):
+        # Master A streams writes to bank 1, master B starts writing to the same bank after delay_b
+        # cycles. Returns the order in which the writes have been sent.
+        def master_a(dut, driver):
+            adr = functools.partial(dut.addr_port, row=1, col=1)
+            for i in range(n_a):
+                yield from driver.write(adr(bank=1), data=0x10 + i, wait_data=False)
+            yield from driver.wait_all()
+
+        def master_b(dut, driver):
+            adr = functools.partial(dut.addr_port, row=2, col=2)
+            for _ in range(delay_b):
+                yield
+            if urgent_b is not None:
+                yield urgent_b.eq(1)
+            for i in range(n_b):
+                yield from driver.write(adr(bank=1), data=0x20 + i, wait_data=False)
+            yield from driver.wait_all()
+
+        dut     = CrossbarDUT()
+        ports   = [dut.crossbar.get_port(**qos_a), dut.crossbar.get_port(**qos_b)]
+        drivers = [NativePortDriver(port) for port in ports]
+        masters = [master_a(dut, drivers[0]), master_b(dut, drivers[1])]
+        data    = self.crossbar_test(dut, masters + drivers[0].generators() + drivers[1].generators(),
+            timeout=1000)
+        return [d.data for d in data]
+
+    def test_qos_priority(self):
+        # Without QoS, master B waits for master A to release the bank; with a higher priority,
+        # master A is preempted once its pending commands are done.
+        self.assertEqual(self.qos_test({}, {}),
+            [0x10, 0x11, 0x12, 0x13, 0x14, 0x15, 0x16, 0x17, 0x20, 0x21])
+        self.assertEqual(self.qos_test({}, dict(priority=1)),
+            [0x10, 0x20, 0x21, 0x11, 0x12, 0x13, 0x14, 0x15, 0x16, 0x17])
+
+    def test_qos_urgent(self):
+        # An urgent master preempts masters of any priority.
+        urgent = Signal()
+        self.assertEqual(self.qos_test(dict(priority=15), dict(urgent=urgent), urgent_b=urgent),
+            [0x10, 0x20, 0x21, 0x11, 0x12, 0x13, 0x14, 0x15, 0x16, 0x17])
+
+    def test_qos_weight(self):
+        # Masters with the same priority yield the bank after issuing weight commands.
+        self.assertEqual(self.qos_test(dict(weight=2), dict(weight=2), n_b=8, delay_b=0),
+            [0x10, 0x11, 0x20, 0x21, 0x12, 0x13, 0x22, 0x23,
+             0x14, 0x15, 0x24, 0x25, 0x16, 0x17, 0x26, 0x27])
+
+    def test_qos_csr(self):
+        # QoS can be exposed in a CSR, initialized with the port configuration.
+        dut = CrossbarDUT()
+        dut.crossbar.get_port()
+        dut.crossbar.get_port(priority=3, weight=4, with_qos_csr=True)
+        csrs = dut.crossbar.get_csrs()
+        self.assertEqual([csr.name for csr in csrs], ["port1_qos"])
+        self.assertEqual(csrs[0].storage.reset.value, 3 | (4 << 8))
+        with self.assertRaises(ValueError):
+            dut.crossbar.get_port(priority=16)
+
+    def test_reorder_read_bank_parallelism(self):
+        # Verify that a port with reorder_depth issues reads to another bank while the first bank is
+        # busy, and that read data is returned in request order.
+        def master(dut, driver):
+            adr = functools.partial(dut.addr_port, row=1, col=1)
+            yield from driver.read(adr(bank=0), wait_data=False)
+            yield from driver.read(adr(bank=1), wait_data=False)
+            yield from driver.wait_all()
+
+        for reorder_depth in [0, 4]:
+            with self.subTest(reorder_depth=reorder_depth):
+                delays = iter([16, 2])
+                dut    = CrossbarDUT()
+                port   = dut.crossbar.get_port(reorder_depth=reorder_depth)
+                driver = NativePortDriver(port)
+                data   = self.crossbar_test(dut, [master(dut, driver)] + driver.generators(),
+                    cmd_delay=lambda: next(delays))
+                banks  = [d.bank for d in data]
+                if reorder_depth:
+                    # Bank 1 has been served first, but data order is kept on the port.
+                    self.assertEqual(banks, [1, 0])
+                    self.assertEqual(driver.rdata, [0x11, 0x10])
+                else:
+                    self.assertEqual(banks, [0, 1])
+                    self.assertEqual(driver.rdata, [0x10, 0x11])
+
+    def test_reorder_stress_single_master(self):
+        # Test communication of a reordering port with random bank latencies.
+        prng = random.Random(42)
+        dut  = CrossbarDUT()
+        port = dut.crossbar.get_port(reorder_depth=8)
+        def master(driver):
+            for i in range(32):
+                addr = dut.addr_port(bank=prng.randrange(4), row=1, col=i << dut.address_align)
+                if prng.randrange(2):
+                    yield from driver.write(addr, data=i, wait_data=False)
+                else:
+                    yield from driver.read(addr, wait_data=False)
+            yield from driver.wait_all()
+        driver = NativePortDriver(port)
+        data   = self.crossbar_test(dut, [master(driver)] + driver.generators(), timeout=2000,
+            cmd_delay=lambda: prng.randrange(1, 16))
+        reads  = [d for d in data if isinstance(d, self.R)]
+        writes = [d for d in data if isinstance(d, self.W)]
+        # Read data has to be received in request order (col), whatever the order on the datapath.
+        read_addrs = [{d.data: d.addr for d in reads}[data] for data in driver.rdata]
+        self.assertEqual(len(read_addrs), len(reads))
+        self.assertEqual(read_addrs, sorted(read_addrs))
+        for w in writes:
+            self.assertEqual(w.addr & (2**(dut.settings.geom.colbits - dut.address_align) - 1), w.data)
+
+    def test_reorder_depth_check(self):
+        dut = CrossbarDUT()
+        with self.assertRaises(ValueError):
+            dut.crossbar.get_port(reorder_depth=3)
+
+    def test_tagged_port_out_of_order(self):
+        # Verify that a tagged port returns read data as soon as it is available with the ID of its
+        # command, while keeping the reads with the same ID in order.
+        ids = []
+        def master(dut, port, driver):
+            adr = functools.partial(dut.addr_port, row=1, col=1)
+            for id, bank in [(0, 0), (1, 1), (0, 1)]:
+                yield port.cmd.id.eq(id)
+                yield from driver.read(adr(bank=bank), wait_data=False)
+            yield from driver.wait_all()
+
+        @passive
+        def monitor(port):
+            while True:
+                if (yield port.rdata.valid):
+                    ids.append((yield port.rdata.id))
+                yield
+
+        delays = iter([16, 2, 2])
+        dut    = CrossbarDUT()
+        port   = dut.crossbar.get_port(reorder_depth=4, id_width=2)
+        driver = NativePortDriver(port)
+        data   = self.crossbar_test(dut, [master(dut, port, driver), monitor(port)] + driver.generators(),
+            cmd_delay=lambda: next(delays))
+        # ID 1 completes before ID 0, the second read with ID 0 waits for the first one.
+        self.assertEqual([d.bank for d in data], [1, 0, 1])
+        self.assertEqual(ids, [1, 0, 0])
+        self.assertEqual(driver.rdata, [0x10, 0x11, 0x12])
+
+    def test_tagged_port_stress(self):
+        # Test a tagged port with random IDs and bank latencies: reads with the same ID have to be
+        # received in request order.
+        prng    = random.Random(42)
+        dut     = CrossbarDUT()
+        port    = dut.crossbar.get_port(reorder_depth=8, id_width=2)
+        driver  = NativePortDriver(port)
+        rdata   = []
+        issued  = defaultdict(list)
+        def master():
+            for i in range(32):
+                id = prng.randrange(4)
+                issued[id].append(i)
+                yield port.cmd.id.eq(id)
+                addr = dut.addr_port(bank=prng.randrange(4), row=1, col=i << dut.address_align)
+                yield from driver.read(addr, wait_data=False)
+            yield from driver.wait_all()
+
+        @passive
+        def monitor():
+            while True:
+                if (yield port.rdata.valid):
+                    rdata.append(((yield port.rdata.id), (yield port.rdata.data)))
+                yield
+
+        data  = self.crossbar_test(dut, [master(), monitor()] + driver.generators(), timeout=2000,
+            cmd_delay=lambda: prng.randrange(1, 16))
+        col   = {d.data: d.addr & (2**(dut.settings.geom.colbits - dut.address_align) - 1) for d in data}
+        self.assertEqual(len(rdata), 32)
+        for id in range(4):
+            self.assertEqual([col[d] for i, d in rdata if i == id], issued[id])
+
+    def test_tagged_port_check(self):
+        dut = CrossbarDUT()
+        with self.assertRaises(ValueError):
+            dut.crossbar.get_port(id_width=2)
+        with self.assertRaises(ValueError):
+            dut.crossbar.get_port(id_width=2, reorder_depth=4, clock_domain="other")
+        port = dut.crossbar.get_port(id_width=2, reorder_depth=4)
+        self.assertEqual(len(port.cmd.id), 2)
+        self.assertEqual(len(port.rdata.id), 2)
+
+    def test_burst(self):
+        # Verify that with command bursts, a port command is forwarded to the bank as a single
+        # request and that the data of each beat is routed to/from the port.
+        dut    = CrossbarDUT(controller_settings=dict(cmd_burst_max=4))
+        port   = dut.crossbar.get_port()
+        driver = NativePortDriver(port)
+        def master(dut, driver):
+            adr = functools.partial(dut.addr_port, bank=2, row=1)
+            yield port.cmd.len.eq(3)
+            yield from driver.read(adr(col=4 << dut.address_align), wait_data=False)
+            yield port.cmd.len.eq(1)
+            yield port.cmd.we.eq(1)
+            yield port.cmd.addr.eq(adr(col=8 << dut.address_align))
+            yield port.cmd.valid.eq(1)
+            yield
+            while not (yield port.cmd.ready):
+                yield
+            yield port.cmd.valid.eq(0)
+            # Burst beats are requested back to back.
+            for data in [0x20, 0x21]:
+                yield port.wdata.valid.eq(1)
+                yield port.wdata.data.eq(data)
+                yield port.wdata.we.eq(0xff)
+                yield
+                while not (yield port.wdata.ready):
+                    yield
+            yield port.wdata.valid.eq(0)
+            while len(driver.rdata) < 4:
+                yield
+
+        self.assertEqual(len(port.cmd.len), 2)
+        data   = self.crossbar_test(dut, [master(dut, driver), driver.read_data_handler()])
+        reads  = [d for d in data if isinstance(d, self.R)]
+        writes = [d for d in data if isinstance(d, self.W)]
+        col    = lambda d: d.addr & (2**(dut.settings.geom.colbits - dut.address_align) - 1)
+        self.assertEqual([(d.bank, col(d)) for d in reads], [(2, 4), (2, 5), (2, 6), (2, 7)])
+        self.assertEqual(driver.rdata, [0x10, 0x11, 0x12, 0x13])
+        self.assertEqual([(d.bank, col(d), d.data) for d in writes], [(2, 8, 0x20), (2, 9, 0x21)])
+
+    def test_write_buffer(self):
+        # Verify that a port with a write buffer merges the writes to the same address and serves
+        # the reads hitting the buffer.
+        def master(dut, driver):
+            adr = dut.addr_port(bank=1, row=1, col=1)
+            yield from driver.write(adr, data=0x10)
+            yield from driver.write(adr, data=0x20)
+            yield from driver.read(adr)
+            for _ in range(32):  # Let the buffer drain.
+                yield
+
+        dut    = CrossbarDUT()
+        port   = dut.crossbar.get_port(write_buffer_depth=4, write_buffer_timeout=8)
+        driver = NativePortDriver(port)
+        data   = self.crossbar_test(dut, [master(dut, driver)] + driver.generators())
+        self.assertEqual(driver.rdata, [0x20])
+        self.assertEqual([d.data for d in data], [0x20])
+        self.assertIsInstance(data[0], self.W)
+
+    def test_write_buffer_mode_check(self):
+        dut = CrossbarDUT()
+        with self.assertRaises(ValueError):
+            dut.crossbar.get_port(mode="read", write_buffer_depth=4)
+
     def crossbar_stress_test(self, dut, ports, n_banks, n_ops, clocks=None):
         # Runs simulation with multiple masters writing and reading to multiple banks
         controller = ControllerStub(dut.interface,
@@ -175,3 +175,187 @@ class TestDMA(MemoryTestDataMixin, unittest.TestCase):
         # Verify DMAReader with a buffered FIFO.
         data = self.pattern_test_data["32bit_long_sequential"]
         self.dma_reader_test(data["pattern"], data["expected"], data_width=32, fifo_buffered=True)
+
+    # Strided ------------------------------------------------------------------------------------
+
+    def test_dma_address_generator(self):
+        # Verify that the address generator generates a 3D region, one address per cycle (also
+        # across line/plane boundaries), with last on the last address.
+        dut = ResetInserter()(LiteDRAMDMAAddressGenerator(address_width=32))
+        addresses = []
+        def generator(dut):
+            yield dut.reset.eq(1)
+            yield dut.base.eq(4)
+            yield dut.width.eq(2)
+            yield dut.height.eq(3)
+            yield dut.depth.eq(2)
+            yield dut.pitch.eq(8)
+            yield dut.plane_pitch.eq(64)
+            yield dut.source.ready.eq(1)
+            yield
+            yield dut.reset.eq(0)
+            while not (yield dut.source.valid):
+                yield
+            while not (yield dut.done):
+                self.assertEqual((yield dut.source.valid), 1)
+                addresses.append(((yield dut.source.address), (yield dut.source.last)))
+                yield
+
+        run_simulation(dut, generator(dut))
+        lines = [4, 12, 20, 68, 76, 84]
+        self.assertEqual([a for a, _ in addresses], [l + x for l in lines for x in range(2)])
+        self.assertEqual([l for _, l in addresses], [0]*11 + [1])
+
+    def test_dma_reader_strided(self):
+        # Verify DMAReader reading a 2D strided region.
+        class DUT(Module):
+            def __init__(self):
+                self.port = LiteDRAMNativeReadPort(address_width=32, data_width=32)
+                self.submodules.dma = LiteDRAMDMAReader(self.port)
+                self.dma.add_strided_csr(default_base=0x10, default_width=0xc, default_height=3,
+                    default_pitch=0x40)
+
+        dut    = DUT()
+        driver = DMAReaderDriver(dut.dma)
+        mem    = DRAMMemory(32, 64, init=list(range(64)))
+
+        def enable(dut):
+            yield dut.dma._enable.storage.eq(1)
+            yield
+            while not (yield dut.dma._done.status):
+                yield
+            while len(driver.data) < 9:
+                yield
+
+        run_simulation(dut, [enable(dut), driver.read_handler(), mem.read_handler(dut.port)])
+        self.assertEqual(driver.data, [4, 5, 6, 20, 21, 22, 36, 37, 38])
+
+    # Scatter-gather -------------------------------------------------------------------------------
+
+    def dma_sg_test(self, dma_cls, port_cls, descriptors, mem, generators):
+        class DUT(Module):
+            def __init__(self):
+                self.port      = port_cls(address_width=32, data_width=128)
+                self.desc_port = LiteDRAMNativePort("both", address_width=32, data_width=128)
+                self.submodules.dma = dma_cls(self.port)
+                self.dma.add_scatter_gather(self.desc_port, with_irq=False)
+
+        # Descriptors are chained from address 0, one per 128-bit word.
+        for n, (address, length, control) in enumerate(descriptors):
+            mem.mem[n] = address | (length << 32) | ((n + 1)*16 << 64) | (control << 96)
+
+        irqs = []
+        @passive
+        def irq_handler(dut):
+            while True:
+                if (yield dut.dma.sg.irq):
+                    irqs.append((yield dut.dma.sg.count)) # Index of the descriptor.
+                yield
+
+        def enable(dut):
+            yield dut.dma._enable.storage.eq(1)
+            yield
+            while not (yield dut.dma._done.status):
+                yield
+            self.assertEqual((yield dut.dma._count.status), len(descriptors))
+
+        dut = DUT()
+        run_simulation(dut, [
+            enable(dut),
+            irq_handler(dut),
+            mem.read_handler(dut.desc_port),
+            mem.write_handler(dut.desc_port),
+            *generators(dut),
+        ])
+        return irqs
+
+    def test_dma_reader_scatter_gather(self):
+        # Verify that DMAReader reads the buffers of the descriptors chain in order, marks their
+        # last word and writes back their status.
+        mem = DRAMMemory(128, 64, init=[0]*16 + list(range(0x100, 0x100 + 48)))
+        descriptors = [
+            (0x100, 0x20, DMA_DESC_OWN),
+            (0x200, 0x10, DMA_DESC_OWN | DMA_DESC_IRQ),
+            (0x300, 0x30, DMA_DESC_OWN | DMA_DESC_LAST),
+            (0x000, 0x10, DMA_DESC_OWN), # Not reached.
+        ]
+        data = []
+        @passive
+        def read_handler(dut):
+            yield dut.dma.source.ready.eq(1)
+            while True:
+                if (yield dut.dma.source.valid):
+                    data.append(((yield dut.dma.source.data), (yield dut.dma.source.last)))
+                yield
+
+        irqs = self.dma_sg_test(LiteDRAMDMAReader, LiteDRAMNativeReadPort, descriptors[:3], mem,
+            lambda dut: [read_handler(dut), mem.read_handler(dut.port)])
+        self.assertEqual(data, [
+            (0x100, 0), (0x101, 1),
+            (0x110, 1),
+            (0x120, 0), (0x121, 0), (0x122, 1),
+        ])
+        self.assertEqual(irqs, [1])
+        for n, (address, length, control) in enumerate(descriptors[:3]):
+            self.assertEqual(mem.mem[n] >> 32,
+                length | ((n + 1)*16 << 32) | ((control & ~DMA_DESC_OWN) << 64))
+
+    def test_dma_reader_scatter_gather_empty(self):
+        # Verify that an empty descriptor is completed without words, even with backpressure on
+        # the DMA output.
+        mem = DRAMMemory(128, 64, init=[0]*16 + list(range(0x100, 0x100 + 48)))
+        descriptors = [
+            (0x100, 0x20, DMA_DESC_OWN),
+            (0x200, 0x00, DMA_DESC_OWN),
+            (0x300, 0x30, DMA_DESC_OWN | DMA_DESC_LAST),
+        ]
+        data = []
+        @passive
+        def read_handler(dut):
+            for _ in range(80):
+                yield
+            yield dut.dma.source.ready.eq(1)
+            while True:
+                if (yield dut.dma.source.valid) & (yield dut.dma.source.ready):
+                    data.append(((yield dut.dma.source.data), (yield dut.dma.source.last)))
+                yield
+
+        self.dma_sg_test(LiteDRAMDMAReader, LiteDRAMNativeReadPort, descriptors, mem,
+            lambda dut: [read_handler(dut), mem.read_handler(dut.port)])
+        self.assertEqual(data, [
+            (0x100, 0), (0x101, 1),
+            (0x120, 0), (0x121, 0), (0x122, 1),
+        ])
+        for n, (address, length, control) in enumerate(descriptors):
+            self.assertEqual(mem.mem[n] >> 32,
+                length | ((n + 1)*16 << 32) | ((control & ~DMA_DESC_OWN) << 64))
+
+    def test_dma_writer_scatter_gather(self):
+        # Verify that DMAWriter writes the data to the buffers of the descriptors chain, a packet
+        # end ending the current buffer, and writes back their status.
+        mem = DRAMMemory(128, 64)
+        descriptors = [
+            (0x100, 0x20, DMA_DESC_OWN),
+            (0x200, 0x20, DMA_DESC_OWN),
+            (0x300, 0x20, DMA_DESC_OWN | DMA_DESC_LAST | DMA_DESC_IRQ),
+        ]
+        def writer(dut):
+            for data, last in [(0xa0, 0), (0xa1, 0), (0xa2, 1), (0xb0, 1)]:
+                yield dut.dma.sink.valid.eq(1)
+                yield dut.dma.sink.data.eq(data)
+                yield dut.dma.sink.last.eq(last)
+                yield
+                while not (yield dut.dma.sink.ready):
+                    yield
+            yield dut.dma.sink.valid.eq(0)
+
+        irqs = self.dma_sg_test(LiteDRAMDMAWriter, LiteDRAMNativeWritePort, descriptors, mem,
+            lambda dut: [writer(dut), mem.write_handler(dut.port)])
+        self.assertEqual(mem.mem[16:18] + mem.mem[32:33] + mem.mem[48:49], [0xa0, 0xa1, 0xa2, 0xb0])
+        self.assertEqual(irqs, [2])
+        for n, (length, control) in enumerate([
+            (0x20, DMA_DESC_OWN),
+            (0x10, DMA_DESC_OWN | DMA_DESC_EOP),
+            (0x10, DMA_DESC_OWN | DMA_DESC_LAST | DMA_DESC_IRQ | DMA_DESC_EOP)]):
+            self.assertEqual(mem.mem[n] >> 32,
+                length | ((n + 1)*16 << 32) | ((control & ~DMA_DESC_OWN) << 64))
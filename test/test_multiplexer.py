@@ -39,20 +39,43 @@ class BankMachineStub:
         self.cmd = stream.Endpoint(cmd_request_rw_layout(a=abits, ba=babits))
         self.refresh_req = Signal()
         self.refresh_gnt = Signal()
+        # Performance monitor events
+        self.row_hit_event      = Signal()
+        self.row_miss_event     = Signal()
+        self.row_conflict_event = Signal()
 
 
 class RefresherStub:
-    def __init__(self, babits, abits):
+    def __init__(self, babits, abits, per_bank=False):
         self.cmd = stream.Endpoint(cmd_request_rw_layout(a=abits, ba=babits))
+        if per_bank:
+            self.per_bank = True
+            self.bank     = Signal(babits)
+            self.bank_req = Signal()
+            self.idle     = Signal()
 
 
 class MultiplexerDUT(Module):
     # Define default settings that can be overwritten in specific tests use only these settings
     # that we actually need for Multiplexer.
     default_controller_settings = dict(
-        read_time      = 32,
-        write_time     = 16,
-        with_bandwidth = False,
+        read_time           = 32,
+        write_time          = 16,
+        write_drain_high    = None,
+        write_drain_low     = 0,
+        with_fast_rtw       = False,
+        read_priority       = False,
+        write_age_limit     = 64,
+        with_sched_csrs     = False,
+        with_bandwidth      = False,
+        with_perfmon        = False,
+        cmd_choosers        = 1,
+        cmd_burst_max       = 1,
+        with_cmd_pipeline   = False,
+        rank_switch_penalty = 2,
+        with_dynamic_odt    = False,
+        powerdown_timeout   = None,
+        selfrefresh_timeout = None,
     )
     default_phy_settings = dict(
         nphases      = 2,
@@ -84,7 +107,8 @@ class MultiplexerDUT(Module):
         controller_settings = None,
         phy_settings        = None,
         geom_settings       = None,
-        timing_settings     = None):
+        timing_settings     = None,
+        refresher_per_bank  = False):
         # Update settings if provided
         def updated(settings, update):
             copy = settings.copy()
@@ -115,7 +139,7 @@ class MultiplexerDUT(Module):
         nranks = settings.phy.nranks
         self.bank_machines = [BankMachineStub(abits=abits, babits=babits)
                               for _ in range(nbanks*nranks)]
-        self.refresher = RefresherStub(abits=abits, babits=babits)
+        self.refresher = RefresherStub(abits=abits, babits=babits, per_bank=refresher_per_bank)
         self.dfi = dfi.Interface(
             addressbits = abits,
             bankbits    = babits,
@@ -178,6 +202,171 @@ class TestMultiplexer(unittest.TestCase):
         dut = MultiplexerDUT()
         run_simulation(dut, main_generator(dut))
 
+    def test_fsm_read_to_write_fast_latency(self):
+        # Verify the timing of READ to WRITE transition when computed from CL/CWL.
+        def main_generator(dut):
+            # cl + BL/2 + 2 - cwl + rdphase - wrphase = 6 + 4 + 2 - 5 + 2 - 3 = 6 DRAM cycles
+            expected = "r" + ">" + "w"
+            states = ""
+
+            # Set write_available=1
+            yield from dut.bm_drivers[0].write()
+            yield
+
+            for _ in range(len(expected)):
+                state = (yield from dut.fsm_state())
+                states += {
+                    "READ": "r",
+                    "WRITE": "w",
+                }.get(state, ">")
+                yield
+
+            self.assertEqual(states, expected)
+
+        phy_settings = dict(
+            nphases      = 4,
+            rdphase      = 2,
+            wrphase      = 3,
+            cl           = 6,
+            cwl          = 5,
+            read_latency = 8,
+            dfi_databits = 4*16,
+            memtype      = "DDR3",
+        )
+        dut = MultiplexerDUT(controller_settings=dict(with_fast_rtw=True), phy_settings=phy_settings)
+        run_simulation(dut, main_generator(dut))
+
+    def test_fsm_write_drain(self):
+        # Verify that writes are drained between the high and low watermarks.
+        def main_generator(dut):
+            yield from dut.bm_drivers[0].read()
+            yield from dut.bm_drivers[1].write()
+            yield from dut.bm_drivers[2].write()
+            yield
+
+            # High watermark reached: READ -> RTW -> WRITE even though reads are available
+            for _ in range(2):
+                yield
+            self.assertNotEqual((yield from dut.fsm_state()), "READ")
+            while (yield from dut.fsm_state()) != "WRITE":
+                yield
+
+            # Stay in WRITE until the low watermark is reached
+            for _ in range(4):
+                self.assertEqual((yield from dut.fsm_state()), "WRITE")
+                yield
+            yield from dut.bm_drivers[2].nop()
+            yield
+            yield
+            self.assertEqual((yield from dut.fsm_state()), "WTR")
+
+        settings = dict(write_drain_high=2, write_drain_low=1)
+        dut = MultiplexerDUT(controller_settings=settings)
+        generators = [
+            main_generator(dut),
+            timeout_generator(50),
+        ]
+        run_simulation(dut, generators)
+
+    def test_fsm_read_priority(self):
+        # With read priority, writes are held in READ until they are aged or the high watermark is
+        # reached, even when no reads are available.
+        def main_generator(dut):
+            yield from dut.bm_drivers[1].write()
+            for _ in range(7):
+                yield
+                self.assertEqual((yield from dut.fsm_state()), "READ")
+            yield
+            yield
+            self.assertNotEqual((yield from dut.fsm_state()), "READ")
+            while (yield from dut.fsm_state()) != "WRITE":
+                yield
+            yield from dut.bm_drivers[0].read()
+            yield from dut.bm_drivers[1].nop()
+            while (yield from dut.fsm_state()) != "READ":
+                yield
+
+            # High watermark reached: switch without waiting for the age limit
+            yield from dut.bm_drivers[1].write()
+            yield from dut.bm_drivers[2].write()
+            yield
+            yield
+            yield
+            self.assertNotEqual((yield from dut.fsm_state()), "READ")
+
+        settings = dict(read_priority=True, write_age_limit=8, write_drain_high=2)
+        dut = MultiplexerDUT(controller_settings=settings)
+        generators = [
+            main_generator(dut),
+            timeout_generator(100),
+        ]
+        run_simulation(dut, generators)
+
+    def test_fsm_sched_csrs(self):
+        # Write age limit can be changed at runtime (0: writes only issued at the high watermark).
+        def main_generator(dut):
+            yield dut.multiplexer._write_drain_high.storage.eq(2)
+            yield dut.multiplexer._write_age_limit.storage.eq(0)
+            yield from dut.bm_drivers[1].write()
+            for _ in range(32):
+                yield
+                self.assertEqual((yield from dut.fsm_state()), "READ")
+            yield dut.multiplexer._write_age_limit.storage.eq(4)
+            for _ in range(6):
+                yield
+            self.assertNotEqual((yield from dut.fsm_state()), "READ")
+
+        settings = dict(read_priority=True, with_sched_csrs=True)
+        dut = MultiplexerDUT(controller_settings=settings)
+        generators = [
+            main_generator(dut),
+            timeout_generator(100),
+        ]
+        run_simulation(dut, generators)
+
+    def test_fsm_read_priority_no_limit(self):
+        # With read priority but neither drain high watermark nor write age limit, writes must
+        # still be issued when no read is available (static settings and runtime CSRs).
+        def main_generator(dut):
+            yield from dut.bm_drivers[1].write()
+            while (yield from dut.fsm_state()) != "WRITE":
+                yield
+            yield from dut.bm_drivers[1].nop()
+            yield from dut.bm_drivers[0].read()
+            while (yield from dut.fsm_state()) != "READ":
+                yield
+
+        for settings in [
+            dict(read_priority=True, write_age_limit=0),
+            dict(read_priority=True, write_age_limit=0, with_sched_csrs=True),
+            ]:
+            with self.subTest(settings=settings):
+                dut = MultiplexerDUT(controller_settings=settings)
+                generators = [
+                    main_generator(dut),
+                    timeout_generator(50),
+                ]
+                run_simulation(dut, generators)
+
+    def test_perfmon_rtw_cycles(self):
+        # Verify that the RTW cycles counted by the performance monitor are the cycles spent in
+        # the read to write turnaround states.
+        def main_generator(dut):
+            yield from dut.bm_drivers[0].write()
+            while (yield from dut.fsm_state()) != "WRITE":
+                yield
+            for _ in range(8):
+                yield
+            perfmon = dut.multiplexer.perfmon
+            yield from perfmon.update.write(1)
+            yield
+            rtw = dut.settings.phy.read_latency - 1
+            self.assertEqual((yield from perfmon.rtw_cycles.read()), rtw)
+            self.assertEqual((yield from perfmon.wtr_cycles.read()), 0)
+
+        dut = MultiplexerDUT(controller_settings=dict(with_perfmon=True))
+        run_simulation(dut, [main_generator(dut), timeout_generator(100)])
+
     def test_fsm_write_to_read_latency(self):
         # Verify the timing of WRITE to READ transition.
         def main_generator(dut):
@@ -265,6 +454,50 @@ class TestMultiplexer(unittest.TestCase):
         ]
         run_simulation(dut, generators)
 
+    def test_steer_multiple_cmds(self):
+        # Check that additional command choosers issue commands on the free phases in the same
+        # cycle, ACTs only being issued on the command phase.
+        requests = {2: "r", 3: "a", 4: "a", 5: "p", 6: "p"}
+        dfi_cmds = []
+
+        def bm_generator(dut, n, request):
+            yield from dut.bm_drivers[n].request(request)
+            yield
+            while not (yield dut.bank_machines[n].cmd.ready):
+                yield
+            yield from dut.bm_drivers[n].nop()
+            for _ in range(4):
+                yield
+
+        @passive
+        def dfi_monitor(dut):
+            while True:
+                cmds = []
+                for i, p in enumerate(dut.dfi.phases):
+                    cmd = dfi_cmd_to_char((yield p.cas_n), (yield p.ras_n), (yield p.we_n))
+                    if cmd != "_":
+                        cmds.append((i, cmd, (yield p.bank)))
+                if cmds:
+                    dfi_cmds.append(cmds)
+                yield
+
+        dut = MultiplexerDUT(
+            controller_settings = dict(cmd_choosers=3),
+            phy_settings        = dict(nphases=4, rdphase=2, wrphase=3, rdcmdphase=1, wrcmdphase=2))
+        generators = [bm_generator(dut, n, request) for n, request in requests.items()]
+        generators += [dfi_monitor(dut), timeout_generator(50)]
+        run_simulation(dut, generators)
+
+        issued = sorted((bank, cmd) for cmds in dfi_cmds for _, cmd, bank in cmds)
+        self.assertEqual(issued, sorted(requests.items()))
+        self.assertEqual(len(dfi_cmds[0]), 3)
+        for cmds in dfi_cmds:
+            for phase, cmd, bank in cmds:
+                if cmd == "a":
+                    self.assertEqual(phase, dut.settings.phy.rdcmdphase)
+                if cmd == "p":
+                    self.assertIn(phase, [dut.settings.phy.rdcmdphase, 3, 0])
+
     def test_single_phase_cmd_req(self):
         # Verify that, for a single phase, commands are sent sequentially.
         def main_generator(dut):
@@ -318,12 +551,17 @@ class TestMultiplexer(unittest.TestCase):
 
             self.assertEqual(ras_time, 6)
 
-        dut = MultiplexerDUT(timing_settings=dict(tRRD=6))
-        generators = [
-            main_generator(dut),
-            timeout_generator(50),
-        ]
-        run_simulation(dut, generators)
+        # Timings are also kept with pipelined command arbitration.
+        for with_cmd_pipeline in [False, True]:
+            with self.subTest(with_cmd_pipeline=with_cmd_pipeline):
+                dut = MultiplexerDUT(
+                    controller_settings = dict(with_cmd_pipeline=with_cmd_pipeline),
+                    timing_settings     = dict(tRRD=6))
+                generators = [
+                    main_generator(dut),
+                    timeout_generator(50),
+                ]
+                run_simulation(dut, generators)
 
     def test_cas_tccd(self):
         # Verify tCCD.
@@ -350,12 +588,17 @@ class TestMultiplexer(unittest.TestCase):
 
             self.assertEqual(cas_time, 3)
 
-        dut = MultiplexerDUT(timing_settings=dict(tCCD=3))
-        generators = [
-            main_generator(dut),
-            timeout_generator(50),
-        ]
-        run_simulation(dut, generators)
+        # Timings are also kept with pipelined command arbitration.
+        for with_cmd_pipeline in [False, True]:
+            with self.subTest(with_cmd_pipeline=with_cmd_pipeline):
+                dut = MultiplexerDUT(
+                    controller_settings = dict(with_cmd_pipeline=with_cmd_pipeline),
+                    timing_settings     = dict(tCCD=3))
+                generators = [
+                    main_generator(dut),
+                    timeout_generator(50),
+                ]
+                run_simulation(dut, generators)
 
     def test_fsm_anti_starvation(self):
         # Check that anti-starvation works according to controller settings.
@@ -482,6 +725,58 @@ class TestMultiplexer(unittest.TestCase):
         dut = MultiplexerDUT()
         run_simulation(dut, main_generator(dut))
 
+    def test_per_bank_refresh_requires_bank_gnt(self):
+        # With a per-bank refresher, only the bank machine of the refreshed bank is requested
+        # and the other bank machines keep being serviced after the refresh commands.
+        def main_generator(dut):
+            def assert_dfi_cmd(cas, ras, we):
+                p = dut.dfi.phases[0]
+                cas_n, ras_n, we_n = (yield p.cas_n), (yield p.ras_n), (yield p.we_n)
+                self.assertEqual((cas_n, ras_n, we_n), (1 - cas, 1 - ras, 1 - we))
+
+            yield dut.refresher.bank.eq(3)
+            yield dut.refresher.bank_req.eq(1)
+            yield from dut.refresh_driver.refresh()
+            yield
+
+            # Only the refreshed bank machine gets the request
+            for n, bm in enumerate(dut.bank_machines):
+                self.assertEqual((yield bm.refresh_req), int(n == 3))
+            yield from assert_dfi_cmd(cas=0, ras=0, we=0)
+
+            # Other bank machines granting permission have no effect
+            for n, bm in enumerate(dut.bank_machines):
+                if n != 3:
+                    yield bm.refresh_gnt.eq(1)
+            for _ in range(4):
+                yield
+                self.assertNotEqual((yield from dut.fsm_state()), "REFRESH")
+
+            # Refreshed bank machine grants permission
+            yield dut.bank_machines[3].refresh_gnt.eq(1)
+            yield
+            yield
+            self.assertEqual((yield from dut.fsm_state()), "REFRESH")
+            yield
+
+            # Refresh command
+            yield from assert_dfi_cmd(cas=1, ras=1, we=0)
+
+        dut = MultiplexerDUT(refresher_per_bank=True)
+        run_simulation(dut, main_generator(dut))
+
+    def test_refresher_idle(self):
+        # Refresher is notified when no bank machine has a pending command.
+        def main_generator(dut):
+            yield
+            self.assertEqual((yield dut.refresher.idle), 1)
+            yield from dut.bm_drivers[2].read()
+            yield
+            self.assertEqual((yield dut.refresher.idle), 0)
+
+        dut = MultiplexerDUT(refresher_per_bank=True)
+        run_simulation(dut, main_generator(dut))
+
     def test_requests_from_multiple_bankmachines(self):
         # Check complex communication scenario with requests from multiple bank machines
         # The communication is greatly simplified - data path is completely ignored, no responses
@@ -9,7 +9,7 @@ import unittest
 from migen import *
 
 from litedram.core.multiplexer import cmd_request_rw_layout
-from litedram.core.refresher import RefreshSequencer, RefreshTimer, Refresher
+from litedram.core.refresher import RefreshSequencer, RefreshTimer, Refresher, PerBankRefresher
 
 
 def c2bool(c):
@@ -44,6 +44,16 @@ class TestRefresh(unittest.TestCase):
         dones    = "_____-__________"
         self.refresh_sequencer_test(trp, trfc, starts, dones, cmds)
 
+    def test_refresh_sequencer_runtime(self):
+        # Runtime tRP/tRFC (Signals) give the same sequence as the static timings.
+        class Obj: pass
+        cmds = Obj()
+        starts   = "_-______________"
+        cmds.cas = "___-____________"
+        cmds.ras = "__--____________"
+        dones    = "_____-__________"
+        self.refresh_sequencer_test(Signal(8, reset=1), Signal(8, reset=2), starts, dones, cmds)
+
     def refresh_timer_test(self, trefi):
         def generator(dut):
             dut.errors = 0
@@ -111,3 +121,274 @@ class TestRefresh(unittest.TestCase):
         for postponing in [1, 2, 4, 8]:
             with self.subTest(postponing=postponing):
                 self.refresher_test(postponing)
+
+    def test_refresh_timer_runtime(self):
+        # With a runtime tREFI (Signal), the new period is used from the next refresh.
+        def generator(dut, trefi):
+            dones = []
+            for cycle in range(512):
+                if cycle == 100:
+                    yield trefi.eq(64)
+                if (yield dut.done):
+                    dones.append(cycle)
+                yield
+            self.assertEqual(dones[:2], [127, 128 + 63])
+            self.assertEqual(set(b - a for a, b in zip(dones[1:-1], dones[2:])), {64})
+
+        class DUT(Module):
+            def __init__(self, trefi):
+                self.submodules.refresh = RefreshTimer(trefi)
+                self.comb += self.refresh.wait.eq(~self.refresh.done)
+                self.done = self.refresh.done
+
+        trefi = Signal(16, reset=128)
+        dut   = DUT(trefi)
+        run_simulation(dut, [generator(dut, trefi)])
+
+    def debt_refresher_settings(self):
+        class Obj: pass
+        settings = Obj()
+        settings.with_refresh = True
+        settings.timing = Obj()
+        settings.timing.tREFI = 128
+        settings.timing.tRP   = 1
+        settings.timing.tRFC  = 2
+        settings.timing.tZQCS = None
+        settings.geom = Obj()
+        settings.geom.addressbits = 16
+        settings.geom.bankbits    = 3
+        settings.phy = Obj()
+        settings.phy.nranks = 1
+        return settings
+
+    def debt_refresher_generator(self, dut, refreshs, ncycles, idle_cycle):
+        # Busy until idle_cycle (None: never idle), then idle: log (cycle, number of refreshs) of
+        # each cmd.valid period.
+        yield dut.cmd.ready.eq(1)
+        cycle = 0
+        while cycle < ncycles:
+            yield dut.idle.eq(idle_cycle is not None and cycle >= idle_cycle)
+            if (yield dut.cmd.valid):
+                start = cycle
+                count = 0
+                while (yield dut.cmd.valid):
+                    count += (yield dut.cmd.cas) & (yield dut.cmd.ras)
+                    cycle += 1
+                    yield
+                refreshs.append((start, count))
+            cycle += 1
+            yield
+
+    def test_refresher_debt(self):
+        # Owed refreshs are issued one at a time as soon as the controller is idle, they are only
+        # forced (back to back) when postponing refreshs are owed.
+        settings = self.debt_refresher_settings()
+        dut = Refresher(settings, clk_freq=100e6, postponing=8)
+        refreshs = []
+        run_simulation(dut, [self.debt_refresher_generator(dut, refreshs,
+            ncycles    = 8*128,
+            idle_cycle = 3*128 + 64)])
+        starts = [start for start, count in refreshs]
+        self.assertEqual([count for start, count in refreshs], [1]*len(refreshs))
+        # 3 owed refreshs issued back to back once idle, then 1 refresh every tREFI.
+        self.assertTrue(all(3*128 + 64 <= start < 3*128 + 64 + 32 for start in starts[:3]))
+        self.assertEqual([b - a for a, b in zip(starts[3:-1], starts[4:])], [128]*(len(starts) - 4))
+
+    def test_refresher_debt_forced(self):
+        # When the controller is never idle, refreshs are postponed until postponing refreshs are
+        # owed and are then forced back to back: one burst of 8 refreshs every 8 tREFI.
+        settings = self.debt_refresher_settings()
+        dut = Refresher(settings, clk_freq=100e6, postponing=8)
+        refreshs = []
+        run_simulation(dut, [self.debt_refresher_generator(dut, refreshs,
+            ncycles    = 4*8*128,
+            idle_cycle = None)])
+        starts = [start for start, count in refreshs]
+        self.assertEqual([count for start, count in refreshs], [8]*3)
+        self.assertEqual([b - a for a, b in zip(starts[:-1], starts[1:])], [8*128]*2)
+
+    def per_bank_refresher_settings(self, memtype):
+        class Obj: pass
+        settings = Obj()
+        settings.with_refresh = True
+        settings.timing = Obj()
+        settings.timing.tREFI = 256
+        settings.timing.tRP   = 1
+        settings.timing.tRFC  = 8
+        settings.timing.tRRD  = 2
+        settings.timing.tZQCS = None
+        settings.geom = Obj()
+        settings.geom.addressbits = 16
+        settings.geom.bankbits    = 3
+        settings.phy = Obj()
+        settings.phy.nranks  = 1
+        settings.phy.memtype = memtype
+        return settings
+
+    def per_bank_refresher_generator(self, dut, refreshs, idle=0):
+        # Acknowledge refresh commands and log (start, cmd.valid cycles, bank_req cycles, commands).
+        yield dut.cmd.ready.eq(1)
+        yield dut.idle.eq(idle)
+        cycle = 0
+        while len(refreshs) < 16:
+            if (yield dut.bank_req):
+                start     = cycle
+                bank      = (yield dut.rank) if dut.per_rank else (yield dut.bank)
+                cmds      = []
+                cmd_valid = 0
+                bank_req  = 0
+                while (yield dut.bank_req):
+                    cmd_valid += (yield dut.cmd.valid)
+                    bank_req  += 1
+                    if (yield dut.cmd.valid) and (yield dut.cmd.ras):
+                        cmds.append(((yield dut.cmd.cas), (yield dut.cmd.we), (yield dut.cmd.a), (yield dut.cmd.ba)))
+                    cycle += 1
+                    yield
+                refreshs.append((start, bank, cmd_valid, bank_req, cmds))
+            cycle += 1
+            yield
+
+    def test_per_bank_refresher(self):
+        # Banks are refreshed in round-robin every tREFI/nbanks, the command path is only requested
+        # for the Precharge/Refresh commands while the bank is blocked until tRFC is elapsed.
+        settings = self.per_bank_refresher_settings("LPDDR4")
+        dut = PerBankRefresher(settings, clk_freq=100e6)
+        self.assertTrue(dut.per_bank)
+        refreshs = []
+        run_simulation(dut, [self.per_bank_refresher_generator(dut, refreshs)])
+        for i, (start, bank, cmd_valid, bank_req, cmds) in enumerate(refreshs):
+            self.assertEqual(bank, i%8)
+            self.assertLess(cmd_valid, bank_req)
+            self.assertEqual(cmds, [(0, 1, 0, bank), (1, 0, 0, bank)])
+        gaps = [b[0] - a[0] for a, b in zip(refreshs[:-1], refreshs[1:])]
+        self.assertEqual(gaps, [256//8]*len(gaps))
+
+    def test_per_bank_refresher_pullin(self):
+        # When idle, up to 8 refreshs per bank are pulled-in back to back, then refreshs are issued
+        # at the regular rate.
+        settings = self.per_bank_refresher_settings("LPDDR4")
+        dut = PerBankRefresher(settings, clk_freq=100e6, pullin=1)
+        refreshs = []
+        run_simulation(dut, [self.per_bank_refresher_generator(dut, refreshs, idle=1)])
+        gaps = [b[0] - a[0] for a, b in zip(refreshs[:-1], refreshs[1:])]
+        self.assertTrue(all(gap < 256//8 for gap in gaps[:7]))
+        self.assertEqual(gaps[-3:], [256//8]*3)
+
+    def test_per_bank_refresher_all_banks(self):
+        # Memories without per-bank refresh use all-bank refreshs every tREFI.
+        settings = self.per_bank_refresher_settings("DDR3")
+        dut = PerBankRefresher(settings, clk_freq=100e6)
+        self.assertFalse(dut.per_bank)
+        refreshs = []
+        run_simulation(dut, [self.per_bank_refresher_generator(dut, refreshs)])
+        for start, bank, cmd_valid, bank_req, cmds in refreshs:
+            self.assertEqual(cmd_valid, bank_req - 1)
+            self.assertEqual(cmds, [(0, 1, 2**10, 0), (1, 0, 2**10, 0)])
+        gaps = [b[0] - a[0] for a, b in zip(refreshs[:-1], refreshs[1:])]
+        self.assertEqual(gaps, [256]*len(gaps))
+
+    def test_per_bank_refresher_per_rank(self):
+        # Multi-rank memories without per-bank refresh refresh one rank at a time every
+        # tREFI/nranks, the command path is only requested for the Precharge All/Refresh commands.
+        settings = self.per_bank_refresher_settings("DDR3")
+        settings.phy.nranks = 2
+        dut = PerBankRefresher(settings, clk_freq=100e6)
+        self.assertTrue(dut.per_rank)
+        refreshs = []
+        run_simulation(dut, [self.per_bank_refresher_generator(dut, refreshs)])
+        for i, (start, rank, cmd_valid, bank_req, cmds) in enumerate(refreshs):
+            self.assertEqual(rank, i%2)
+            self.assertLess(cmd_valid, bank_req)
+            self.assertEqual(cmds, [(0, 1, 2**10, rank << 3), (1, 0, 2**10, rank << 3)])
+        gaps = [b[0] - a[0] for a, b in zip(refreshs[:-1], refreshs[1:])]
+        self.assertEqual(gaps, [256//2]*len(gaps))
+
+    def lowpower_refresher_settings(self, powerdown_timeout, selfrefresh_timeout):
+        class Obj: pass
+        settings = Obj()
+        settings.with_refresh        = True
+        settings.powerdown_timeout   = powerdown_timeout
+        settings.selfrefresh_timeout = selfrefresh_timeout
+        settings.timing = Obj()
+        settings.timing.tREFI = 1024
+        settings.timing.tRP   = 2
+        settings.timing.tRFC  = 4
+        settings.timing.tZQCS = None
+        settings.timing.tXP   = 3
+        settings.timing.tXS   = 12
+        settings.geom = Obj()
+        settings.geom.addressbits = 16
+        settings.geom.bankbits    = 3
+        settings.phy = Obj()
+        settings.phy.nranks  = 1
+        settings.phy.nphases = 4
+        return settings
+
+    def lowpower_refresher_generator(self, dut, trace, ncycles, wake_cycle=None):
+        # Acknowledge commands, log (cke, powerdown, selfrefresh, command, cmd.last) on each cycle.
+        yield dut.cmd.ready.eq(1)
+        yield dut.idle.eq(1)
+        for cycle in range(ncycles):
+            yield dut.wake.eq(cycle == wake_cycle)
+            cmd = ""
+            if (yield dut.cmd.valid):
+                cmd = {(0, 1, 1): "p", (1, 1, 0): "f"}.get(
+                    ((yield dut.cmd.cas), (yield dut.cmd.ras), (yield dut.cmd.we)), "")
+            trace.append(((yield dut.cke), (yield dut.powerdown), (yield dut.selfrefresh), cmd,
+                (yield dut.cmd.last)))
+            yield
+
+    def test_refresher_powerdown(self):
+        # After powerdown_timeout idle cycles, all banks are precharged and CKE is driven low. On
+        # wake-up, CKE is driven high and the Controller is released after tXP.
+        settings = self.lowpower_refresher_settings(powerdown_timeout=16, selfrefresh_timeout=None)
+        dut = Refresher(settings, clk_freq=100e6)
+        trace = []
+        run_simulation(dut, [self.lowpower_refresher_generator(dut, trace, 64, wake_cycle=40)])
+        cke  = [t[0] for t in trace]
+        cmds = [(i, t[3]) for i, t in enumerate(trace) if t[3]]
+        pd_enter = cke.index(0)
+        pd_exit  = cke.index(1, pd_enter)
+        last     = [t[4] for t in trace].index(1)
+        self.assertEqual(cmds, [(pd_enter - settings.timing.tRP, "p")])
+        self.assertGreaterEqual(pd_enter, 16)
+        self.assertTrue(all(t[1] for t in trace[pd_enter:pd_exit]))
+        self.assertFalse(any(t[2] for t in trace))
+        self.assertEqual(pd_exit, 42)
+        self.assertEqual(last - pd_exit, settings.timing.tXP)
+
+    def test_refresher_selfrefresh(self):
+        # After selfrefresh_timeout idle cycles, the DRAM leaves power-down and enters self-refresh
+        # ("Auto Refresh" with CKE low). On wake-up, the Controller is released after tXS.
+        settings = self.lowpower_refresher_settings(powerdown_timeout=16, selfrefresh_timeout=48)
+        dut = Refresher(settings, clk_freq=100e6)
+        trace = []
+        run_simulation(dut, [self.lowpower_refresher_generator(dut, trace, 128, wake_cycle=96)])
+        cke  = [t[0] for t in trace]
+        cmds = [t[3] for t in trace if t[3]]
+        pd_enter = cke.index(0)
+        pd_exit  = cke.index(1, pd_enter)
+        sr_enter = cke.index(0, pd_exit)
+        sr_exit  = cke.index(1, sr_enter)
+        last     = [t[4] for t in trace].index(1)
+        self.assertEqual(cmds, ["p", "p", "f"])
+        self.assertEqual(trace[sr_enter][3], "f")
+        self.assertGreaterEqual(pd_exit - pd_enter, 48 - 16)
+        self.assertTrue(all(t[2] for t in trace[sr_enter:sr_exit]))
+        self.assertEqual(sr_exit, 98)
+        self.assertEqual(last - sr_exit, settings.timing.tXS)
+
+    def test_refresher_selfrefresh_no_debt(self):
+        # No refresh is owed for the tREFI periods spent in self-refresh: after wake-up, the DRAM
+        # is not refreshed (with CKE high) to catch up.
+        settings = self.lowpower_refresher_settings(powerdown_timeout=16, selfrefresh_timeout=48)
+        dut = Refresher(settings, clk_freq=100e6, postponing=8)
+        trace = []
+        run_simulation(dut, [self.lowpower_refresher_generator(dut, trace, 4*1024 + 256,
+            wake_cycle=4*1024 + 64)])
+        cke  = [t[0] for t in trace]
+        sr_enter = cke.index(0, cke.index(1, cke.index(0)))
+        sr_exit  = cke.index(1, sr_enter)
+        self.assertTrue(all(t[2] for t in trace[sr_enter:sr_exit]))
+        self.assertGreater(sr_exit, 4*1024)
+        self.assertEqual([t for t in trace if t[0] and t[3] == "f"], [])
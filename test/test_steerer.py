@@ -18,7 +18,7 @@ from test.common import CmdRequestRWDriver
 
 
 class SteererDUT(Module):
-    def __init__(self, nranks, dfi_databits, nphases):
+    def __init__(self, nranks, dfi_databits, nphases, **kwargs):
         a, ba         = 13, 3
         nop           = Record(cmd_request_layout(a=a, ba=ba))
         choose_cmd    = stream.Endpoint(cmd_request_rw_layout(a=a, ba=ba))
@@ -28,7 +28,7 @@ class SteererDUT(Module):
         self.commands = [nop, choose_cmd, choose_req, refresher_cmd]
         self.dfi = dfi.Interface(addressbits=a, bankbits=ba, nranks=nranks, databits=dfi_databits,
                                  nphases=nphases)
-        self.submodules.steerer = _Steerer(self.commands, self.dfi)
+        self.submodules.steerer = _Steerer(self.commands, self.dfi, **kwargs)
 
         # NOP is not an endpoint and does not have is_* signals
         self.drivers = [CmdRequestRWDriver(req, i, ep_layout=i != 0, rw_layout=i != 0)
@@ -194,6 +194,26 @@ class TestSteerer(unittest.TestCase):
         dut = SteererDUT(nranks=2, dfi_databits=16, nphases=2)
         run_simulation(dut, main_generator(dut))
 
+    def test_select_refreshed_rank(self):
+        # With per-rank refresh, the refresh command only selects the rank from `ba`.
+        def main_generator(dut):
+            yield from dut.drivers[STEER_NOP].nop()
+            yield dut.steerer.sel[0].eq(STEER_REFRESH)
+            yield dut.steerer.sel[1].eq(STEER_NOP)
+            dut.drivers[STEER_REFRESH].bank = 0b100
+            yield from dut.drivers[STEER_REFRESH].refresh()
+            yield dut.commands[STEER_REFRESH].ready.eq(1)
+            yield
+            yield
+
+            p = dut.dfi.phases[0]
+            self.assertEqual((yield p.cas_n), 0)
+            self.assertEqual((yield p.ras_n), 0)
+            self.assertEqual((yield p.cs_n),  0b01)
+
+        dut = SteererDUT(nranks=2, dfi_databits=16, nphases=2, refresh_all_ranks=False)
+        run_simulation(dut, main_generator(dut))
+
     def test_reset_n_high(self):
         # Reset_n should be 1 for all phases at all times.
         def main_generator(dut):
@@ -239,3 +259,39 @@ class TestSteerer(unittest.TestCase):
 
         dut = SteererDUT(nranks=2, dfi_databits=16, nphases=4)
         run_simulation(dut, main_generator(dut))
+
+    def test_odt_dynamic(self):
+        # With dynamic ODT, ODT is driven for odt_cycles from a WRITE on all the ranks and from a
+        # READ on the ranks not being read, and low otherwise.
+        def main_generator(dut, cmd, expected):
+            yield dut.steerer.sel[0].eq(STEER_REQ)
+            yield dut.steerer.sel[1].eq(STEER_NOP)
+            yield dut.commands[STEER_REQ].ready.eq(1)
+            dut.drivers[STEER_REQ].bank = 0b100 # rank=1
+            yield from getattr(dut.drivers[STEER_REQ], cmd)()
+            yield
+            yield from dut.drivers[STEER_REQ].nop()
+            odts = []
+            for _ in range(len(expected)):
+                yield
+                odts.append(((yield dut.dfi.phases[0].odt), (yield dut.dfi.phases[1].odt)))
+            self.assertEqual(odts, [(odt, odt) for odt in expected])
+
+        for cmd, expected in [("write", [0b11, 0b11, 0b11, 0b00]), ("read", [0b01, 0b01, 0b01, 0b00])]:
+            with self.subTest(cmd=cmd):
+                dut = SteererDUT(nranks=2, dfi_databits=16, nphases=2, odt_cycles=3)
+                run_simulation(dut, main_generator(dut, cmd, expected))
+
+    def test_cke(self):
+        # When given, CKE is driven on all the phases/ranks and registered along with the commands.
+        def main_generator(dut, cke):
+            ckes = []
+            for value in [1, 0, 0, 1]:
+                yield cke.eq(value)
+                yield
+                ckes.append(((yield dut.dfi.phases[0].cke), (yield dut.dfi.phases[1].cke)))
+            self.assertEqual(ckes, [(0b11, 0b11), (0b11, 0b11), (0b00, 0b00), (0b00, 0b00)])
+
+        cke = Signal(reset=1)
+        dut = SteererDUT(nranks=2, dfi_databits=16, nphases=2, cke=cke)
+        run_simulation(dut, main_generator(dut, cke))
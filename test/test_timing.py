@@ -9,7 +9,7 @@ import random
 
 from migen import *
 
-from litedram.common import tXXDController, tFAWController
+from litedram.common import tXXDController, tFAWController, TimingScoreboard
 
 
 def c2bool(c):
@@ -51,6 +51,30 @@ class TestTiming(unittest.TestCase):
         readys = "___--___---"
         self.txxd_controller_test(txxd, valids, readys)
 
+    def test_txxd_controller_runtime(self):
+        # With a runtime timing (Signal), the controller is ready out of reset and then behaves as
+        # with the static timing, the timing can be changed between commands.
+        txxd = Signal(8, reset=3)
+        valids = "____-______"
+        readys = "-----__----"
+        self.txxd_controller_test(txxd, valids, readys)
+
+        def generator(dut, txxd):
+            readys = ""
+            for t in [4, 2]:
+                yield txxd.eq(t)
+                yield dut.valid.eq(1)
+                yield
+                yield dut.valid.eq(0)
+                for _ in range(4):
+                    yield
+                    readys += "-" if (yield dut.ready) else "_"
+            self.assertEqual(readys, "___-" + "_---")
+
+        txxd = Signal(8, reset=3)
+        dut  = tXXDController(txxd)
+        run_simulation(dut, [generator(dut, txxd)])
+
     def txxd_controller_random_test(self, txxd, loops):
         def generator(dut, valid_rand):
             prng = random.Random(42)
@@ -120,3 +144,60 @@ class TestTiming(unittest.TestCase):
         readys = "-----------------"
         with self.subTest(tfaw=tfaw, valids=valids, readys=readys):
             self.tfaw_controller_test(tfaw, valids, readys)
+
+    def timing_scoreboard_test(self, kwargs, cmd, ba, valids, checks):
+        # Issue `cmd` ("act", "read" or "write") to bank `ba` on valids and compare the can_*
+        # signals of the banks in checks ({(can_*, bank): readys}).
+        def generator(dut):
+            dut.errors = 0
+            yield getattr(dut, "act_ba" if cmd == "act" else "cas_ba").eq(ba)
+            for i, valid in enumerate(valids):
+                yield getattr(dut, cmd).eq(c2bool(valid))
+                yield
+                for (name, bank), readys in checks.items():
+                    if (yield getattr(dut, name)[bank]) != c2bool(readys[i]):
+                        dut.errors += 1
+
+        dut = TimingScoreboard(**kwargs)
+        run_simulation(dut, [generator(dut)])
+        self.assertEqual(dut.errors, 0)
+
+    def test_timing_scoreboard(self):
+        # tRRD only applies to the banks of the same rank.
+        self.timing_scoreboard_test(dict(nbanks=16, nranks=2, tRRD=4), "act", 0,
+            valids = "_-______",
+            checks = {("can_act", 1): "--___---", ("can_act", 8): "--------"})
+        # tWTR only applies to the same rank, tCCD to all the ranks.
+        self.timing_scoreboard_test(dict(nbanks=16, nranks=2, tCCD=2, tWTR=4), "write", 0,
+            valids = "_-______",
+            checks = {
+                ("can_read",  1): "--___---",
+                ("can_read",  8): "--_-----",
+                ("can_write", 8): "--_-----",
+            })
+        # tRTP only applies to the same bank.
+        self.timing_scoreboard_test(dict(nbanks=8, tRTP=3), "read", 2,
+            valids = "_-______",
+            checks = {("can_pre", 2): "--__----", ("can_pre", 3): "--------"})
+        # Bank groups: tCCD/tRRD only apply to the same group, tCCD_S/tRRD_S to the other groups.
+        self.timing_scoreboard_test(dict(nbanks=8, ngroups=2, tCCD=3, tCCD_S=1), "read", 0,
+            valids = "_-______",
+            checks = {
+                ("can_read",      1): "--__----",
+                ("can_read",      4): "--------",
+                ("cas_alternate", 1): "________",
+                ("cas_alternate", 4): "--------",
+            })
+        self.timing_scoreboard_test(dict(nbanks=8, ngroups=2, tRRD=4, tRRD_S=2), "act", 0,
+            valids = "_-______",
+            checks = {("can_act", 1): "--___---", ("can_act", 4): "--_-----"})
+        # tRTRS only applies to the other ranks, CAS are favored to the rank of the last CAS.
+        self.timing_scoreboard_test(dict(nbanks=16, nranks=2, tRTRS=3), "write", 0,
+            valids = "_-______",
+            checks = {
+                ("can_write",     1): "--------",
+                ("can_write",     8): "--__----",
+                ("can_read",      8): "--__----",
+                ("cas_same_rank", 1): "--------",
+                ("cas_same_rank", 8): "________",
+            })